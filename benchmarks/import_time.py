@@ -0,0 +1,125 @@
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+
+"""Measure the startup cost of the devflow entry points.
+
+Every entry point module is imported in a fresh interpreter a few times, and
+the fastest import time, the number of loaded modules and whether any of the
+heavy dependencies got loaded are reported:
+
+    python benchmarks/import_time.py [--repeat N] [--output FILE]
+
+With '--output' the results are also written as JSON, so that they can be
+compared between revisions.
+
+"""
+
+import os
+import sys
+import json
+import subprocess
+
+from optparse import OptionParser
+
+TOPLEVEL = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOPLEVEL)
+
+from devflow.cli import COMMANDS  # noqa
+
+HEAVY_MODULES = ["git", "sh", "configobj"]
+
+PROBE = """
+import sys, time, json
+start = time.time()
+import %(module)s
+elapsed = time.time() - start
+json.dump({"seconds": elapsed,
+           "modules": len([m for m in sys.modules.values() if m]),
+           "heavy": [m for m in %(heavy)r if m in sys.modules]},
+          sys.stdout)
+"""
+
+
+def get_entry_modules():
+    modules = ["devflow.cli"]
+    for module, _, _ in COMMANDS.values():
+        if module not in modules:
+            modules.append(module)
+    return modules
+
+
+def measure(module, repeat):
+    """Import 'module' in 'repeat' fresh interpreters, keep the fastest."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [TOPLEVEL] + filter(None, [env.get("PYTHONPATH")]))
+    runs = []
+    for _ in range(repeat):
+        code = PROBE % {"module": module, "heavy": HEAVY_MODULES}
+        out = subprocess.check_output([sys.executable, "-c", code], env=env)
+        runs.append(json.loads(out))
+    best = min(runs, key=lambda run: run["seconds"])
+    return {"module": module,
+            "milliseconds": round(best["seconds"] * 1000, 1),
+            "modules": best["modules"],
+            "heavy": best["heavy"]}
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-n", "--repeat", dest="repeat", type="int", default=5,
+                      help="Number of imports of each module")
+    parser.add_option("-o", "--output", dest="output", default=None,
+                      help="Write the results as JSON to this file")
+    options, _ = parser.parse_args()
+
+    results = [measure(module, options.repeat)
+               for module in get_entry_modules()]
+
+    sys.stdout.write("%-20s %10s %8s  %s\n"
+                     % ("module", "ms", "modules", "heavy dependencies"))
+    for result in results:
+        sys.stdout.write("%-20s %10.1f %8d  %s\n" % (
+            result["module"], result["milliseconds"], result["modules"],
+            ", ".join(result["heavy"]) or "-"))
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump({"python": sys.version.split()[0],
+                       "repeat": options.repeat,
+                       "results": results}, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
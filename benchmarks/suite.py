@@ -0,0 +1,302 @@
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+
+"""Benchmark the devflow entry points on a synthetic repository.
+
+A repository is generated with benchmarks/synthetic.py and every entry point
+is run on it a few times, in fresh processes:
+
+    version-python       devflow-version python
+    version-debian       devflow-version debian
+    update-version       devflow-update-version
+    autopkg-dry-run      devflow-autopkg snapshot --dry-run
+    flow-feature-start   devflow-flow -d feature start
+    flow-feature-finish  devflow-flow -d feature finish
+
+For each one the fastest and the median wall time are reported, together
+with the number of git subprocesses it spawned, which is counted in a
+separate run through a 'git' wrapper placed first in the PATH. The results
+can be written to a JSON baseline and compared with an earlier one:
+
+    python benchmarks/suite.py --output baseline.json
+    python benchmarks/suite.py --compare baseline.json
+
+The commands run through 'python -m devflow.cli'. Revisions without
+devflow.cli are run through their devflow-* console scripts instead, which
+must be installed, and operations using options the revision does not
+have yet, e.g. 'devflow-autopkg --dry-run', are skipped.
+
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+
+from collections import OrderedDict
+from distutils.spawn import find_executable
+from optparse import OptionParser
+
+import synthetic
+
+TOPLEVEL = synthetic.TOPLEVEL
+
+GIT_WRAPPER = """#!/bin/sh
+echo "$1" >> "$DEVFLOW_BENCH_GIT_LOG"
+exec %s "$@"
+"""
+
+# 'devflow-flow' opens the changelog with 'editor'
+EDITOR = """#!/bin/sh
+exit 0
+"""
+
+# Groups of operations, run one after the other on every run. A feature is
+# finished before the next one starts, since they would conflict otherwise.
+OPERATIONS = [
+    [("version-python", lambda run: ["version", "python"])],
+    [("version-debian", lambda run: ["version", "debian"])],
+    [("update-version", lambda run: ["update-version"])],
+    [("autopkg-dry-run", lambda run: ["autopkg", "snapshot", "--dry-run",
+                                      "--dirty", "--color=no"])],
+    [("flow-feature-start", lambda run: ["flow", "-d", "feature", "start",
+                                         "bench-%d" % run]),
+     ("flow-feature-finish", lambda run: ["flow", "-d", "feature", "finish",
+                                          "bench-%d" % run])],
+]
+
+# Operations that need an option older revisions do not have
+REQUIRED_OPTIONS = {
+    "autopkg-dry-run": ("autopkg", "--dry-run"),
+}
+
+
+def get_command(args):
+    """Return the command line running a devflow command of the checkout."""
+    if os.path.exists(os.path.join(TOPLEVEL, "devflow", "cli.py")):
+        return [sys.executable, "-m", "devflow.cli"] + args
+    # The PYTHONPATH makes the console scripts import the checkout
+    script = find_executable("devflow-" + args[0])
+    if script is None:
+        raise RuntimeError("'devflow-%s' was not found in the PATH" % args[0])
+    return [script] + args[1:]
+
+
+def write_script(path, content):
+    with open(path, "w") as f:
+        f.write(content)
+    os.chmod(path, 0755)
+
+
+class Runner(object):
+    """Run devflow commands in a repository."""
+    def __init__(self, repo_dir, tools_dir):
+        self.repo_dir = repo_dir
+        self.git_log = os.path.join(tools_dir, "git.log")
+        self.env = dict(os.environ)
+        self.env.pop("DEVFLOW_TRACE", None)
+        self.env.pop("DEVFLOW_BUILD_MODE", None)
+        self.env["PYTHONPATH"] = os.pathsep.join(
+            [TOPLEVEL] + filter(None, [self.env.get("PYTHONPATH")]))
+        self.env["PATH"] = os.pathsep.join([os.path.join(tools_dir, "bin"),
+                                            self.env.get("PATH", "")])
+        self.counting_env = dict(self.env)
+        self.counting_env["PATH"] = os.pathsep.join(
+            [os.path.join(tools_dir, "counting"), self.env["PATH"]])
+        self.counting_env["DEVFLOW_BENCH_GIT_LOG"] = self.git_log
+
+    def supports(self, name):
+        """Check whether the devflow checkout can run an operation."""
+        if name not in REQUIRED_OPTIONS:
+            return True
+        command, option = REQUIRED_OPTIONS[name]
+        proc = subprocess.Popen(get_command([command, "--help"]),
+                                cwd=self.repo_dir, env=self.env,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        output = proc.communicate()[0]
+        return option in output
+
+    def run(self, args, env):
+        command = get_command(args)
+        with open(os.devnull, "w") as devnull:
+            start = time.time()
+            subprocess.check_call(command, cwd=self.repo_dir, env=env,
+                                  stdout=devnull, stderr=devnull)
+            return time.time() - start
+
+    def time(self, args):
+        return self.run(args, self.env)
+
+    def count_git_commands(self, args):
+        if os.path.exists(self.git_log):
+            os.unlink(self.git_log)
+        self.run(args, self.counting_env)
+        if not os.path.exists(self.git_log):
+            return 0
+        with open(self.git_log) as f:
+            return len(f.readlines())
+
+
+def setup_tools(tools_dir):
+    """Create the 'editor' and the counting 'git' wrapper."""
+    git = find_executable("git")
+    if git is None:
+        raise RuntimeError("git was not found in the PATH")
+    for subdir in ("bin", "counting"):
+        os.makedirs(os.path.join(tools_dir, subdir))
+    write_script(os.path.join(tools_dir, "bin", "editor"), EDITOR)
+    write_script(os.path.join(tools_dir, "counting", "git"),
+                 GIT_WRAPPER % git)
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def run_suite(runner, repeat):
+    results = OrderedDict()
+    for group in OPERATIONS:
+        supported = []
+        for name, get_args in group:
+            if runner.supports(name):
+                supported.append((name, get_args))
+            else:
+                sys.stdout.write("Skipping %s, which this revision does not"
+                                 " support\n" % name)
+        group = supported
+        timings = dict((name, []) for name, _ in group)
+        for run in range(repeat):
+            for name, get_args in group:
+                timings[name].append(runner.time(get_args(run)))
+        # One more run, to count the git commands
+        for name, get_args in group:
+            commands = runner.count_git_commands(get_args(repeat))
+            results[name] = OrderedDict([
+                ("min", round(min(timings[name]), 4)),
+                ("median", round(median(timings[name]), 4)),
+                ("git_commands", commands)])
+    return results
+
+
+def get_revision():
+    try:
+        return subprocess.check_output(["git", "describe", "--always",
+                                        "--dirty"], cwd=TOPLEVEL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_results(results, baseline=None):
+    header = "%-20s %9s %9s %8s" % ("operation", "min (s)", "median", "git")
+    if baseline is not None:
+        header += " %9s %8s" % ("base min", "change")
+    lines = [header]
+    for name, result in results.items():
+        line = "%-20s %9.3f %9.3f %8d" % (name, result["min"],
+                                          result["median"],
+                                          result["git_commands"])
+        old = (baseline or {}).get(name)
+        if old is not None:
+            line += " %9.3f %+7.0f%%" % (
+                old["min"], (result["min"] / old["min"] - 1) * 100)
+        elif baseline is not None:
+            line += " %9s %8s" % ("-", "-")
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options]")
+    for name, default in sorted(synthetic.DEFAULTS.items()):
+        parser.add_option("--" + name.replace("_", "-"), dest=name,
+                          type="int", default=default,
+                          help="Size of the synthetic repository."
+                               " Default: %d" % default)
+    parser.add_option("-n", "--repeat", dest="repeat", type="int", default=3,
+                      help="Number of timed runs of each operation")
+    parser.add_option("-o", "--output", dest="output", default=None,
+                      help="Write the results as JSON to this file")
+    parser.add_option("-c", "--compare", dest="compare", default=None,
+                      help="Compare the results with this JSON file")
+    parser.add_option("-k", "--keep", dest="keep", default=False,
+                      action="store_true",
+                      help="Do not delete the synthetic repository")
+    options, _ = parser.parse_args()
+
+    sizes = dict((name, getattr(options, name))
+                 for name in synthetic.DEFAULTS)
+    work_dir = tempfile.mkdtemp(prefix="devflow-bench-")
+    try:
+        repo_dir = os.path.join(work_dir, "repo")
+        tools_dir = os.path.join(work_dir, "tools")
+        start = time.time()
+        repository = synthetic.generate_repository(repo_dir, **sizes)
+        sys.stdout.write("Generated repository in %.1fs: %s\n"
+                         % (time.time() - start, json.dumps(repository)))
+        setup_tools(tools_dir)
+        results = run_suite(Runner(repo_dir, tools_dir), options.repeat)
+    finally:
+        if options.keep:
+            sys.stdout.write("Repository kept in '%s'\n" % work_dir)
+        else:
+            shutil.rmtree(work_dir)
+
+    baseline = None
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)["results"]
+    sys.stdout.write(format_results(results, baseline))
+
+    if options.output:
+        report = OrderedDict([
+            ("revision", get_revision()),
+            ("python", sys.version.split()[0]),
+            ("git", subprocess.check_output(["git", "--version"]).strip()),
+            ("repeat", options.repeat),
+            ("repository", repository),
+            ("results", results)])
+        with open(options.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
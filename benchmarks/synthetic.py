@@ -0,0 +1,222 @@
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+
+"""Generate synthetic devflow repositories with 'git fast-import'.
+
+The repositories follow the layout devflow expects: a 'develop' branch with
+the base version file and a 'devflow.conf', 'master', and a
+'debian-develop' branch with a Debian changelog. On top of that they have a
+configurable number of commits, merges, feature branches, version tags and
+'debian/*' tags, so that the cost of the devflow tools can be measured on
+histories much larger than the ones of the tests:
+
+    python benchmarks/synthetic.py --commits 5000 --debian-tags 20000 DIR
+
+"""
+
+import os
+import subprocess
+
+from optparse import OptionParser
+
+TOPLEVEL = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULTS = {
+    "commits": 2000,
+    "merges": 200,
+    "branches": 50,
+    "tags": 200,
+    "debian_tags": 5000,
+}
+
+CODENAMES = ["stretch", "buster", "bullseye", "bookworm"]
+AUTHOR = "Devflow Benchmark <bench@example.com>"
+START_TIME = 1500000000
+
+DEVFLOW_CONF = """[ packages ]
+  [[ pkg ]]
+    version_file = "pkg/version.py"
+    version_template = "version_template"
+"""
+
+CHANGELOG = """pkg (0.1-1) unstable; urgency=low
+
+  * Initial release
+
+ -- %s  Fri, 14 Jul 2017 02:40:00 +0000
+""" % AUTHOR
+
+
+class FastImportStream(object):
+    """Build the input of 'git fast-import'."""
+    def __init__(self):
+        self.chunks = []
+        self.marks = 0
+
+    def data(self, content):
+        self.chunks.append("data %d\n%s\n" % (len(content), content))
+
+    def commit(self, ref, message, files, parent=None, merge=None):
+        """Add a commit and return its mark."""
+        self.marks += 1
+        mark = self.marks
+        self.chunks.append("commit %s\nmark :%d\n" % (ref, mark))
+        self.chunks.append("committer %s %d +0000\n"
+                           % (AUTHOR, START_TIME + mark * 60))
+        self.data(message)
+        if parent is not None:
+            self.chunks.append("from :%d\n" % parent)
+        if merge is not None:
+            self.chunks.append("merge :%d\n" % merge)
+        for path, content in sorted(files.items()):
+            self.chunks.append("M 100644 inline %s\n" % path)
+            self.data(content)
+        self.chunks.append("\n")
+        return mark
+
+    def reset(self, ref, mark):
+        self.chunks.append("reset %s\nfrom :%d\n\n" % (ref, mark))
+
+    def getvalue(self):
+        return "".join(self.chunks)
+
+
+def build_stream(commits, merges, branches, tags, debian_tags):
+    """Return the fast-import stream of a repository, and its summary."""
+    stream = FastImportStream()
+    with open(os.path.join(TOPLEVEL, "version_template")) as f:
+        version_template = f.read()
+    root = stream.commit("refs/heads/develop", "Initial commit", {
+        "version": "0.15dev\n",
+        "devflow.conf": DEVFLOW_CONF,
+        "version_template": version_template,
+        "pkg/__init__.py": "",
+        # Older versions of devflow-flow only prepend to an existing one
+        "Changelog": "",
+        "counter": "0\n"})
+    stream.reset("refs/heads/master", root)
+    debian = stream.commit("refs/heads/debian-develop", "Add debian files",
+                           {"debian/changelog": CHANGELOG}, parent=root)
+
+    # A merge every 'interval' commits, of a commit made on a side branch
+    interval = max(1, commits // merges) if merges else None
+    develop = [root]
+    merged = 0
+    for i in range(1, commits):
+        head = develop[-1]
+        if interval and i % interval == 0 and merged < merges:
+            side = stream.commit("refs/heads/side", "Side change %d" % i,
+                                 {"side/%d" % (i % 100): "%d\n" % i},
+                                 parent=head)
+            mark = stream.commit("refs/heads/develop",
+                                 "Merge side change %d" % i, {},
+                                 parent=head, merge=side)
+            merged += 1
+        else:
+            mark = stream.commit("refs/heads/develop", "Change %d" % i,
+                                 {"counter": "%d\n" % i}, parent=head)
+        develop.append(mark)
+
+    def spread(count):
+        step = max(1, len(develop) // max(1, count))
+        return [develop[(k * step) % len(develop)] for k in range(count)]
+
+    for k, mark in enumerate(spread(branches)):
+        stream.reset("refs/heads/feature-synthetic-%d" % k, mark)
+    for k, mark in enumerate(spread(tags)):
+        stream.reset("refs/tags/v0.%d" % k, mark)
+    # Many revisions of many versions, for every codename
+    for k in range(debian_tags):
+        # Tags are named after the version without the '~' separators
+        version = "0.%ddev%d" % (k // 1000, k // 10)
+        revision = k % 10 + 1
+        codename = CODENAMES[(k // 10) % len(CODENAMES)]
+        tag = "debian/%s-%d%s" % (version, revision, codename)
+        stream.reset("refs/tags/" + tag, debian)
+
+    summary = {"commits": stream.marks, "merges": merged,
+               "branches": branches, "tags": tags,
+               "debian_tags": debian_tags}
+    return stream.getvalue(), summary
+
+
+def generate_repository(path, commits=DEFAULTS["commits"],
+                        merges=DEFAULTS["merges"],
+                        branches=DEFAULTS["branches"],
+                        tags=DEFAULTS["tags"],
+                        debian_tags=DEFAULTS["debian_tags"]):
+    """Create a repository in 'path' with 'develop' checked out.
+
+    Returns a summary of the generated history.
+
+    """
+    content, summary = build_stream(commits, merges, branches, tags,
+                                    debian_tags)
+    subprocess.check_call(["git", "init", "-q", path])
+
+    def git(*args, **kwargs):
+        return subprocess.check_call(["git"] + list(args), cwd=path, **kwargs)
+
+    p = subprocess.Popen(["git", "fast-import", "--quiet"], cwd=path,
+                         stdin=subprocess.PIPE)
+    p.communicate(content)
+    if p.returncode:
+        raise RuntimeError("git fast-import failed with status %d"
+                           % p.returncode)
+    git("config", "user.name", "Devflow Benchmark")
+    git("config", "user.email", "bench@example.com")
+    if summary["merges"]:
+        # The branch of the merged commits
+        git("branch", "-q", "-D", "side")
+    git("symbolic-ref", "HEAD", "refs/heads/develop")
+    git("reset", "-q", "--hard")
+    return summary
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options] directory")
+    for name, default in sorted(DEFAULTS.items()):
+        parser.add_option("--" + name.replace("_", "-"), dest=name,
+                          type="int", default=default,
+                          help="Default: %d" % default)
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("Give me the directory of the new repository")
+    summary = generate_repository(args[0], **dict(
+        (name, getattr(options, name)) for name in DEFAULTS))
+    print ", ".join("%d %s" % (summary[name], name.replace("_", " "))
+                    for name in sorted(summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -35,29 +35,29 @@
 
 import os
 import sys
+import shutil
+import tempfile
 import subprocess
-
-from git import GitCommandError
-from optparse import OptionParser
-from sh import mktemp, cd, rm  # pylint: disable=E0611
-from functools import partial
-try:
-    from sh import git_dch as gbp_dch  # pylint: disable=E0611
-    gbp_buildpackage = ['git-buildpackage']
-except ImportError:
-    # In newer versions of git-buildpackage the executables have changed.
-    # Instead of having various git-* executables, there is only a gbp one,
-    # which expects the command (dch, buildpackage, etc) as the first argument.
-    from sh import gbp  # pylint: disable=E0611
-    gbp_dch = partial(gbp, 'dch')
-    gbp_buildpackage = ['gbp', 'buildpackage']
-
+import traceback
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing import Pool
+from distutils.spawn import find_executable
+
+from devflow import buildcache
+from devflow import changelog
+from devflow import gitbackend
+from devflow import instrument
+from devflow import refs
+from devflow import sourcepkg
+from devflow import ui
 from devflow import versioning
 from devflow import utils
 from devflow import BRANCH_TYPES
 
-
 AVAILABLE_MODES = ["release", "snapshot"]
+TIMINGS_REPORT = "devflow-autopkg-timings.json"
 
 DESCRIPTION = """Tool for automatic build of Debian packages.
 
@@ -67,11 +67,12 @@ repositories that follow the `git flow` development model
 
 This script must run from inside a clean git repository and will perform the
 following steps:
-    * Clone your repository to a temporary directory
+    * Clone your repository to a temporary directory, optionally sharing
+      its objects with the original repository
     * Merge the current branch with the corresponding debian branch
     * Compute the version of the new package and update the python
       version files
-    * Create a new entry in debian/changelog, using `git-dch`
+    * Create a new entry in debian/changelog
     * Create the Debian packages, using `git-buildpackage`
     * Tag the appropriate branches if in `release` mode
 
@@ -86,6 +87,7 @@ def print_help(prog):
 
 
 def main():
+    from optparse import OptionParser
     from devflow.version import __version__  # pylint: disable=E0611,F0401
     parser = OptionParser(usage="usage: %prog [options] mode",
                           version="devflow %s" % __version__,
@@ -107,6 +109,47 @@ def main():
                       dest="repo_dir",
                       default=None,
                       help="Directory to clone repository")
+    parser.add_option("--scratch-dir",
+                      dest="scratch_dir",
+                      default=None,
+                      help="Directory, preferably on a tmpfs like /dev/shm,"
+                           " for the clone and the intermediate files of the"
+                           " build. Only the final packages are copied to"
+                           " the build directory")
+    parser.add_option("--scratch-min-free",
+                      dest="scratch_min_free",
+                      type="int",
+                      default=None,
+                      help="Free space in MiB required in the scratch"
+                           " directory. Defaults to an estimate based on the"
+                           " size of the repository")
+    parser.add_option("--shared-clone",
+                      dest="shared_clone",
+                      default=False,
+                      action="store_true",
+                      help="Clone the repository with 'git clone --shared',"
+                           " so that the clone uses the objects of the"
+                           " original repository instead of copying them")
+    parser.add_option("--cache-dir",
+                      dest="cache_dir",
+                      default=None,
+                      help="Directory of the cache of built packages."
+                           " Defaults to ~/.cache/devflow/autopkg")
+    parser.add_option("--cache-max-size",
+                      dest="cache_max_size",
+                      type="int",
+                      default=buildcache.MAX_SIZE >> 20,
+                      help=("Size in MiB the cache of built packages is"
+                            " pruned to, removing the least recently used"
+                            " builds. Builds unused for %d days are always"
+                            " removed. Default: %%default"
+                            % (buildcache.MAX_AGE // (24 * 3600))))
+    parser.add_option("--no-cache",
+                      dest="use_cache",
+                      default=True,
+                      action="store_false",
+                      help="Always build the packages, without looking up"
+                           " or updating the cache of snapshot builds")
     parser.add_option("-d", "--dirty",
                       dest="force_dirty",
                       default=False,
@@ -126,7 +169,47 @@ def main():
     parser.add_option("--dist",
                       dest="dist",
                       default=None,
-                      help="Force distribution in Debian changelog")
+                      help="Force distribution in Debian changelog. It is"
+                           " also used as the distribution codename of the"
+                           " Debian version. A comma separated list builds"
+                           " the packages for each distribution in"
+                           " parallel. Several distributions can only be"
+                           " built in snapshot mode")
+    parser.add_option("-j", "--jobs",
+                      dest="jobs",
+                      type="int",
+                      default=None,
+                      help="Number of parallel worker processes building"
+                           " distributions. Defaults to one per"
+                           " distribution. Each package with a 'source_dir'"
+                           " always gets its own worker")
+    parser.add_option("--timings",
+                      dest="timings",
+                      default=False,
+                      action="store_true",
+                      help="Print the time spent in each phase of the build."
+                           " The timings are always written to '%s' in the"
+                           " build directory" % TIMINGS_REPORT)
+    parser.add_option("--trace",
+                      dest="trace",
+                      default=False,
+                      action="store_true",
+                      help="Print a summary of the git commands that were"
+                           " run, with their count and latency. Also enabled"
+                           " by DEVFLOW_TRACE")
+    parser.add_option("--trace-file",
+                      dest="trace_file",
+                      default=None,
+                      help="Write every git command that was run, with its"
+                           " wall time and exit status, to this file as"
+                           " JSON")
+    parser.add_option("-n", "--dry-run",
+                      dest="dry_run",
+                      default=False,
+                      action="store_true",
+                      help="Only print the versions and the debian branches"
+                           " that would be built, without cloning the"
+                           " repository or creating any branch")
     parser.add_option("-S", "--source-only",
                       dest="source_only",
                       default=False,
@@ -169,7 +252,6 @@ def main():
         except AttributeError:
             pass
 
-    print_red = lambda x: sys.stdout.write(red(x) + "\n")
     print_green = lambda x: sys.stdout.write(green(x) + "\n")
 
     if options.help:
@@ -177,79 +259,421 @@ def main():
         parser.print_help()
         return
 
+    # The workers change to the directories of their clones
+    if options.config_file is not None:
+        options.config_file = os.path.abspath(options.config_file)
+
+    with instrument.counting(), \
+            instrument.tracing(options.trace, options.trace_file):
+        try:
+            build(options, args, red, print_green)
+        finally:
+            # The clones are gone, along with the repositories of their
+            # backends
+            gitbackend.close_backends()
+
+
+def build(options, args, red, print_green):
+    """Build the packages of the checked out branch.
+
+    'options' and 'args' are the parsed command line of devflow-autopkg.
+
+    """
+    timer = instrument.PhaseTimer()
+    timer.start("setup")
+
+    # Load the repository
+    original_repo = utils.get_repository()
+    vcs_info = utils.VCSInfo(original_repo)
+
     # Get build mode
     try:
         mode = args[0]
     except IndexError:
-        mode = utils.get_build_mode()
+        mode = utils.get_build_mode(vcs_info)
     if mode not in AVAILABLE_MODES:
         raise ValueError(red("Invalid argument! Mode must be one: %s" %
                              ", ".join(AVAILABLE_MODES)))
 
-    # Load the repository
-    original_repo = utils.get_repository()
-
     # Check that repository is clean
     toplevel = original_repo.working_dir
     if original_repo.is_dirty() and not options.force_dirty:
         raise RuntimeError(red("Repository %s is dirty." % toplevel))
 
     # Get packages from configuration file
-    config = utils.get_config(options.config_file)
-    packages = config['packages'].keys()
-    print_green("Will build the following packages:\n" + "\n".join(packages))
+    config = utils.get_compiled_config(options.config_file,
+                                       vcs_info=vcs_info)
+    print_green("Will build the following packages:\n" +
+                "\n".join(config.package_names))
+    source_packages = sourcepkg.get_source_packages(config)
 
-    # Get current branch name and type and check if it is a valid one
-    branch = original_repo.head.reference.name
-    branch = utils.undebianize(branch)
-    branch_type_str = utils.get_branch_type(branch)
+    branch = get_upstream_branch(vcs_info)
+
+    # Fix needed environment variables
+    os.environ["DEVFLOW_BUILD_MODE"] = mode
+    os.environ["DEBFULLNAME"] = vcs_info.name
+    os.environ["DEBEMAIL"] = vcs_info.email
+
+    # Check that base version file and branch are correct
+    versioning.get_python_version(vcs_info)
 
+    dists = get_distributions(options.dist)
+    check_distributions(dists, mode, source_packages)
+
+    # The clones of the distributions and of the source packages share the
+    # objects of the first one
+    scratch_dir = prepare_scratch_directory(
+        original_repo, options, len(dists) + len(source_packages))
+
+    if options.dry_run:
+        print_dry_run(original_repo, vcs_info, dists, mode, branch,
+                      options.debian_branch, source_packages, print_green)
+        return
+
+    timer.start("debian-branch")
+    debian_branches = get_debian_branches(dists, branch,
+                                          options.debian_branch)
+    package_branches = OrderedDict(
+        (name, package.debian_branch or debian_branches[dists[0]])
+        for name, package in source_packages.items())
+
+    timer.start("clone")
+    repo_dir, repo = clone_repository(original_repo, branch, options,
+                                      scratch_dir, print_green)
+    build_dir, work_dir = create_build_directories(options, scratch_dir,
+                                                   print_green)
+
+    timer.start("merge")
+    merge_debian_branches(repo, branch, unique(debian_branches.values() +
+                                               package_branches.values()),
+                          print_green)
+
+    if len(dists) > 1:
+        timer.start("build")
+        results = build_distributions(dists, debian_branches, repo_dir,
+                                      work_dir, mode, branch, options,
+                                      print_green)
+        timer.extra["distributions"] = OrderedDict(
+            (result["dist"], result["timings"]) for result in results)
+        result = None
+    else:
+        with distribution_codename(dists[0]):
+            result = build_single_distribution(
+                repo, repo_dir, work_dir, mode, branch,
+                debian_branches[dists[0]], config, source_packages,
+                package_branches, options,
+                get_changelog_distribution(dists[0], mode), print_green,
+                timer)
+
+    # Remove cloned repo
+    timer.start("cleanup")
+    collect_artifacts(work_dir, build_dir,
+                      dists if len(dists) > 1 else source_packages.keys(),
+                      print_green)
+    if mode != 'release' and not options.keep_repo:
+        print_green("Removing cloned repo '%s'." % repo_dir)
+        shutil.rmtree(repo_dir)
+
+    if result is not None:
+        print_summary(result, branch, debian_branches[dists[0]], repo_dir,
+                      build_dir, print_green)
+        if mode == "release":
+            print_release_instructions(original_repo, repo, repo_dir,
+                                       debian_branches[dists[0]], result,
+                                       options, print_green, timer)
+    else:
+        print_green("Packages directory: %s" % build_dir)
+
+    report_timings(timer, build_dir, options.timings)
+
+
+def get_upstream_branch(vcs_info):
+    """Return the checked out branch, checking that it has a valid type."""
+    branch = utils.undebianize(vcs_info.branch)
+    branch_type_str = utils.get_branch_type(branch)
     if branch_type_str not in BRANCH_TYPES.keys():
         allowed_branches = ", ".join(BRANCH_TYPES.keys())
         raise ValueError("Malformed branch name '%s', cannot classify as"
                          " one of %s" % (branch, allowed_branches))
+    return branch
+
+
+def check_distributions(dists, mode, source_packages):
+    """Check that the requested build matrix is supported."""
+    if len(dists) > 1 and mode == "release":
+        raise ValueError("Building for several distributions is only"
+                         " supported in snapshot mode.")
+    if source_packages and (len(dists) > 1 or mode == "release"):
+        raise ValueError("Packages with a 'source_dir' can only be built"
+                         " in snapshot mode, for a single distribution.")
+
+
+def get_debian_branches(dists, branch, debian_branch=None):
+    """Return the debian branch to build for each distribution.
+
+    The branch is 'debian_branch', if given, or the one
+    utils.get_debian_branch() finds using the distribution as codename.
+
+    """
+    debian_branches = OrderedDict()
+    for dist in dists:
+        if debian_branch:
+            debian_branches[dist] = debian_branch
+            continue
+        with distribution_codename(dist):
+            debian_branches[dist] = utils.get_debian_branch(branch)
+    return debian_branches
+
+
+def print_dry_run(repo, vcs_info, dists, mode, branch, debian_branch,
+                  source_packages, print_green):
+    """Print the versions and the debian branches a build would use.
+
+    No branch is created or updated. The version of each distribution is
+    computed on the commit that merging 'branch' into its debian branch
+    creates, which is only written to the object database. If the merge
+    cannot be computed, the version of the checked out commit is printed
+    instead, labelled as an estimate.
+
+    """
+    first_branch = None
+    for dist in dists:
+        with distribution_codename(dist):
+            if debian_branch:
+                name, ref = debian_branch, "refs/heads/" + debian_branch
+            else:
+                name, ref = utils.find_debian_branch(branch)
+            merged = get_merged_vcs_info(repo, branch, name, ref)
+            if merged is not None:
+                version = "'%s'" % versioning.get_debian_version(merged)
+            else:
+                version = ("'%s' (estimated from branch '%s' only, cannot"
+                           " merge it into '%s')"
+                           % (versioning.get_debian_version(vcs_info),
+                              branch, name))
+        print_green("Would build version %s for distribution '%s'"
+                    " from branch '%s'"
+                    % (version, get_changelog_distribution(dist, mode), name))
+        first_branch = first_branch or name
+    for name, package in source_packages.items():
+        print_green("Would build package '%s' from branch '%s'"
+                    % (name, package.debian_branch or first_branch))
+
+
+def get_merged_vcs_info(repo, branch, debian_branch, ref):
+    """Return the VCSInfo of the merge of 'branch' into a debian branch.
+
+    'ref' is the ref the debian branch gets its commit from. The merge
+    follows 'git merge', without updating any ref. Returns None if either
+    branch does not exist or the merge cannot be computed.
+
+    """
+    backend = gitbackend.get_backend(repo)
+    upstream = backend.resolve("refs/heads/" + branch)
+    head = backend.resolve(ref) if ref is not None else None
+    if upstream is None or head is None:
+        return None
+    message = "Merge branch '%s' into %s" % (branch, debian_branch)
+    # The commit is only needed for its version, so it is never signed
+    merged = refs.merge_commit(repo, head, upstream, message,
+                               fast_forward=True, sign=False)
+    if merged is None:
+        return None
+    return utils.VCSInfo(repo, rev=merged, branch=debian_branch)
+
+
+def prepare_scratch_directory(repo, options, trees):
+    """Check the scratch directory of the options, if any, and return it.
+
+    The scratch directory must have enough free space for 'trees' clones
+    of the repository.
+
+    """
+    if options.scratch_dir is None:
+        return None
+    scratch_dir = os.path.abspath(options.scratch_dir)
+    if options.scratch_min_free is not None:
+        required = options.scratch_min_free * 1024 * 1024
+    else:
+        required = estimate_build_space(repo, "HEAD", trees,
+                                        options.shared_clone)
+    check_free_space(scratch_dir, required)
+    return scratch_dir
 
-    # Fix needed environment variables
-    v = utils.get_vcs_info()
-    os.environ["DEVFLOW_BUILD_MODE"] = mode
-    os.environ["DEBFULLNAME"] = v.name
-    os.environ["DEBEMAIL"] = v.email
 
-    # Check that base version file and branch are correct
-    versioning.get_python_version()
+def clone_repository(original_repo, branch, options, scratch_dir,
+                     print_green):
+    """Clone the repository, checking out 'branch'.
 
-    # Get the debian branch
-    if options.debian_branch:
-        debian_branch = options.debian_branch
-    else:
-        debian_branch = utils.get_debian_branch(branch)
-    origin_debian = "origin/" + debian_branch
+    Returns the directory of the clone and the clone.
 
-    # Clone the repo
-    repo_dir = options.repo_dir or create_temp_directory("df-repo")
+    """
+    repo_dir = options.repo_dir or create_temp_directory("df-repo",
+                                                         scratch_dir)
     repo_dir = os.path.abspath(repo_dir)
-    repo = original_repo.clone(repo_dir, branch=branch)
-    print_green("Cloned repository to '%s'." % repo_dir)
+    if options.shared_clone:
+        # Objects are found through .git/objects/info/alternates, while
+        # branches, tags and commits stay private to the clone.
+        repo = original_repo.clone(repo_dir, branch=branch, shared=True)
+        print_green("Cloned repository to '%s', sharing objects with '%s'."
+                    % (repo_dir, original_repo.working_dir))
+    else:
+        repo = original_repo.clone(repo_dir, branch=branch)
+        print_green("Cloned repository to '%s'." % repo_dir)
+    return repo_dir, repo
+
+
+def create_build_directories(options, scratch_dir, print_green):
+    """Create the build directory and the directory the packages are built.
+
+    Packages are built in the scratch directory, if any, and only the
+    final artifacts are copied to the build directory. Returns both
+    directories, which are the same without a scratch directory.
 
+    """
     build_dir = options.build_dir or create_temp_directory("df-build")
     build_dir = os.path.abspath(build_dir)
+    # The workers write their logs here before anything is built
+    if not os.path.isdir(build_dir):
+        os.makedirs(build_dir)
     print_green("Build directory: '%s'" % build_dir)
+    if scratch_dir is None:
+        return build_dir, build_dir
+    work_dir = create_temp_directory("df-build", scratch_dir)
+    print_green("Scratch build directory: '%s'" % work_dir)
+    return build_dir, work_dir
+
+
+def merge_debian_branches(repo, branch, debian_branches, print_green):
+    """Create the debian branches in the clone and merge 'branch' in them."""
+    with refs.RefTransaction(repo) as transaction:
+        for debian_branch in debian_branches:
+            transaction.create_branch(debian_branch, "origin/" + debian_branch)
+    for debian_branch in debian_branches:
+        print_green("Created branch '%s' from 'origin/%s'" %
+                    (debian_branch, debian_branch))
+
+    for debian_branch in debian_branches:
+        # Go to debian branch
+        repo.git.checkout(debian_branch)
+        print_green("Changed to branch '%s'" % debian_branch)
+
+        # Merge with starting branch
+        repo.git.merge(branch)
+        print_green("Merged branch '%s' into '%s'" % (branch, debian_branch))
+
+
+def build_single_distribution(repo, repo_dir, build_dir, mode, branch,
+                              debian_branch, config, source_packages,
+                              package_branches, options, distribution,
+                              print_green, timer):
+    """Build the packages of the repository and of its subdirectories.
+
+    Packages in subdirectories are built by worker processes, while the
+    packages of the repository are built here. Returns the result of
+    build_packages(), or None if all packages are in subdirectories.
+
+    """
+    source_builds = None
+    if source_packages:
+        source_builds = sourcepkg.start_source_packages(
+            repo, source_packages, package_branches, repo_dir, build_dir,
+            mode, branch, options, distribution, print_green)
+
+    result = None
+    if len(config.packages) > len(source_packages):
+        # The last merged branch may be the one of a source package
+        repo.git.checkout(debian_branch)
+        print_green("Changed to branch '%s'" % debian_branch)
+        result = build_packages(repo, repo_dir, build_dir, mode, branch,
+                                debian_branch, config, options, distribution,
+                                print_green, timer)
+
+    if source_builds is not None:
+        timer.start("source-packages")
+        results = sourcepkg.finish_source_packages(source_builds, print_green)
+        timer.extra["packages"] = OrderedDict(
+            (result["package"], result["timings"]) for result in results)
+    return result
+
+
+def print_summary(result, branch, debian_branch, repo_dir, build_dir,
+                  print_green):
+    """Print the versions, branches and tags of a build."""
+    info = (("Version", result["debian_version"]),
+            ("Upstream branch", branch),
+            ("Upstream tag", result["branch_tag"]),
+            ("Debian branch", debian_branch),
+            ("Debian tag", result["debian_branch_tag"]),
+            ("Repository directory", repo_dir),
+            ("Packages directory", build_dir))
+    print_green("\n".join(["%s: %s" % (name, val) for name, val in info]))
 
-    # Create the debian branch
-    repo.git.branch(debian_branch, origin_debian)
-    print_green("Created branch '%s' to track '%s'" %
-                (debian_branch, origin_debian))
 
-    # Go to debian branch
-    repo.git.checkout(debian_branch)
-    print_green("Changed to branch '%s'" % debian_branch)
+def print_release_instructions(original_repo, repo, repo_dir, debian_branch,
+                               result, options, print_green, timer):
+    """Print how to push a release, and push it if requested."""
+    toplevel = original_repo.working_dir
+    origin = original_repo.remote().url
+    repo.create_remote("original_origin", origin)
+    print_green("Created remote 'original_origin' for the repository '%s'"
+                % origin)
+
+    if options.shared_clone:
+        print_green("Repository '%s' uses the objects of '%s'. Run 'git"
+                    " repack -a' in it, before it is used on its own."
+                    % (repo_dir, toplevel))
+    print_green("To update repositories '%s' and '%s' go to '%s' and run:"
+                % (toplevel, origin, repo_dir))
+    # All refs are pushed at once, and either all or none are updated
+    objects = [debian_branch, result["branch_tag"],
+               result["debian_branch_tag"]]
+    for remote in ['origin', 'original_origin']:
+        print_green("git push --atomic %s %s" % (remote, " ".join(objects)))
+    if options.push_back:
+        timer.start("push")
+        repo.git.push("--atomic", "origin", *objects)
+        print_green("Automatically updated origin repo.")
+
+
+def report_timings(timer, build_dir, print_table=False):
+    """Write the timings of the run next to the packages."""
+    timer.stop()
+    path = os.path.join(build_dir, TIMINGS_REPORT)
+    timer.write_report(path)
+    if print_table:
+        sys.stdout.write(timer.format_table() + "\n")
+    sys.stdout.write("Timings written to '%s'\n" % path)
+
+
+def get_gbp_buildpackage():
+    """Return the command line that runs git-buildpackage.
+
+    Looked up only when a package is built, so that the other commands do not
+    search the PATH for it.
+
+    """
+    if find_executable("git-buildpackage"):
+        return ['git-buildpackage']
+    # In newer versions of git-buildpackage the executables have changed.
+    # Instead of having various git-* executables, there is only a gbp one,
+    # which expects the command (buildpackage, etc) as the first argument.
+    return ['gbp', 'buildpackage']
+
 
-    # Merge with starting branch
-    repo.git.merge(branch)
-    print_green("Merged branch '%s' into '%s'" % (branch, debian_branch))
+def build_packages(repo, repo_dir, build_dir, mode, branch, debian_branch,
+                   config, options, distribution, print_green, timer):
+    """Build the packages of the debian branch checked out in 'repo'.
 
+    The debian branch must already be merged with the upstream branch. The
+    versions are computed, the version files and the changelog are updated
+    and the packages are created with git-buildpackage. Returns a dictionary
+    with the versions and the tags of the build.
+
+    """
     # Compute python and debian version
-    cd(repo_dir)
+    timer.start("version")
+    os.chdir(repo_dir)
     python_version = versioning.get_python_version()
     debian_version = versioning.\
         debian_version_from_python_version(python_version)
@@ -258,70 +682,83 @@ def main():
     # Update the version files
     versioning.update_version()
 
-    if not options.sign:
-        sign_tag_opt = None
-    elif options.keyid:
-        sign_tag_opt = "-u=%s" % options.keyid
-    elif mode == "release":
-        sign_tag_opt = "-s"
-    else:
-        sign_tag_opt = None
+    keyid = options.keyid if options.sign else None
+    sign = keyid is not None or (options.sign and mode == "release")
+
+    # All tags are created at once, before the packages are built
+    tags = refs.RefTransaction(repo)
 
     # Tag branch with python version
     branch_tag = python_version
+    debian_branch_tag = "debian/" + utils.version_to_tag(debian_version)
     tag_message = "%s version %s" % (mode.capitalize(), python_version)
-    try:
-        repo.git.tag(branch_tag, branch, sign_tag_opt, "-m %s" % tag_message)
-    except GitCommandError:
-        # Tag may already exist, if only the debian branch has changed
-        pass
+    # Tag may already exist, if only the debian branch has changed
+    if not tags.backend.ref_exists("refs/tags/" + branch_tag):
+        tags.create_tag(branch_tag, branch, tag_message, sign=sign,
+                        keyid=keyid)
     upstream_tag = "upstream/" + branch_tag
-    repo.git.tag(upstream_tag, branch)
+    tags.create_tag(upstream_tag, branch)
+
+    result = {"python_version": python_version,
+              "debian_version": debian_version,
+              "branch_tag": branch_tag,
+              "upstream_tag": upstream_tag,
+              "debian_branch_tag": debian_branch_tag,
+              "cached": False}
+
+    # Look up the packages in the build cache. The key uses the merged tree,
+    # before the changelog is updated, so identical builds share it.
+    cache_key = None
+    if mode == "snapshot" and options.use_cache:
+        timer.start("cache")
+        cache_dir = buildcache.get_cache_dir(options.cache_dir)
+        tree = repo.git.rev_parse("HEAD^{tree}")
+        cache_key = buildcache.get_cache_key(
+            tree, debian_version, distribution,
+            {"source_only": options.source_only,
+             "sign": options.sign,
+             "keyid": options.keyid,
+             "maintainer": "%s <%s>" % (os.environ.get("DEBFULLNAME"),
+                                        os.environ.get("DEBEMAIL"))})
+        restored = buildcache.restore(cache_dir, cache_key, build_dir)
+        if restored is not None:
+            print_green("Found packages in cache '%s':\n%s"
+                        % (os.path.join(cache_dir, cache_key),
+                           "\n".join(restored)))
+            result["cached"] = True
+            tags.commit()
+            return result
 
     # Update changelog
-    dch = gbp_dch("--debian-branch=%s" % debian_branch,
-                  "--git-author",
-                  "--ignore-regex=\".*\"",
-                  "--multimaint-merge",
-                  "--since=HEAD",
-                  "--new-version=%s" % debian_version)
-    print_green("Successfully ran '%s'" % " ".join(dch.cmd))
-
-    if options.dist is not None:
-        distribution = options.dist
-    elif mode == "release":
-        distribution = utils.get_distribution_codename()
-    else:
-        distribution = "unstable"
-
-    f = open("debian/changelog", 'r+')
-    lines = f.readlines()
-    lines[0] = lines[0].replace("UNRELEASED", distribution)
-    lines[2] = lines[2].replace("UNRELEASED", "%s build" % mode)
-    f.seek(0)
-    f.writelines(lines)
-    f.close()
+    timer.start("changelog")
+    changelog.add_entry("debian/changelog", debian_version, distribution,
+                        "%s build" % mode)
+    print_green("Added entry for version '%s' to debian/changelog"
+                % debian_version)
 
     if mode == "release":
+        timer.start("editor")
         subprocess.check_call(['editor', "debian/changelog"])
 
+    timer.start("commit")
+
     # Add changelog to INDEX
     repo.git.add("debian/changelog")
     # Commit Changes
     repo.git.commit("-s", "debian/changelog",
                     m="Bump version to %s" % debian_version)
     # Tag debian branch
-    debian_branch_tag = "debian/" + utils.version_to_tag(debian_version)
     tag_message = "%s version %s" % (mode.capitalize(), debian_version)
     if mode == "release":
-        repo.git.tag(debian_branch_tag, sign_tag_opt, "-m %s" % tag_message)
+        tags.create_tag(debian_branch_tag, "HEAD", tag_message, sign=sign,
+                        keyid=keyid)
+    tags.commit()
 
     # Create debian packages
-    cd(repo_dir)
+    os.chdir(repo_dir)
     version_files = []
-    for _, pkg_info in config['packages'].items():
-        if pkg_info.get("version_file"):
-            version_files.extend(pkg_info.as_list('version_file'))
+    for package in config.packages:
+        version_files.extend(package.version_files)
 
     # Add version.py files to repo
     repo.git.add("-f", *version_files)
@@ -330,7 +767,7 @@ def main():
     os.environ["DEB_DEVFLOW_DEBIAN_VERSION"] = debian_version
     os.environ["DEB_DEVFLOW_VERSION"] = python_version
 
-    args = list(gbp_buildpackage)
+    args = get_gbp_buildpackage()
     args.extend(["--git-export-dir=%s" % build_dir,
                  "--git-upstream-branch=%s" % branch,
                  "--git-debian-branch=%s" % debian_branch,
@@ -347,44 +784,223 @@ def main():
     elif options.keyid:
         args.append("-k\"'%s'\"" % options.keyid)
 
+    timer.start("buildpackage")
+    artifacts = buildcache.list_artifacts(build_dir)
     subprocess.check_call(args)
 
-    # Remove cloned repo
-    if mode != 'release' and not options.keep_repo:
-        print_green("Removing cloned repo '%s'." % repo_dir)
-        rm("-r", repo_dir)
+    if cache_key is not None:
+        timer.start("cache")
+        built = buildcache.new_artifacts(
+            artifacts, buildcache.list_artifacts(build_dir))
+        if buildcache.store(cache_dir, cache_key,
+                            [os.path.join(build_dir, name) for name in built]):
+            print_green("Stored packages in cache '%s'"
+                        % os.path.join(cache_dir, cache_key))
+        buildcache.prune(cache_dir, options.cache_max_size * 1024 * 1024)
 
-    # Print final info
-    info = (("Version", debian_version),
-            ("Upstream branch", branch),
-            ("Upstream tag", branch_tag),
-            ("Debian branch", debian_branch),
-            ("Debian tag", debian_branch_tag),
-            ("Repository directory", repo_dir),
-            ("Packages directory", build_dir))
-    print_green("\n".join(["%s: %s" % (name, val) for name, val in info]))
+    return result
 
-    # Print help message
-    if mode == "release":
-        origin = original_repo.remote().url
-        repo.create_remote("original_origin", origin)
-        print_green("Created remote 'original_origin' for the repository '%s'"
-                    % origin)
-
-        print_green("To update repositories '%s' and '%s' go to '%s' and run:"
-                    % (toplevel, origin, repo_dir))
-        for remote in ['origin', 'original_origin']:
-            objects = [debian_branch, branch_tag, debian_branch_tag]
-            print_green("git push %s %s" % (remote, " ".join(objects)))
-        if options.push_back:
-            objects = [debian_branch, branch_tag, debian_branch_tag]
-            repo.git.push("origin", *objects)
-            print_green("Automatically updated origin repo.")
-
-
-def create_temp_directory(suffix):
-    create_dir_cmd = mktemp("-d", "/tmp/" + suffix + "-XXXXX")
-    return create_dir_cmd.stdout.strip()
+
+def get_distributions(dist_option):
+    """Parse the comma-separated list of the --dist option.
+
+    Returns [None] if no distribution was given.
+
+    """
+    if dist_option is None:
+        return [None]
+    dists = unique(d.strip() for d in dist_option.split(",") if d.strip())
+    if not dists:
+        raise ValueError("No distribution given to --dist")
+    return dists
+
+
+def get_changelog_distribution(dist, mode):
+    """Return the distribution of the new Debian changelog entry."""
+    if dist is not None:
+        return dist
+    elif mode == "release":
+        return utils.get_distribution_codename()
+    else:
+        return "unstable"
+
+
+def unique(items):
+    """Return the items of an iterable without duplicates, in order."""
+    return list(OrderedDict.fromkeys(items))
+
+
+@contextmanager
+def distribution_codename(codename):
+    """Override the distribution codename used by devflow.utils."""
+    if codename is None:
+        yield
+        return
+    old_codename = os.environ.get("DEVFLOW_CODENAME")
+    os.environ["DEVFLOW_CODENAME"] = codename
+    try:
+        yield
+    finally:
+        if old_codename is None:
+            del os.environ["DEVFLOW_CODENAME"]
+        else:
+            os.environ["DEVFLOW_CODENAME"] = old_codename
+
+
+def build_distributions(dists, debian_branches, repo_dir, build_dir, mode,
+                        branch, options, print_green):
+    """Build the packages for several distributions in parallel.
+
+    Each distribution is built by a separate worker process, in a clone of
+    the build repository that shares its objects, with its own build
+    directory and log file. The distribution is also used as the codename
+    of the Debian revision of the packages.
+
+    """
+    jobs = []
+    for dist in dists:
+        jobs.append({"dist": dist,
+                     "debian_branch": debian_branches[dist],
+                     "branch": branch,
+                     "mode": mode,
+                     "source_repo_dir": repo_dir,
+                     "repo_dir": "%s-%s" % (repo_dir, dist),
+                     "build_dir": os.path.join(build_dir, dist),
+                     "log_file": os.path.join(build_dir, "%s.log" % dist),
+                     "options": options})
+
+    workers = min(options.jobs or len(jobs), len(jobs))
+    print_green("Building for distributions %s using %d workers"
+                % (", ".join(dists), workers))
+    # The workers must not inherit the pipes of the persistent git processes
+    gitbackend.close_backends()
+    pool = Pool(workers, maxtasksperchild=1)
+    try:
+        results = pool.map(build_distribution, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    failed = []
+    for result in results:
+        if result["error"] is None:
+            print_green("%s: built version '%s'"
+                        % (result["dist"], result["debian_version"]))
+        else:
+            failed.append(result["dist"])
+            sys.stdout.write("%s: FAILED: %s. Log: '%s'\n"
+                             % (result["dist"], result["error"],
+                                result["log_file"]))
+    if failed:
+        raise RuntimeError("Build failed for distributions: %s"
+                           % ", ".join(failed))
+    return results
+
+
+def build_distribution(job):
+    """Worker building the packages of a single distribution."""
+    dist = job["dist"]
+    options = job["options"]
+    result = {"dist": dist, "build_dir": job["build_dir"],
+              "log_file": job["log_file"], "error": None}
+
+    log = ui.redirect_output(job["log_file"])
+    os.environ["DEVFLOW_CODENAME"] = dist
+    timer = instrument.PhaseTimer()
+    try:
+        timer.start("clone")
+        if not os.path.isdir(job["build_dir"]):
+            os.makedirs(job["build_dir"])
+        source_repo = utils.get_repository(job["source_repo_dir"])
+        repo = source_repo.clone(job["repo_dir"], branch=job["debian_branch"],
+                                 shared=True)
+        ui.print_log("Cloned repository to '%s'." % job["repo_dir"])
+        repo.git.branch(job["branch"], "origin/" + job["branch"])
+        config = utils.get_compiled_config(options.config_file,
+                                           vcs_info=utils.VCSInfo(repo))
+        distribution = get_changelog_distribution(dist, job["mode"])
+        result.update(build_packages(repo, job["repo_dir"], job["build_dir"],
+                                     job["mode"], job["branch"],
+                                     job["debian_branch"], config, options,
+                                     distribution, ui.print_log, timer))
+        timer.start("cleanup")
+        if not options.keep_repo:
+            ui.print_log("Removing cloned repo '%s'." % job["repo_dir"])
+            shutil.rmtree(job["repo_dir"])
+    except Exception as e:  # pylint: disable=W0703
+        traceback.print_exc()
+        result["error"] = str(e) or e.__class__.__name__
+    finally:
+        result["timings"] = timer.report()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        log.close()
+    return result
+
+
+def create_temp_directory(suffix, root=None):
+    return tempfile.mkdtemp(prefix=suffix + "-", dir=root or "/tmp")
+
+
+def estimate_build_space(repo, rev, trees=1, shared=False):
+    """Estimate the space needed to clone and build a repository.
+
+    Each of the 'trees' working trees needs twice the size of the files of
+    'rev', for its checkout and for the exported sources and packages. A
+    clone that does not share the objects of 'repo' also copies its object
+    store. The sizes are read from git, without walking the working tree.
+
+    """
+    backend = gitbackend.get_backend(repo)
+    tree_size = 0
+    for line in backend.run("ls-tree", "-r", "-l", rev).splitlines():
+        size = line.split("\t", 1)[0].split()[3]
+        # Submodules have no size
+        if size != "-":
+            tree_size += int(size)
+    required = 2 * trees * tree_size
+    if not shared:
+        counts = dict(line.split(": ", 1) for line in
+                      backend.run("count-objects", "-v").splitlines())
+        required += (int(counts["size"]) + int(counts["size-pack"])) * 1024
+    return required
+
+
+def check_free_space(path, required):
+    """Check that 'path' has at least 'required' bytes of free space."""
+    stat = os.statvfs(path)
+    free = stat.f_bavail * stat.f_frsize
+    if free < required:
+        raise RuntimeError("Not enough free space in '%s': %d MiB are"
+                           " required, but only %d MiB are free."
+                           % (path, required >> 20, free >> 20))
+
+
+def collect_artifacts(work_dir, build_dir, subdirs, print_green):
+    """Move the packages and logs of a scratch build to the build directory.
+
+    Only the files at the top of 'work_dir' and of its given subdirectories
+    are considered, leaving out the exported source trees. The scratch
+    directory is removed afterwards.
+
+    """
+    if work_dir == build_dir:
+        return
+    for subdir in [""] + list(subdirs):
+        src = os.path.join(work_dir, subdir)
+        dest = os.path.join(build_dir, subdir)
+        if not os.path.isdir(src):
+            continue
+        for name in sorted(os.listdir(src)):
+            path = os.path.join(src, name)
+            if not os.path.isfile(path) or \
+               not (buildcache.is_artifact(name) or name.endswith(".log")):
+                continue
+            if not os.path.isdir(dest):
+                os.makedirs(dest)
+            shutil.copy2(path, os.path.join(dest, name))
+    print_green("Copied packages from '%s' to '%s'." % (work_dir, build_dir))
+    shutil.rmtree(work_dir)
 
 
 if __name__ == "__main__":
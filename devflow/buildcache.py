@@ -0,0 +1,247 @@
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+
+"""Local cache of the packages built by devflow-autopkg.
+
+Snapshot builds of the same upstream tree, merged with the same debian
+branch, produce the same packages. The results of a build are stored in a
+content-addressed directory, keyed by the hash of the merged tree, the
+Debian version, the distribution and the build options, so that a later
+build with the same key can reuse them instead of running git-buildpackage.
+
+Cached files are read-only copies, and they are copied again when they are
+restored, so that changes to the packages of a build directory, e.g. by
+debsign, never reach the cache. Entries that have not been used for
+MAX_AGE seconds are pruned after each store, and so are the least recently
+used ones, while the cache is larger than its maximum size.
+
+"""
+
+import os
+import time
+import stat
+import errno
+import shutil
+import hashlib
+import tempfile
+
+from fnmatch import fnmatch
+
+
+CACHE_VERSION = "2"
+# Default bounds of the cache: 30 days since last use and 2 GiB
+MAX_AGE = 30 * 24 * 3600
+MAX_SIZE = 2048 * 1024 * 1024
+ARTIFACT_PATTERNS = ["*.deb", "*.udeb", "*.ddeb", "*.dsc", "*.changes",
+                     "*.buildinfo", "*.tar.*", "*.diff.gz"]
+
+
+def get_cache_dir(path=None):
+    """Return the directory of the build cache.
+
+    Defaults to 'devflow/autopkg' under $XDG_CACHE_HOME, or ~/.cache.
+
+    """
+    if path is None:
+        cache_home = os.environ.get("XDG_CACHE_HOME") or \
+            os.path.join(os.path.expanduser("~"), ".cache")
+        path = os.path.join(cache_home, "devflow", "autopkg")
+    return os.path.abspath(path)
+
+
+def get_cache_key(tree, debian_version, distribution, options=None):
+    """Compute the cache key of a build.
+
+    'tree' is the hash of the merged source tree, before the changelog is
+    updated, and 'options' a dictionary with the options that affect the
+    produced packages, including the identity of the maintainer the
+    changelog entry and the .changes files are attributed to.
+
+    """
+    options = options or {}
+    fields = [CACHE_VERSION, tree, debian_version, distribution]
+    fields.extend("%s=%s" % (name, options[name]) for name in sorted(options))
+    return hashlib.sha1("\0".join(fields)).hexdigest()
+
+
+def is_artifact(filename):
+    return any(fnmatch(filename, pattern) for pattern in ARTIFACT_PATTERNS)
+
+
+def list_artifacts(directory):
+    """Return a dictionary with the artifacts of a directory and their mtime.
+
+    Only the regular files of the directory itself are considered.
+
+    """
+    artifacts = {}
+    try:
+        names = os.listdir(directory)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return artifacts
+    for name in names:
+        path = os.path.join(directory, name)
+        if is_artifact(name) and os.path.isfile(path):
+            artifacts[name] = os.path.getmtime(path)
+    return artifacts
+
+
+def new_artifacts(before, after):
+    """Return the names of the artifacts created or modified by a build."""
+    return sorted(name for name, mtime in after.items()
+                  if before.get(name) != mtime)
+
+
+def _copy(src, dst, writable):
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    shutil.copy2(src, dst)
+    mode = stat.S_IMODE(os.stat(dst).st_mode)
+    if writable:
+        mode |= stat.S_IWUSR
+    else:
+        mode &= ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+    os.chmod(dst, mode)
+
+
+def lookup(cache_dir, key):
+    """Return the artifacts cached under 'key', or None on a cache miss."""
+    entry = os.path.join(cache_dir, key)
+    if not os.path.isdir(entry):
+        return None
+    names = sorted(name for name in os.listdir(entry) if is_artifact(name))
+    return names or None
+
+
+def restore(cache_dir, key, build_dir):
+    """Copy the artifacts cached under 'key' into 'build_dir'.
+
+    Returns the list of restored files, or None on a cache miss.
+
+    """
+    names = lookup(cache_dir, key)
+    if names is None:
+        return None
+    if not os.path.isdir(build_dir):
+        os.makedirs(build_dir)
+    entry = os.path.join(cache_dir, key)
+    for name in names:
+        _copy(os.path.join(entry, name), os.path.join(build_dir, name),
+              writable=True)
+    # The modification time of an entry is the time it was last used
+    os.utime(entry, None)
+    return [os.path.join(build_dir, name) for name in names]
+
+
+def store(cache_dir, key, files):
+    """Store the given artifacts in the cache under 'key'.
+
+    The entry is populated in a temporary directory and renamed into place,
+    so that concurrent builds never see a partial entry. Returns False if
+    the entry already exists.
+
+    """
+    if not files:
+        return False
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+    entry = os.path.join(cache_dir, key)
+    if os.path.isdir(entry):
+        return False
+    tmp_entry = tempfile.mkdtemp(prefix=".%s." % key, dir=cache_dir)
+    try:
+        for path in files:
+            _copy(path, os.path.join(tmp_entry, os.path.basename(path)),
+                  writable=False)
+        try:
+            os.rename(tmp_entry, entry)
+        except OSError as e:
+            if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+            return False
+    finally:
+        if os.path.isdir(tmp_entry):
+            shutil.rmtree(tmp_entry)
+    return True
+
+
+def _entry_size(path):
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            size += os.lstat(os.path.join(dirpath, name)).st_size
+    return size
+
+
+def prune(cache_dir, max_size=MAX_SIZE, max_age=MAX_AGE, now=None):
+    """Remove the least recently used entries of the cache.
+
+    Entries, including the temporary ones of interrupted builds, that have
+    not been used for 'max_age' seconds are removed, and so are the oldest
+    of the rest, until the cache takes at most 'max_size' bytes. Returns the
+    number of removed entries.
+
+    """
+    if now is None:
+        now = time.time()
+    try:
+        names = os.listdir(cache_dir)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return 0
+    entries = []
+    for name in names:
+        path = os.path.join(cache_dir, name)
+        try:
+            entries.append((os.stat(path).st_mtime, _entry_size(path), path))
+        except OSError:
+            # Removed by a concurrent prune
+            continue
+    entries.sort()
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for mtime, size, path in entries:
+        if now - mtime <= max_age and total <= max_size:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        removed += 1
+    return removed
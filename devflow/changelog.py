@@ -0,0 +1,118 @@
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+
+"""Native writer of Debian changelog entries.
+
+New entries are rendered in-process and prepended to debian/changelog by
+streaming its old contents into a temporary file, which then replaces the
+changelog. The old contents are never read into memory as a whole, so the
+cost does not grow with the history of the debian branch.
+
+"""
+
+import os
+import re
+
+from devflow import utils
+
+
+DEFAULT_URGENCY = "medium"
+CHANGELOG_HEADER_RE = re.compile(r"^(?P<package>[a-z0-9][a-z0-9.+-]+)"
+                                 r" \((?P<version>[^ ()]+)\)")
+
+ENTRY_TEMPLATE = """\
+%(package)s (%(version)s) %(distribution)s; urgency=%(urgency)s
+
+%(changes)s
+
+ -- %(maintainer)s  %(date)s
+
+"""
+
+
+def get_maintainer():
+    """Return the maintainer of new entries from DEBFULLNAME and DEBEMAIL."""
+    name = os.environ.get("DEBFULLNAME")
+    email = os.environ.get("DEBEMAIL")
+    if not name or not email:
+        raise RuntimeError("DEBFULLNAME and DEBEMAIL must be set to create"
+                           " a Debian changelog entry.")
+    return "%s <%s>" % (name, email)
+
+
+def get_package(path):
+    """Return the source package name from the first changelog entry."""
+    with open(path) as f:
+        header = f.readline()
+    m = CHANGELOG_HEADER_RE.match(header)
+    if m is None:
+        raise ValueError("Can not parse the first line of '%s': %r"
+                         % (path, header))
+    return m.group("package")
+
+
+def format_entry(package, version, distribution, changes,
+                 urgency=DEFAULT_URGENCY, maintainer=None, date=None):
+    """Render a changelog entry.
+
+    'changes' is a list of change descriptions, each one rendered as a
+    bullet item. The date defaults to the current local time, in RFC 2822
+    format.
+
+    """
+    # email.utils pulls in most of the email package, so only import it here
+    from email.utils import formatdate
+    if isinstance(changes, basestring):
+        changes = [changes]
+    return ENTRY_TEMPLATE % {
+        "package": package,
+        "version": version,
+        "distribution": distribution,
+        "urgency": urgency,
+        "changes": "\n".join("  * %s" % change for change in changes),
+        "maintainer": maintainer or get_maintainer(),
+        "date": date or formatdate(localtime=True)}
+
+
+def add_entry(path, version, distribution, changes, urgency=DEFAULT_URGENCY,
+              maintainer=None, date=None):
+    """Prepend a new entry to the changelog in 'path'.
+
+    The package name is taken from the current first entry. Returns the
+    rendered entry.
+
+    """
+    entry = format_entry(get_package(path), version, distribution, changes,
+                         urgency=urgency, maintainer=maintainer, date=date)
+    utils.prepend_file(path, entry)
+    return entry
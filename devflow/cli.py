@@ -0,0 +1,108 @@
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+
+"""Single entry point for the devflow tools.
+
+    devflow <command> [arguments]
+
+runs the same code as the matching 'devflow-<command>' script. Only the
+module of the requested command is imported, so that listing the commands or
+running a cheap one does not pay for the dependencies of the others.
+
+"""
+
+import sys
+
+from collections import OrderedDict
+
+
+# command -> (module, function, description)
+COMMANDS = OrderedDict([
+    ("version", ("devflow.versioning", "main",
+                 "Compute the Python or Debian version of the repository")),
+    ("bump-version", ("devflow.versioning", "bump_version_main",
+                      "Change the base version of the repository")),
+    ("update-version", ("devflow.versioning", "update_version_main",
+                        "Write the version files of the repository")),
+    ("autopkg", ("devflow.autopkg", "main",
+                 "Build the Debian packages of the repository")),
+    ("flow", ("devflow.flow", "main",
+              "Manage the branches of the git flow model")),
+    ("versiond", ("devflow.versiond", "main",
+                  "Serve the versions of the repository over a socket")),
+    ("versionc", ("devflow.versiond", "client_main",
+                  "Query a running devflow-versiond")),
+])
+
+
+def format_usage(prog="devflow"):
+    lines = ["usage: %s <command> [arguments]" % prog, "",
+             "Commands:"]
+    width = max(len(name) for name in COMMANDS)
+    for name, (_, _, description) in COMMANDS.items():
+        lines.append("  %s  %s" % (name.ljust(width), description))
+    lines.extend(["", "Run '%s <command> --help' for the arguments of a"
+                      " command." % prog])
+    return "\n".join(lines) + "\n"
+
+
+def load_command(name):
+    """Import and return the function that implements a command."""
+    module_name, function, _ = COMMANDS[name]
+    module = __import__(module_name, fromlist=[function])
+    return getattr(module, function)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv or argv[0] in ("-h", "--help", "help"):
+        sys.stdout.write(format_usage())
+        return 0
+    if argv[0] in ("-V", "--version"):
+        from devflow.version import __version__  # pylint: disable=E0611,F0401
+        sys.stdout.write("devflow %s\n" % __version__)
+        return 0
+    name = argv[0]
+    if name not in COMMANDS:
+        sys.stderr.write("devflow: unknown command '%s'\n\n" % name)
+        sys.stderr.write(format_usage())
+        return 2
+    command = load_command(name)
+    # The commands parse sys.argv themselves and name themselves after it
+    sys.argv = ["devflow-" + name] + list(argv[1:])
+    return command()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+
+"""Compiled devflow.conf.
+
+'devflow.conf' is parsed with ConfigObj once and compiled to an immutable
+Config, which lists the packages with their version files and templates.
+The compiled form is cached in the git directory of the repository, keyed by
+the path, the modification time and the size of the file, so that the tools
+that run many times during a build do not parse it again.
+
+"""
+
+import os
+import json
+import tempfile
+
+from collections import namedtuple
+
+CONFIG_FILE = "devflow.conf"
+CACHE_FILE = "devflow-config-cache"
+CACHE_VERSION = 1
+
+Package = namedtuple("Package", ["name", "version_files", "version_templates",
+                                 "source_dir", "debian_branch"])
+
+
+class Config(namedtuple("Config", ["path", "packages"])):
+    """The compiled configuration, with a tuple of Package."""
+    __slots__ = ()
+
+    @property
+    def package_names(self):
+        return tuple(package.name for package in self.packages)
+
+    def get_package(self, name):
+        for package in self.packages:
+            if package.name == name:
+                return package
+        raise KeyError(name)
+
+
+def find_repository(path=None):
+    """Return the top-level directory and the git directory of 'path'.
+
+    The parent directories are searched for '.git', without running git.
+
+    """
+    path = os.path.abspath(path or os.getcwd())
+    while True:
+        dotgit = os.path.join(path, ".git")
+        if os.path.isdir(dotgit):
+            return path, dotgit
+        if os.path.isfile(dotgit):
+            # Worktrees and submodules use a 'gitdir: <path>' file
+            with open(dotgit) as f:
+                content = f.read().strip()
+            if content.startswith("gitdir:"):
+                return path, os.path.join(path,
+                                          content[len("gitdir:"):].strip())
+        parent = os.path.dirname(path)
+        if parent == path:
+            raise RuntimeError("Not inside a git repository.")
+        path = parent
+
+
+def _as_tuple(value):
+    if not value:
+        return ()
+    if isinstance(value, basestring):
+        return (value,)
+    return tuple(value)
+
+
+def compile_config(path):
+    """Parse a configuration file and return its Config."""
+    from configobj import ConfigObj
+    parsed = ConfigObj(path)
+    packages = []
+    for name, section in parsed.get("packages", {}).items():
+        packages.append(Package(
+            name=name,
+            version_files=_as_tuple(section.get("version_file")),
+            version_templates=_as_tuple(section.get("version_template")),
+            source_dir=section.get("source_dir") or None,
+            debian_branch=section.get("debian_branch") or None))
+    return Config(path, tuple(packages))
+
+
+def _to_json(config):
+    return {"path": config.path,
+            "packages": [package._asdict() for package in config.packages]}
+
+
+def _str(value):
+    # json returns unicode, while ConfigObj returns str
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return value
+
+
+def _from_json(data):
+    packages = []
+    for package in data["packages"]:
+        packages.append(Package(
+            name=_str(package["name"]),
+            version_files=tuple(map(_str, package["version_files"])),
+            version_templates=tuple(map(_str, package["version_templates"])),
+            source_dir=_str(package["source_dir"]),
+            debian_branch=_str(package["debian_branch"])))
+    return Config(_str(data["path"]), tuple(packages))
+
+
+def get_cache_path(path):
+    """Return the cache file of a configuration file.
+
+    Returns None if the file is not inside a git repository.
+
+    """
+    try:
+        _, git_dir = find_repository(os.path.dirname(path))
+    except RuntimeError:
+        return None
+    return os.path.join(git_dir, CACHE_FILE)
+
+
+def _load_cache(cache_path, path, stat):
+    try:
+        with open(cache_path) as f:
+            data = json.load(f)
+        if data.get("version") != CACHE_VERSION or data["path"] != path or \
+           data["mtime"] != stat.st_mtime or data["size"] != stat.st_size:
+            return None
+        return _from_json(data["config"])
+    except (IOError, ValueError, KeyError, TypeError):
+        # A missing, stale or corrupted cache is parsed again
+        return None
+
+
+def _store_cache(cache_path, path, stat, config):
+    data = {"version": CACHE_VERSION, "path": path, "mtime": stat.st_mtime,
+            "size": stat.st_size, "config": _to_json(config)}
+    try:
+        fd, tmp_path = tempfile.mkstemp(prefix=CACHE_FILE + ".",
+                                        dir=os.path.dirname(cache_path))
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f)
+            os.rename(tmp_path, cache_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+    except (IOError, OSError):
+        # The cache is only an optimization, e.g. the repository may be
+        # read-only.
+        pass
+
+
+def load(path, use_cache=True):
+    """Return the Config of a configuration file, compiling it if needed."""
+    path = os.path.abspath(path)
+    cache_path = get_cache_path(path) if use_cache else None
+    if cache_path is None:
+        return compile_config(path)
+    stat = os.stat(path)
+    config = _load_cache(cache_path, path, stat)
+    if config is None:
+        config = compile_config(path)
+        _store_cache(cache_path, path, stat, config)
+    return config
@@ -33,48 +33,39 @@
 
 import os
 import re
-import subprocess
-
 import logging
-logging.basicConfig()
-
-from argparse import ArgumentParser
+import tempfile
+import subprocess
 
-os.environ["GIT_PYTHON_TRACE"] = "full"
-from devflow import utils, versioning, RC_RE
+from devflow import instrument, refs, utils, versioning, RC_RE
 from devflow.version import __version__
 from devflow.ui import query_action, query_user, query_yes_no
 from functools import wraps, partial
 from contextlib import contextmanager
-from git.exc import GitCommandError
-from sh import mktemp
 
 
 def create_temp_file(suffix):
-    create_dir_cmd = mktemp("/tmp/" + suffix + "-XXXXX")
-    return create_dir_cmd.stdout.strip()
+    fd, path = tempfile.mkstemp(prefix=suffix + "-", dir="/tmp")
+    os.close(fd)
+    return path
 
 
 def cleanup(func):
     @wraps(func)
     def wrapper(self, *args, **kwargs):
+        snapshot = refs.RefSnapshot(self.repo)
         try:
             return func(self, *args, **kwargs)
         except:
             self.log.debug("Unexpected ERROR. Cleaning up repository...")
-            self.repo.git.reset("--hard", "HEAD")
-            self.repo.git.checkout(self.start_branch)
-            self.repo.git.reset("--hard", self.start_hex)
-            for branch in self.new_branches:
-                self.repo.git.branch("-D", branch)
-            for tag in self.new_tags:
-                self.repo.git.tag("-D", tag)
+            snapshot.restore(work_tree=True)
             raise
     return wrapper
 
 
 @contextmanager
 def conflicts():
+    from git.exc import GitCommandError
     try:
         yield
     except GitCommandError as e:
@@ -127,20 +118,23 @@ def get_hotfix_version(version):
 
 
 class GitManager(object):
-    def __init__(self):
-        self.repo = utils.get_repository()
-        self.start_branch = self.repo.active_branch.name
-        self.start_hex = self.repo.head.log()[-1].newhexsha
+    def __init__(self, vcs_info=None):
+        self.vcs_info = vcs_info or utils.get_vcs_info()
+        self.repo = self.vcs_info.repo
+        self.backend = self.vcs_info.backend
+        self.start_branch = self.vcs_info.branch
+        self.start_hex = self.backend.resolve("HEAD")
         self.log = logging.getLogger("")
         self.log.setLevel(logging.DEBUG)
         self.log.info("Repository: %s. HEAD: %s", self.repo, self.start_hex)
-        self.new_branches = []
-        self.new_tags = []
         # self.repo.git.pull("origin")
 
         # Check if version is obsolete
-        versioning.check_obsolete_version()
+        versioning.check_obsolete_version(vcs_info=self.vcs_info)
+
 
+    def branch_exists(self, branch):
+        return self.backend.ref_exists("refs/heads/" + branch)
 
     def get_branch(self, mode, version):
         if mode not in ["release", "hotfix"]:
@@ -170,9 +164,9 @@ class GitManager(object):
             print "git branch -D %s" % b
 
     def __cleanup_branches(self, branches):
-        repo = self.repo
-        for b in branches:
-            repo.git.branch("-D", b)
+        with refs.RefTransaction(self.repo) as transaction:
+            for b in branches:
+                transaction.delete_branch(b)
 
     def cleanup_branches(self, branches, args, default=False):
         if args.cleanup is not None:
@@ -199,7 +193,11 @@ class GitManager(object):
 
     def _merge_branches(self, branch_to, branch_from):
         repo = self.repo
-        cur_branch = repo.active_branch.name
+        cur_branch = self.backend.head_branch()
+        if cur_branch != branch_to:
+            # Merge in the object database, unless there are conflicts
+            if refs.merge_branches(repo, branch_to, branch_from) is not None:
+                return
         repo.git.checkout(branch_to)
         with conflicts():
             repo.git.merge("--no-ff", branch_from)
@@ -211,11 +209,12 @@ class GitManager(object):
         self.doit(action_yes=action, question=question, args=args,
                   default=default)
 
-    def edit_changelog(self, branch, base_branch=None):
+    def edit_changelog(self, branch, base_branch=None, no_merges=False,
+                       unique_subjects=False):
         repo = self.repo
-        if branch not in repo.branches:
+        if not self.branch_exists(branch):
             raise ValueError("Branch %s does not exist." % branch)
-        if base_branch and base_branch not in repo.branches:
+        if base_branch and not self.branch_exists(base_branch):
             raise ValueError("Branch %s does not exist." % base_branch)
 
         repo.git.checkout(branch)
@@ -225,19 +224,19 @@ class GitManager(object):
         lines = []
         lines.append("#Changelog for %s\n" % branch)
         if base_branch:
-            commits = repo.git.rev_list(
-                "%s..%s" % (base_branch, branch)).split("\n")
-            for c in commits:
-                commit = repo.commit(c)
-                lines.append("* " + commit.message.split("\n")[0])
+            log_args = ["%s..%s" % (base_branch, branch)]
+            if no_merges:
+                log_args.append("--no-merges")
+            seen = set()
+            for subject in self.backend.log_subjects(*log_args):
+                if unique_subjects:
+                    if subject in seen:
+                        continue
+                    seen.add(subject)
+                lines.append("* %s\n" % subject)
         lines.append("\n")
 
-        f = open(changelog, 'r+')
-        lines.extend(f.readlines())
-        f.seek(0)
-        f.truncate(0)
-        f.writelines(lines)
-        f.close()
+        utils.prepend_file(changelog, "".join(lines))
 
         subprocess.check_call(['editor', changelog])
         repo.git.add(changelog)
@@ -266,17 +265,14 @@ class GitManager(object):
         upstream_branch = self.get_branch("release", version)
         debian_branch = self.get_debian_branch("release", version)
 
-        # create release branch
-        repo.git.branch(upstream_branch, upstream)
-        self.new_branches.append(upstream_branch)
+        # create release and debian release branches
+        with refs.RefTransaction(repo) as transaction:
+            transaction.create_branch(upstream_branch, upstream)
+            transaction.create_branch(debian_branch, debian)
+
         repo.git.checkout(upstream_branch)
         versioning.bump_version(rc_version)
 
-        # create debian release branch
-        repo.git.checkout(debian)
-        repo.git.branch(debian_branch, debian)
-        self.new_branches.append(debian_branch)
-
         repo.git.checkout(upstream_branch)
         repo.git.checkout(debian)
 
@@ -311,17 +307,14 @@ class GitManager(object):
         upstream_branch = self.get_branch("hotfix", version)
         debian_branch = self.get_debian_branch("hotfix", version)
 
-        # create hotfix branch
-        repo.git.branch(upstream_branch, upstream)
-        self.new_branches.append(upstream_branch)
+        # create hotfix and debian hotfix branches
+        with refs.RefTransaction(repo) as transaction:
+            transaction.create_branch(upstream_branch, upstream)
+            transaction.create_branch(debian_branch, debian)
+
         repo.git.checkout(upstream_branch)
         versioning.bump_version(rc_version)
 
-        # create debian hotfix branch
-        repo.git.checkout(debian)
-        repo.git.branch(debian_branch, debian)
-        self.new_branches.append(debian_branch)
-
         repo.git.checkout(upstream_branch)
         repo.git.checkout(debian)
 
@@ -345,7 +338,9 @@ class GitManager(object):
         tag = upstream_branch
         debian_tag = "debian/" + tag
 
-        edit_action = partial(self.edit_changelog, upstream_branch, "develop")
+        edit_action = partial(self.edit_changelog, upstream_branch, "develop",
+                              no_merges=args.changelog_no_merges,
+                              unique_subjects=args.changelog_unique)
         self.check_edit_changelog(edit_action, args, default=True)
 
         vcs = utils.get_vcs_info()
@@ -359,10 +354,9 @@ class GitManager(object):
         self._merge_branches(debian_master, debian_branch)
 
         # create tags
-        repo.git.checkout(master)
-        repo.git.tag("%s" % tag)
-        repo.git.checkout(debian)
-        repo.git.tag("%s" % debian_tag)
+        with refs.RefTransaction(repo) as transaction:
+            transaction.create_tag(tag, master)
+            transaction.create_tag(debian_tag, debian)
 
         # merge release changes to upstream
         self.merge_branches(upstream, upstream_branch, args, default=True)
@@ -399,31 +393,32 @@ class GitManager(object):
         repo = self.repo
         feature_upstream = "feature-%s" % feature_name
         feature_debian = "debian-%s" % feature_upstream
-        repo.git.branch(feature_upstream, "develop")
-        self.new_branches.append(feature_upstream)
-        repo.git.branch(feature_debian, "debian-develop")
-        self.new_branches.append(feature_debian)
+        with refs.RefTransaction(repo) as transaction:
+            transaction.create_branch(feature_upstream, "develop")
+            transaction.create_branch(feature_debian, "debian-develop")
 
     @cleanup
     def end_feature(self, args):
         feature_name = args.feature_name
         repo = self.repo
         feature_upstream = "feature-%s" % feature_name
-        if feature_upstream not in repo.branches:
+        if not self.branch_exists(feature_upstream):
             raise ValueError("Branch %s does not exist." % feature_upstream)
         feature_debian = "debian-%s" % feature_upstream
 
-        edit_action = partial(self.edit_changelog, feature_upstream, "develop")
+        edit_action = partial(self.edit_changelog, feature_upstream, "develop",
+                              no_merges=args.changelog_no_merges,
+                              unique_subjects=args.changelog_unique)
         self.check_edit_changelog(edit_action, args, default=True)
 
         # merge to develop
         self._merge_branches("develop", feature_upstream)
-        if feature_debian in repo.branches:
+        if self.branch_exists(feature_debian):
             self._merge_branches("debian-develop", feature_debian)
         repo.git.checkout("develop")
 
         branches = [feature_upstream]
-        if feature_debian in repo.branches:
+        if self.branch_exists(feature_debian):
             branches.append(feature_debian)
         self.cleanup_branches(branches, args, default=True)
 
@@ -433,12 +428,22 @@ def refhead(repo):
 
 
 def main():
+    from argparse import ArgumentParser
+
     parser = ArgumentParser(description="Devflow tool")
     parser.add_argument('-V', '--version', action='version',
                         version='devflow-flow %s' % __version__)
     parser.add_argument(
         '-d', '--defaults', action='store_true', default=False,
         help="Assume default on every choice, unless a value is provided")
+    parser.add_argument(
+        '--trace', action='store_true', default=False,
+        help="Print a summary of the git commands that were run, with their"
+             " count and latency. Also enabled by DEVFLOW_TRACE")
+    parser.add_argument(
+        '--trace-file', type=str, default=None,
+        help="Write every git command that was run, with its wall time and"
+             " exit status, to this file as JSON")
 
     subparsers = parser.add_subparsers()
 
@@ -467,6 +472,12 @@ def main():
     feature_finish_parser.add_argument(
         '--no-edit-changelog', action='store_const', const=False,
         dest='edit_changelog', help="Do not edit the changelog")
+    feature_finish_parser.add_argument(
+        '--changelog-no-merges', action='store_true', default=False,
+        help="Do not list merge commits in the changelog")
+    feature_finish_parser.add_argument(
+        '--changelog-unique', action='store_true', default=False,
+        help="List each commit subject in the changelog only once")
     feature_finish_parser.add_argument(
         '--no-cleanup', action='store_const', const=True, dest='cleanup',
         help="Do not cleanup branches")
@@ -489,6 +500,12 @@ def main():
     release_finish_parser.add_argument(
         '--no-edit-changelog', action='store_const', const=False,
         dest='edit_changelog', help="Do not edit the changelog")
+    release_finish_parser.add_argument(
+        '--changelog-no-merges', action='store_true', default=False,
+        help="Do not list merge commits in the changelog")
+    release_finish_parser.add_argument(
+        '--changelog-unique', action='store_true', default=False,
+        help="List each commit subject in the changelog only once")
     release_finish_parser.add_argument(
         '--no-cleanup', action='store_const', const=True, dest='cleanup',
         help="Do not cleanup branches")
@@ -520,8 +537,13 @@ def main():
 
     args = parser.parse_args()
 
-    gm = GitManager()
-    getattr(gm, args.func)(args)
+    logging.basicConfig()
+    # GitPython logs every command it runs at the DEBUG level
+    logging.getLogger("git").setLevel(logging.INFO)
+
+    with instrument.tracing(args.trace, args.trace_file):
+        gm = GitManager(utils.get_vcs_info())
+        getattr(gm, args.func)(args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,339 @@
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+
+"""Git access layer used by devflow.
+
+Most of the git queries devflow performs are read-only lookups: resolving
+refs, reading a blob or the metadata of a commit. Running a git command for
+each one of them means forking hundreds of processes during a single
+devflow-autopkg or devflow-flow run.
+
+This module provides backends that serve these queries. The default one
+keeps long-lived 'git cat-file --batch' and 'git cat-file --batch-check'
+processes open and talks to them over pipes. The backend can be selected
+with the DEVFLOW_GIT_BACKEND environment variable, which accepts one of the
+keys of BACKENDS.
+
+Functions registered with add_hook() are called after every git command a
+backend runs, e.g. to count or trace them.
+
+"""
+
+import os
+import time
+import atexit
+import subprocess
+from collections import namedtuple
+from contextlib import contextmanager
+
+
+Commit = namedtuple("Commit", ["hexsha", "tree", "parents", "author",
+                               "committer", "message"])
+
+
+def parse_commit(hexsha, data):
+    """Parse the raw contents of a commit object."""
+    headers, _, message = data.partition("\n\n")
+    tree = None
+    parents = []
+    author = committer = None
+    for line in headers.split("\n"):
+        key, _, value = line.partition(" ")
+        if key == "tree":
+            tree = value
+        elif key == "parent":
+            parents.append(value)
+        elif key == "author":
+            author = value
+        elif key == "committer":
+            committer = value
+    return Commit(hexsha=hexsha, tree=tree, parents=parents, author=author,
+                  committer=committer, message=message)
+
+
+_hooks = []
+
+
+def add_hook(hook):
+    """Call 'hook(args, wall, status)' after every git command of a backend.
+
+    'args' is the command line, without the --git-dir option, 'wall' the
+    time the command took and 'status' its exit status. The long-lived
+    processes of the batch backend are reported once, when they start.
+
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+@contextmanager
+def _notify_hooks(args):
+    if not _hooks:
+        yield
+        return
+    start = time.time()
+    status = 0
+    try:
+        yield
+    except subprocess.CalledProcessError as e:
+        status = e.returncode
+        raise
+    except Exception:
+        status = -1
+        raise
+    finally:
+        for hook in list(_hooks):
+            hook(["git"] + list(args), time.time() - start, status)
+
+
+class GitBackend(object):
+    """Serve read-only git queries by running one git command per query.
+
+    Subclasses may override 'resolve' and 'read_object' to serve the
+    queries more efficiently.
+
+    """
+    def __init__(self, git_dir):
+        self.git_dir = git_dir
+
+    def _command(self, *args):
+        return ["git", "--git-dir=%s" % self.git_dir] + list(args)
+
+    def _output(self, *args):
+        with _notify_hooks(args):
+            return subprocess.check_output(self._command(*args))
+
+    def _stream(self, *args):
+        """Yield the output lines of a git command, as it produces them."""
+        with _notify_hooks(args):
+            proc = subprocess.Popen(self._command(*args),
+                                    stdout=subprocess.PIPE)
+            try:
+                for line in iter(proc.stdout.readline, ""):
+                    yield line.rstrip("\n")
+            finally:
+                proc.stdout.close()
+                status = proc.wait()
+            if status != 0:
+                raise subprocess.CalledProcessError(status, args)
+
+    def close(self):
+        pass
+
+    def run(self, *args, **kwargs):
+        """Run a git command and return its output.
+
+        The 'input' keyword argument is written to the standard input of
+        the command. A CalledProcessError, including the error output of
+        git, is raised if the command fails.
+
+        """
+        with _notify_hooks(args):
+            proc = subprocess.Popen(self._command(*args),
+                                    stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+            out, err = proc.communicate(kwargs.get("input"))
+            if proc.returncode != 0:
+                raise subprocess.CalledProcessError(proc.returncode, args,
+                                                    err.strip())
+            return out
+
+    def resolve(self, rev):
+        """Return the object id 'rev' points to, or None."""
+        args = ("rev-parse", "--verify", "--quiet", rev)
+        # A missing revision is an answer, not a failure of the command
+        with _notify_hooks(args):
+            try:
+                with open(os.devnull, "w") as devnull:
+                    out = subprocess.check_output(self._command(*args),
+                                                  stderr=devnull)
+            except subprocess.CalledProcessError:
+                return None
+        return out.strip()
+
+    def read_object(self, rev):
+        """Return a (hexsha, type, contents) tuple for 'rev', or None."""
+        hexsha = self.resolve(rev)
+        if hexsha is None:
+            return None
+        objtype = self._output("cat-file", "-t", hexsha).strip()
+        return hexsha, objtype, self._output("cat-file", objtype, hexsha)
+
+    def ref_exists(self, ref):
+        """Check whether a full ref name, e.g. 'refs/heads/master', exists."""
+        return self.resolve(ref) is not None
+
+    def read_blob(self, rev):
+        """Return the contents of a blob, e.g. 'HEAD:version', or None."""
+        obj = self.read_object(rev)
+        if obj is None or obj[1] != "blob":
+            return None
+        return obj[2]
+
+    def read_commit(self, rev):
+        """Return the Commit 'rev' points to."""
+        obj = self.read_object(rev + "^{commit}")
+        if obj is None:
+            raise ValueError("Unknown commit '%s'" % rev)
+        return parse_commit(obj[0], obj[2])
+
+    def head_branch(self):
+        """Return the name of the checked out branch.
+
+        The HEAD file is read directly, instead of running 'git symbolic-ref'.
+        None is returned if HEAD is detached.
+
+        """
+        with open(os.path.join(self.git_dir, "HEAD")) as f:
+            head = f.read().strip()
+        prefix = "ref: refs/heads/"
+        if head.startswith(prefix):
+            return head[len(prefix):]
+        return None
+
+    def list_refs(self, *prefixes):
+        """Return a list of (refname, hexsha) tuples for refs under prefixes.
+
+        The refs under all prefixes are listed with a single command.
+
+        """
+        out = self._output("for-each-ref", "--format=%(refname) %(objectname)",
+                           *prefixes)
+        return [tuple(line.split(" ", 1)) for line in out.splitlines()]
+
+    def rev_list(self, *args):
+        """Yield the commit ids printed by 'git rev-list'."""
+        return self._stream("rev-list", *args)
+
+    def log_subjects(self, *args):
+        """Yield the subjects of the commits listed by 'git log'."""
+        return self._stream("log", "--format=%s", *args)
+
+    def count_commits(self, *args):
+        """Return the output of 'git rev-list --count' as an integer."""
+        return int(self._output("rev-list", "--count", *args))
+
+
+class BatchBackend(GitBackend):
+    """Serve object lookups through long-lived 'git cat-file' processes."""
+    def __init__(self, git_dir):
+        super(BatchBackend, self).__init__(git_dir)
+        self._batch = None
+        self._batch_check = None
+
+    def _spawn(self, option):
+        with _notify_hooks(("cat-file", option)):
+            return subprocess.Popen(self._command("cat-file", option),
+                                    stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE)
+
+    def _request(self, proc, rev):
+        if "\n" in rev:
+            raise ValueError("Invalid revision '%s'" % rev)
+        proc.stdin.write(rev + "\n")
+        proc.stdin.flush()
+        header = proc.stdout.readline()
+        if not header:
+            raise RuntimeError("git cat-file exited unexpectedly")
+        header = header.rstrip("\n")
+        # '<rev> missing' or '<rev> ambiguous', where 'rev' may have spaces
+        if header.endswith((" missing", " ambiguous")):
+            return None
+        hexsha, objtype, size = header.rsplit(" ", 2)
+        return hexsha, objtype, int(size)
+
+    def close(self):
+        for proc in (self._batch, self._batch_check):
+            if proc is not None and proc.poll() is None:
+                proc.stdin.close()
+                proc.wait()
+        self._batch = self._batch_check = None
+
+    def resolve(self, rev):
+        if self._batch_check is None:
+            self._batch_check = self._spawn("--batch-check")
+        info = self._request(self._batch_check, rev)
+        return info[0] if info is not None else None
+
+    def read_object(self, rev):
+        if self._batch is None:
+            self._batch = self._spawn("--batch")
+        info = self._request(self._batch, rev)
+        if info is None:
+            return None
+        hexsha, objtype, size = info
+        data = self._batch.stdout.read(size)
+        # Each object is followed by a newline
+        self._batch.stdout.read(1)
+        return hexsha, objtype, data
+
+
+BACKENDS = {
+    "subprocess": GitBackend,
+    "batch": BatchBackend,
+}
+DEFAULT_BACKEND = "batch"
+
+_backends = {}
+
+
+def get_backend(repo):
+    """Return the backend serving the git queries for a repository.
+
+    Backends are shared per git directory, so that all devflow helpers
+    running in the same process reuse the same git processes.
+
+    """
+    git_dir = os.path.abspath(repo.git_dir)
+    backend = _backends.get(git_dir)
+    if backend is None:
+        name = os.environ.get("DEVFLOW_GIT_BACKEND", DEFAULT_BACKEND)
+        try:
+            backend_class = BACKENDS[name]
+        except KeyError:
+            raise ValueError("Unknown git backend '%s'. Available backends:"
+                             " %s" % (name, ", ".join(sorted(BACKENDS))))
+        backend = _backends[git_dir] = backend_class(git_dir)
+    return backend
+
+
+@atexit.register
+def close_backends():
+    """Terminate the processes of all backends."""
+    for backend in _backends.values():
+        backend.close()
+    _backends.clear()
@@ -0,0 +1,333 @@
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+
+"""Per-phase timing and tracing of devflow commands.
+
+A PhaseTimer splits a run in consecutive phases and records the wall clock
+time, the CPU time of the process and its children, and the number of git
+subprocesses spawned in each of them. Git subprocesses are counted inside
+a counting() block.
+
+A GitTracer, enabled inside a tracing() block, records the arguments, wall
+time and exit status of every git command and summarizes them per git
+subcommand. Tracing is off by default; the devflow tools enable it with
+their --trace option or the DEVFLOW_TRACE environment variable.
+
+The commands of devflow.gitbackend are observed through its hooks, while
+the command execution of GitPython is wrapped for the duration of the
+block. Both are restored when the block exits, even if it raises.
+
+"""
+
+import os
+import sys
+import json
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from devflow import gitbackend
+
+
+_git_commands = [0]
+
+
+def git_command_count():
+    """Return the number of git subprocesses spawned in counting() blocks."""
+    return _git_commands[0]
+
+
+@contextmanager
+def _wrapped_execute(wrap):
+    """Replace the command execution of GitPython with wrap(execute)."""
+    import git
+    execute = vars(git.cmd.Git)["execute"]
+    git.cmd.Git.execute = wrap(execute)
+    try:
+        yield
+    finally:
+        git.cmd.Git.execute = execute
+
+
+@contextmanager
+def _backend_hook(hook):
+    gitbackend.add_hook(hook)
+    try:
+        yield
+    finally:
+        gitbackend.remove_hook(hook)
+
+
+def _counting(func):
+    def wrapper(*args, **kwargs):
+        _git_commands[0] += 1
+        return func(*args, **kwargs)
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+def _count_command(args, wall, status):  # pylint: disable=W0613
+    _git_commands[0] += 1
+
+
+@contextmanager
+def counting():
+    """Count the git subprocesses of GitPython and of the git backends."""
+    with _wrapped_execute(_counting), _backend_hook(_count_command):
+        yield
+
+
+def _cpu_time():
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+
+class PhaseTimer(object):
+    """Record consecutive phases of a run.
+
+    start() ends the running phase, if any, and starts a new one; stop()
+    ends the running phase. A phase that is started again accumulates.
+
+    """
+    def __init__(self):
+        self.phases = OrderedDict()
+        self.extra = OrderedDict()
+        self._current = None
+        self._start = None
+
+    def _sample(self):
+        return (time.time(), _cpu_time(), git_command_count())
+
+    def start(self, name):
+        self.stop()
+        self._current = name
+        self._start = self._sample()
+
+    def stop(self):
+        if self._current is None:
+            return
+        end = self._sample()
+        phase = self.phases.setdefault(
+            self._current, OrderedDict([("wall", 0.0), ("cpu", 0.0),
+                                        ("git_commands", 0)]))
+        phase["wall"] += end[0] - self._start[0]
+        phase["cpu"] += end[1] - self._start[1]
+        phase["git_commands"] += end[2] - self._start[2]
+        self._current = None
+        self._start = None
+
+    def report(self):
+        """Return the timings as a dictionary that can be dumped to JSON."""
+        self.stop()
+        total = OrderedDict()
+        for field in ("wall", "cpu", "git_commands"):
+            total[field] = sum(p[field] for p in self.phases.values())
+        report = OrderedDict([("phases", self.phases), ("total", total)])
+        report.update(self.extra)
+        return report
+
+    def write_report(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+            f.write("\n")
+
+    def format_table(self):
+        """Return a summary table of the phases."""
+        report = self.report()
+        rows = list(report["phases"].items()) + [("total", report["total"])]
+        width = max([len("phase")] + [len(name) for name, _ in rows])
+        lines = ["%-*s %10s %10s %6s" % (width, "phase", "wall (s)",
+                                         "cpu (s)", "git")]
+        for name, phase in rows:
+            lines.append("%-*s %10.2f %10.2f %6d"
+                         % (width, name, phase["wall"], phase["cpu"],
+                            phase["git_commands"]))
+        return "\n".join(lines)
+
+
+def git_subcommand(args):
+    """Return the git subcommand of a command line, e.g. 'rev-parse'."""
+    args = list(args)
+    if args and os.path.basename(args[0]) == "git":
+        args = args[1:]
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in ("-c", "-C"):
+            skip = True
+        elif not arg.startswith("-"):
+            return arg
+    return None
+
+
+class GitTracer(object):
+    """Record the git commands of a run."""
+    def __init__(self, trace_file=None):
+        self.records = []
+        self.trace_file = trace_file
+
+    def record(self, args, wall, status):
+        self.records.append(OrderedDict([("args", list(args)),
+                                         ("wall", wall),
+                                         ("status", status)]))
+
+    def summary(self):
+        """Return the count, total and max latency of each git command.
+
+        Commands are sorted by total time, slowest first.
+
+        """
+        commands = {}
+        for record in self.records:
+            name = git_subcommand(record["args"]) or "git"
+            stats = commands.setdefault(name, OrderedDict(
+                [("count", 0), ("total", 0.0), ("max", 0.0),
+                 ("failed", 0)]))
+            stats["count"] += 1
+            stats["total"] += record["wall"]
+            stats["max"] = max(stats["max"], record["wall"])
+            if record["status"]:
+                stats["failed"] += 1
+        return OrderedDict(sorted(commands.items(),
+                                  key=lambda item: -item[1]["total"]))
+
+    def format_summary(self):
+        summary = self.summary()
+        width = max([len("command")] + [len(name) for name in summary])
+        lines = ["%-*s %6s %10s %10s %6s" % (width, "command", "count",
+                                             "total (s)", "max (s)",
+                                             "failed")]
+        for name, stats in summary.items():
+            lines.append("%-*s %6d %10.3f %10.3f %6d"
+                         % (width, name, stats["count"], stats["total"],
+                            stats["max"], stats["failed"]))
+        return "\n".join(lines)
+
+    def write(self, path):
+        """Write the summary and all records to 'path' as JSON."""
+        with open(path, "w") as f:
+            json.dump(OrderedDict([("summary", self.summary()),
+                                   ("commands", self.records)]), f, indent=2)
+            f.write("\n")
+
+
+_tracer = []
+
+
+def get_tracer():
+    """Return the active GitTracer, or None if tracing is disabled."""
+    return _tracer[-1] if _tracer else None
+
+
+def _exit_status(error):
+    for attr in ("status", "returncode"):
+        status = getattr(error, attr, None)
+        if isinstance(status, int):
+            return status
+    return -1
+
+
+def _tracing(tracer):
+    """Return a wrapper of GitPython's execute, recording to 'tracer'."""
+    def wrap(func):
+        def wrapper(self, command, *args, **kwargs):
+            start = time.time()
+            status = 0
+            try:
+                result = func(self, command, *args, **kwargs)
+                if kwargs.get("with_extended_output") and \
+                   isinstance(result, tuple):
+                    status = result[0]
+                return result
+            except Exception as e:
+                status = _exit_status(e)
+                raise
+            finally:
+                tracer.record(command, time.time() - start, status)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return wrap
+
+
+def trace_enabled(enable=False, trace_file=None):
+    """Return whether tracing is requested, and the file to write it to.
+
+    DEVFLOW_TRACE may be '1', or the name of the file to write the trace to.
+    Tracing is also requested by a trace file.
+
+    """
+    env = os.environ.get("DEVFLOW_TRACE", "")
+    if env and env != "0":
+        enable = True
+        if env != "1" and trace_file is None:
+            trace_file = env
+    return enable or trace_file is not None, trace_file
+
+
+@contextmanager
+def tracing(enable=False, trace_file=None, stream=None):
+    """Trace the git commands of GitPython and of the git backends.
+
+    Tracing is enabled if requested, or if DEVFLOW_TRACE is set. The block
+    gets the GitTracer, or None if tracing is disabled. When the block
+    exits, the summary is printed to 'stream', stderr by default, and the
+    trace file is written.
+
+    """
+    enable, trace_file = trace_enabled(enable, trace_file)
+    if not enable:
+        yield None
+        return
+    tracer = GitTracer(trace_file)
+    _tracer.append(tracer)
+    try:
+        with _wrapped_execute(_tracing(tracer)), _backend_hook(tracer.record):
+            yield tracer
+    finally:
+        _tracer.remove(tracer)
+        report_tracing(tracer, stream)
+
+
+def report_tracing(tracer, stream=None):
+    """Print the summary of a tracer and write its trace file, if any."""
+    if tracer is None:
+        return
+    stream = stream or sys.stderr
+    stream.write(tracer.format_summary() + "\n")
+    if tracer.trace_file:
+        tracer.write(tracer.trace_file)
+        stream.write("Git trace written to '%s'\n" % tracer.trace_file)
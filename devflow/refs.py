@@ -0,0 +1,310 @@
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+
+"""Atomic, batched ref updates.
+
+Creating branches and tags one 'git branch' or 'git tag' command at a time
+forks a process per ref, and a failure half-way leaves only some of the
+refs behind. A RefTransaction collects the planned ref creations, updates
+and deletions and applies all of them with a single
+'git update-ref --stdin' command, which either updates every ref or none.
+
+Annotated and signed tags need a tag object, which is written with
+'git mktag' before the transaction is committed. Merges of branches that
+are not checked out are computed and committed the same way, without a
+work tree.
+
+"""
+
+import subprocess
+
+from devflow import gitbackend
+
+
+class RefTransaction(object):
+    """Collect ref updates and apply them in a single transaction.
+
+    Revisions are resolved when an update is planned, so later changes to
+    the refs they name do not affect the transaction. The transaction can
+    also be used as a context manager, which commits it on success.
+
+    """
+    def __init__(self, repo):
+        self.repo = repo
+        self.backend = gitbackend.get_backend(repo)
+        self.commands = []
+        self.refs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+
+    def __len__(self):
+        return len(self.commands)
+
+    def resolve(self, rev):
+        hexsha = self.backend.resolve(rev)
+        if hexsha is None:
+            raise ValueError("Unknown revision '%s'" % rev)
+        return hexsha
+
+    def _add(self, command, ref, *values):
+        if "\n" in ref or " " in ref:
+            raise ValueError("Invalid ref name '%s'" % ref)
+        if ref in self.refs:
+            raise ValueError("Ref '%s' is updated twice in the same"
+                             " transaction" % ref)
+        self.refs.append(ref)
+        self.commands.append(" ".join((command, ref) +
+                                      tuple(v for v in values if v)))
+
+    def create(self, ref, rev):
+        """Create 'ref', which must not exist, pointing to 'rev'."""
+        self._add("create", ref, self.resolve(rev))
+
+    def update(self, ref, rev, old_rev=None):
+        """Point 'ref' to 'rev', optionally verifying its old value."""
+        old = self.resolve(old_rev) if old_rev is not None else None
+        self._add("update", ref, self.resolve(rev), old)
+
+    def delete(self, ref, old_rev=None):
+        """Delete 'ref', optionally verifying its old value."""
+        old = self.resolve(old_rev) if old_rev is not None else None
+        self._add("delete", ref, old)
+
+    def create_branch(self, name, rev):
+        self.create("refs/heads/" + name, rev)
+
+    def delete_branch(self, name):
+        self.delete("refs/heads/" + name)
+
+    def create_tag(self, name, rev, message=None, sign=False, keyid=None):
+        """Create tag 'name' pointing to 'rev'.
+
+        A lightweight tag is created, unless a message is given or the tag
+        is signed, in which case the tag object is written right away.
+
+        """
+        target = self.resolve(rev)
+        if message is not None or sign or keyid:
+            target = write_tag_object(self.repo, name, target,
+                                      message or "", sign=sign, keyid=keyid)
+        self._add("create", "refs/tags/" + name, target)
+
+    def delete_tag(self, name):
+        self.delete("refs/tags/" + name)
+
+    def commit(self):
+        """Apply all collected updates at once."""
+        if not self.commands:
+            return
+        self.backend.run("update-ref", "--stdin",
+                         input="".join(c + "\n" for c in self.commands))
+        self.commands = []
+        self.refs = []
+
+
+# Refs saved by a RefSnapshot
+SNAPSHOT_PREFIXES = ("refs/heads/", "refs/tags/")
+
+
+class RefSnapshot(object):
+    """Save the refs of a repository, to restore them after a failure.
+
+    The refs are listed with a single 'git for-each-ref' and restored in a
+    single transaction, which deletes the refs created since the snapshot,
+    recreates the deleted ones and moves back the updated ones. The cost
+    depends neither on the size of the reflogs nor on the number of refs
+    that changed.
+
+    """
+    def __init__(self, repo, prefixes=SNAPSHOT_PREFIXES):
+        self.repo = repo
+        self.backend = gitbackend.get_backend(repo)
+        self.prefixes = prefixes
+        self.refs = dict(self.backend.list_refs(*prefixes))
+        self.head_branch = self.backend.head_branch()
+        self.head = self.backend.resolve("HEAD")
+
+    def restore(self, work_tree=False):
+        """Restore the saved refs and return the number of changed refs.
+
+        If 'work_tree' is set, the branch or commit that was checked out is
+        checked out again, discarding any changes in the work tree.
+
+        """
+        current = dict(self.backend.list_refs(*self.prefixes))
+        with RefTransaction(self.repo) as transaction:
+            for ref, hexsha in sorted(current.items()):
+                old = self.refs.get(ref)
+                if old is None:
+                    transaction.delete(ref, hexsha)
+                elif old != hexsha:
+                    transaction.update(ref, old, hexsha)
+            for ref, hexsha in sorted(self.refs.items()):
+                if ref not in current:
+                    transaction.create(ref, hexsha)
+            changed = len(transaction)
+        if work_tree:
+            self.repo.git.checkout("-f", self.head_branch or self.head)
+        return changed
+
+
+def merge_branches(repo, branch_to, branch_from, message=None):
+    """Merge 'branch_from' into 'branch_to' without touching the work tree.
+
+    The merge is computed in the object database with
+    'git merge-tree --write-tree', committed with 'git commit-tree' and
+    'branch_to' is updated in a transaction that verifies its old value.
+    Like 'git merge --no-ff', a merge commit is always created, unless
+    'branch_from' is already merged.
+
+    Returns the new head of 'branch_to', or None if the merge has conflicts,
+    or this version of git cannot merge without a work tree. The caller
+    must then merge in a work tree.
+
+    """
+    backend = gitbackend.get_backend(repo)
+    ours = backend.resolve("refs/heads/" + branch_to)
+    theirs = backend.resolve("refs/heads/" + branch_from)
+    if ours is None or theirs is None:
+        raise ValueError("Branch %s does not exist."
+                         % (branch_to if ours is None else branch_from))
+
+    if message is None:
+        message = "Merge branch '%s' into %s" % (branch_from, branch_to)
+    commit = merge_commit(repo, ours, theirs, message)
+    if commit is not None and commit != ours:
+        with RefTransaction(repo) as transaction:
+            transaction.update("refs/heads/" + branch_to, commit, ours)
+    return commit
+
+
+def merge_commit(repo, ours, theirs, message, fast_forward=False,
+                 sign=None):
+    """Return the commit merging commit 'theirs' into commit 'ours'.
+
+    The commit is created in the object database, without updating any ref.
+    This is 'ours' if 'theirs' is already merged, or 'theirs' if
+    'fast_forward' is set and 'ours' is one of its ancestors, as with
+    'git merge'. Returns None if the merge has conflicts, or this version
+    of git cannot merge without a work tree.
+
+    The commit is signed if 'sign' is set or, by default, if the
+    'commit.gpgSign' option of git is set, as 'git merge' does.
+
+    """
+    backend = gitbackend.get_backend(repo)
+    base = backend.run("merge-base", "--all", ours, theirs).split()
+    if theirs in base:
+        # Already up to date
+        return ours
+    if fast_forward and ours in base:
+        return theirs
+
+    try:
+        # Fails with conflicts, or with versions of git before 2.38
+        out = backend.run("merge-tree", "--write-tree", ours, theirs)
+    except subprocess.CalledProcessError:
+        return None
+    tree = out.split()[0]
+    if sign is None:
+        sign = get_bool_option(repo, "commit.gpgSign")
+    args = ["commit-tree", tree, "-p", ours, "-p", theirs]
+    if sign:
+        args.append("-S")
+    return backend.run(*args, input=message + "\n").strip()
+
+
+def get_bool_option(repo, name):
+    """Return the value of a boolean option of git, False if it is unset."""
+    try:
+        value = gitbackend.get_backend(repo).run("config", "--bool", name)
+    except subprocess.CalledProcessError:
+        return False
+    return value.strip() == "true"
+
+
+def get_tagger(repo):
+    """Return the identity and date of the tagger of a new tag object."""
+    return repo.git.var("GIT_COMMITTER_IDENT")
+
+
+def write_tag_object(repo, name, target, message, sign=False, keyid=None,
+                     tagger=None):
+    """Write an annotated tag object for commit 'target' and return its id.
+
+    If 'sign' is set or a key is given, the tag is signed with gpg, the
+    same way 'git tag -s' or 'git tag -u <keyid>' would sign it.
+
+    """
+    tagger = tagger or get_tagger(repo)
+    payload = "object %s\ntype commit\ntag %s\ntagger %s\n\n%s" % (
+        target, name, tagger, message.strip() + "\n" if message else "")
+    if sign or keyid:
+        payload += sign_payload(repo, payload,
+                                keyid or get_signing_key(repo, tagger))
+    backend = gitbackend.get_backend(repo)
+    return backend.run("mktag", input=payload).strip()
+
+
+def _get_config(repo, name, default=None):
+    from git import GitCommandError
+    try:
+        return repo.git.config(name)
+    except GitCommandError:
+        return default
+
+
+def get_signing_key(repo, tagger):
+    """Return the key 'git tag -s' would sign with.
+
+    This is user.signingkey, or the name and email of the tagger.
+
+    """
+    return _get_config(repo, "user.signingkey") or \
+        tagger[:tagger.rindex(">") + 1]
+
+
+def sign_payload(repo, payload, keyid):
+    """Return an armored detached signature of 'payload'."""
+    program = _get_config(repo, "gpg.program", "gpg")
+    proc = subprocess.Popen([program, "-bsau", keyid],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    signature, _ = proc.communicate(payload)
+    if proc.returncode != 0 or not signature:
+        raise RuntimeError("Failed to sign tag with key '%s'" % keyid)
+    return signature
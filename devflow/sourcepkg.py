@@ -0,0 +1,259 @@
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+
+"""Building of the packages in subdirectories of a repository.
+
+Packages of devflow.conf with a 'source_dir' are independent Debian source
+packages. devflow-autopkg builds each one of them in a worker process, in
+its own shared clone of the build repository, with dpkg-buildpackage.
+
+"""
+
+import os
+import sys
+import shutil
+import tarfile
+import subprocess
+import traceback
+
+from collections import OrderedDict
+from multiprocessing import Pool
+
+from devflow import changelog
+from devflow import gitbackend
+from devflow import instrument
+from devflow import ui
+from devflow import utils
+from devflow import versioning
+
+
+def get_source_packages(config):
+    """Return the packages of devflow.conf with their own 'source_dir'.
+
+    These are independent Debian source packages in subdirectories of the
+    repository, optionally with their own 'debian_branch'.
+
+    """
+    source_packages = OrderedDict()
+    for package in config.packages:
+        if package.source_dir:
+            source_packages[package.name] = package
+    return source_packages
+
+
+def start_source_packages(repo, source_packages, package_branches, repo_dir,
+                          build_dir, mode, branch, options, distribution,
+                          print_green):
+    """Start building the packages in subdirectories in worker processes.
+
+    Each package is built in its own shared clone of the build repository,
+    with its own build directory and log file. The commits to build are
+    resolved here, so that the workers are not affected by later commits
+    in the build repository. Returns the pool and the pending results.
+
+    """
+    jobs = []
+    for name, package in source_packages.items():
+        debian_branch = package_branches[name]
+        jobs.append({"package": name,
+                     "source_dir": package.source_dir.strip("/"),
+                     "debian_branch": debian_branch,
+                     "debian_commit": repo.commit(debian_branch).hexsha,
+                     "branch": branch,
+                     "branch_commit": repo.commit(branch).hexsha,
+                     "mode": mode,
+                     "distribution": distribution,
+                     "source_repo_dir": repo_dir,
+                     "repo_dir": "%s-%s" % (repo_dir, name),
+                     "build_dir": os.path.join(build_dir, name),
+                     "log_file": os.path.join(build_dir, "%s.log" % name),
+                     "options": options})
+
+    # The pool forks its workers only here, while no git command runs in
+    # this process. They must not inherit the pipes of the persistent git
+    # processes, nor outlive their first task and get replaced by forks
+    # racing with the git commands of the root packages.
+    gitbackend.close_backends()
+    repo.git.clear_cache()
+    print_green("Building packages %s using %d workers"
+                % (", ".join(source_packages), len(jobs)))
+    pool = Pool(len(jobs))
+    return pool, pool.map_async(build_source_package, jobs, chunksize=1)
+
+
+def finish_source_packages(source_builds, print_green):
+    """Wait for the packages in subdirectories and print their results."""
+    pool, pending = source_builds
+    try:
+        results = pending.get()
+    finally:
+        pool.close()
+        pool.join()
+
+    failed = []
+    for result in results:
+        if result["error"] is None:
+            print_green("%s: built version '%s'"
+                        % (result["package"], result["debian_version"]))
+        else:
+            failed.append(result["package"])
+            sys.stdout.write("%s: FAILED: %s. Log: '%s'\n"
+                             % (result["package"], result["error"],
+                                result["log_file"]))
+    if failed:
+        raise RuntimeError("Build failed for packages: %s"
+                           % ", ".join(failed))
+    return results
+
+
+def build_source_package(job):
+    """Worker building the package of a subdirectory of the repository.
+
+    The subdirectory of the debian branch is exported with 'git archive',
+    together with its version files, and the package is built with
+    dpkg-buildpackage. The upstream tarball, if the source format needs
+    one, is created from the same subdirectory of the upstream branch.
+
+    """
+    options = job["options"]
+    source_dir = job["source_dir"]
+    build_dir = job["build_dir"]
+    result = {"package": job["package"], "build_dir": build_dir,
+              "log_file": job["log_file"], "error": None}
+
+    cwd = os.getcwd()
+    log = ui.redirect_output(job["log_file"])
+    timer = instrument.PhaseTimer()
+    try:
+        timer.start("clone")
+        if not os.path.isdir(build_dir):
+            os.makedirs(build_dir)
+        source_repo = utils.get_repository(job["source_repo_dir"])
+        repo = source_repo.clone(job["repo_dir"], shared=True,
+                                 no_checkout=True)
+        ui.print_log("Cloned repository to '%s'." % job["repo_dir"])
+        repo.git.checkout("-B", job["debian_branch"], job["debian_commit"])
+        repo.git.branch("-f", job["branch"], job["branch_commit"])
+
+        timer.start("version")
+        os.chdir(job["repo_dir"])
+        vcs_info = utils.VCSInfo(repo)
+        python_version = versioning.get_python_version(vcs_info)
+        debian_version = versioning.\
+            debian_version_from_python_version(python_version)
+        versioning.update_version(vcs_info)
+        result["python_version"] = python_version
+        result["debian_version"] = debian_version
+        ui.print_log("The new debian version will be: '%s'" % debian_version)
+
+        timer.start("export")
+        export_dir = export_source_package(repo, job, debian_version)
+        ui.print_log("Exported '%s' to '%s'" % (source_dir, export_dir))
+
+        timer.start("changelog")
+        changelog.add_entry(os.path.join(export_dir, "debian", "changelog"),
+                            debian_version, job["distribution"],
+                            "%s build" % job["mode"])
+
+        timer.start("buildpackage")
+        os.environ["DEB_DEVFLOW_DEBIAN_VERSION"] = debian_version
+        os.environ["DEB_DEVFLOW_VERSION"] = python_version
+        args = ["dpkg-buildpackage", "-sa"]
+        if options.source_only:
+            args.append("-S")
+        if not options.sign:
+            args.extend(["-uc", "-us"])
+        elif options.keyid:
+            args.append("-k%s" % options.keyid)
+        subprocess.check_call(args, cwd=export_dir)
+
+        timer.start("cleanup")
+        if not options.keep_repo:
+            ui.print_log("Removing cloned repo '%s'." % job["repo_dir"])
+            shutil.rmtree(job["repo_dir"])
+    except Exception as e:  # pylint: disable=W0703
+        traceback.print_exc()
+        result["error"] = str(e) or e.__class__.__name__
+    finally:
+        os.chdir(cwd)
+        result["timings"] = timer.report()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        log.close()
+    return result
+
+
+def export_source_package(repo, job, debian_version):
+    """Export the subdirectory of a package to its build directory.
+
+    Returns the directory of the exported sources.
+
+    """
+    source_dir = job["source_dir"]
+    build_dir = job["build_dir"]
+    upstream_version = debian_version.split(":", 1)[-1].rsplit("-", 1)[0]
+
+    archive = os.path.join(build_dir, "%s.tar" % job["package"])
+    repo.git.archive("--format=tar", "-o", archive,
+                     "%s:%s" % (job["debian_commit"], source_dir))
+    export_dir = os.path.join(build_dir,
+                              "%s-%s" % (job["package"], upstream_version))
+    tar = tarfile.open(archive)
+    try:
+        tar.extractall(export_dir)
+    finally:
+        tar.close()
+    os.unlink(archive)
+
+    # Version files are generated, so they are not part of the archive
+    config = utils.get_compiled_config(job["options"].config_file,
+                                       vcs_info=utils.VCSInfo(repo))
+    for vfile in versioning.get_version_files(config):
+        if vfile.startswith(source_dir + "/"):
+            dest = os.path.join(export_dir, vfile[len(source_dir) + 1:])
+            shutil.copy2(os.path.join(repo.working_dir, vfile), dest)
+
+    with open(os.path.join(export_dir, "debian", "changelog")) as f:
+        source_name = f.readline().split(" ", 1)[0]
+    source_format = os.path.join(export_dir, "debian", "source", "format")
+    if os.path.exists(source_format):
+        with open(source_format) as f:
+            quilt = "quilt" in f.read()
+        if quilt:
+            orig = os.path.join(build_dir, "%s_%s.orig.tar.gz"
+                                % (source_name, upstream_version))
+            repo.git.archive("--format=tar.gz", "-o", orig,
+                             "--prefix=%s-%s/" % (source_name,
+                                                  upstream_version),
+                             "%s:%s" % (job["branch_commit"], source_dir))
+    return export_dir
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import os
 import sys
 
 
@@ -50,3 +51,18 @@ def query_user(question, default=""):
     if answer == "":
         return default
     return answer
+
+
+def redirect_output(log_file):
+    """Send all output of the process and its children to 'log_file'."""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    log = open(log_file, "w")
+    os.dup2(log.fileno(), sys.stdout.fileno())
+    os.dup2(log.fileno(), sys.stderr.fileno())
+    return log
+
+
+def print_log(msg):
+    sys.stdout.write(msg + "\n")
+    sys.stdout.flush()
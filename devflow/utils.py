@@ -32,17 +32,30 @@
 # or implied, of GRNET S.A.
 
 import os
-import git
-import sh
 import re
-from collections import namedtuple
-from configobj import ConfigObj
+import errno
+import shutil
+import tempfile
 
 from devflow import BRANCH_TYPES
+from devflow import config
+from devflow import gitbackend
+
+
+def _get_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# Read once, since reading the umask means changing it for a moment
+UMASK = _get_umask()
 
 
 def get_repository(path=None):
     """Load the repository from the current working dir."""
+    # GitPython is slow to import, so only load it when it is needed
+    import git
     if path is None:
         path = os.getcwd()
     try:
@@ -53,49 +66,315 @@ def get_repository(path=None):
         raise RuntimeError(msg)
 
 
-def get_config(path=None):
-    """Load configuration file."""
+def write_file_if_changed(path, content):
+    """Atomically replace the contents of a file, if they differ.
+
+    The file is left untouched, including its modification time, if it
+    already has the given contents. Otherwise the contents are written to a
+    temporary file in the same directory, which is then renamed over the
+    original, so that readers never see a partially written file.
+
+    Returns whether the file was written.
+
+    """
+    try:
+        with open(path) as f:
+            if f.read() == content:
+                return False
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except OSError:
+        mode = 0o666 & ~UMASK
+    dirname, basename = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix="." + basename + ".")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.chmod(tmp_path, mode)
+        os.rename(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    return True
+
+
+def prepend_file(path, content):
+    """Atomically prepend 'content' to a file.
+
+    The old contents are streamed after the new ones into a temporary file
+    in the same directory, which is then renamed over the original, so the
+    file is never read into memory as a whole. A missing file is created.
+
+    """
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except OSError:
+        mode = 0o666 & ~UMASK
+    dirname, basename = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix="." + basename + ".")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+            try:
+                with open(path) as old:
+                    shutil.copyfileobj(old, f)
+            except IOError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+        os.chmod(tmp_path, mode)
+        os.rename(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def get_config_path(path=None, vcs_info=None):
+    """Return the path of the configuration file.
+
+    By default, this is 'devflow.conf' in the top-level directory of the
+    repository. RuntimeError is raised if the file does not exist.
+
+    """
     if path is None:
-        toplevel = get_vcs_info().toplevel
-        path = os.path.join(toplevel, "devflow.conf")
+        if vcs_info is not None:
+            toplevel = vcs_info.toplevel
+        else:
+            toplevel, _ = config.find_repository()
+        path = os.path.join(toplevel, config.CONFIG_FILE)
 
     if not os.path.isfile(path):
         raise RuntimeError("Config file: '%s' does not exist!" % path)
+    return path
+
 
-    config = ConfigObj(path)
-    return config
+def get_config(path=None, vcs_info=None):
+    """Load configuration file.
+
+    Returns the ConfigObj mapping of the file. See get_compiled_config() for
+    the faster, cached devflow.config.Config.
+
+    """
+    from configobj import ConfigObj
+    return ConfigObj(get_config_path(path, vcs_info))
+
+
+def get_compiled_config(path=None, vcs_info=None):
+    """Load the configuration file as a devflow.config.Config.
+
+    The compiled form is cached in the git directory of the repository, so
+    the file is only parsed again after it changes.
+
+    """
+    return config.load(get_config_path(path, vcs_info))
+
+
+class cached_property(object):
+    """A property that is computed once per instance, on first access."""
+    def __init__(self, func):
+        self.func = func
+        self.__name__ = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.__name__] = self.func(obj)
+        return value
+
+
+class VCSInfo(object):
+    """Information about the HEAD commit of a git repository.
+
+    Every field is computed when it is first accessed and is then kept for
+    the lifetime of the object, so that passing the same object around
+    pays for each git query at most once. The fields are:
+        - branch: branch name
+        - revid: commit id
+        - revno: commit count
+        - toplevel: path of git toplevel directory
+        - name, email: user identity from git configuration
+
+    Since the information is not refreshed, a new object must be created
+    after HEAD moves.
+
+    Instead of HEAD, the object may describe any commit 'rev' of the
+    repository, e.g. one that is not checked out. In that case the name of
+    the branch the commit is considered to belong to can be given, and
+    defaults to the checked out branch.
+
+    """
+    def __init__(self, repo=None, rev=None, branch=None):
+        self._repo_override = repo
+        self.rev = rev
+        self._branch_override = branch
+
+    def __repr__(self):
+        return "<VCSInfo %s>" % self.toplevel
+
+    @cached_property
+    def repo(self):
+        if self._repo_override is not None:
+            return self._repo_override
+        return get_repository()
+
+    @cached_property
+    def backend(self):
+        return gitbackend.get_backend(self.repo)
+
+    @cached_property
+    def commit(self):
+        return self.backend.read_commit(self.rev or "HEAD")
+
+    @cached_property
+    def branch(self):
+        if self._branch_override is not None:
+            return self._branch_override
+        branch = self.backend.head_branch()
+        if branch is None:
+            raise RuntimeError("HEAD of repository '%s' is detached."
+                               % self.toplevel)
+        return branch
+
+    @cached_property
+    def revid(self):
+        return get_commit_id(self.commit, self.branch)
+
+    @cached_property
+    def revno(self):
+        return get_revision_number(self.repo, self.commit.hexsha)
+
+    @cached_property
+    def toplevel(self):
+        return self.repo.working_dir
+
+    @cached_property
+    def _user(self):
+        reader = self.repo.config_reader()
+        try:
+            name = reader.get_value("user", "name")
+            email = reader.get_value("user", "email")
+        except Exception as e:
+            raise ValueError("Can not read name/email from .gitconfig"
+                             " file.: %s" % e)
+        return name, email
+
+    @property
+    def name(self):
+        return self._user[0]
+
+    @property
+    def email(self):
+        return self._user[1]
 
 
 def get_vcs_info():
     """Return current git HEAD commit information.
 
-    Returns a tuple containing
-        - branch name
-        - commit id
-        - commit count
-        - git describe output
-        - path of git toplevel directory
+    Returns a VCSInfo object, whose fields are computed lazily.
 
     """
+    return VCSInfo()
 
-    repo = get_repository()
-    branch = repo.head.reference
-    revid = get_commit_id(branch.commit, branch)
-    revno = len(list(repo.iter_commits()))
-    toplevel = repo.working_dir
-    config = repo.config_reader()
+
+REVNO_CACHE_FILE = "devflow-revno-cache"
+# Maximum number of entries kept in the revision number cache
+REVNO_CACHE_SIZE = 10000
+# Maximum number of first-parent steps to walk looking for a cached commit
+REVNO_CACHE_MAX_WALK = 5000
+
+
+def _load_revno_cache(path):
+    cache = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    sha, count = line.split()
+                    cache[sha] = int(count)
+                except ValueError:
+                    # Ignore partially written or corrupted lines
+                    continue
+    except IOError:
+        pass
+    return cache
+
+
+def _store_revno_cache(path, cache, sha, count):
+    cache[sha] = count
     try:
-        name = config.get_value("user", "name")
-        email = config.get_value("user", "email")
-    except Exception as e:
-        raise ValueError("Can not read name/email from .gitconfig"
-                         " file.: %s" % e)
+        if len(cache) > REVNO_CACHE_SIZE:
+            # Compact the cache, keeping the entries with the highest counts,
+            # which normally belong to the most recent commits
+            items = sorted(cache.items(), key=lambda x: x[1])
+            items = items[-(REVNO_CACHE_SIZE // 2):]
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w") as f:
+                f.writelines("%s %d\n" % item for item in items)
+            os.rename(tmp_path, path)
+        else:
+            with open(path, "a") as f:
+                f.write("%s %d\n" % (sha, count))
+    except (IOError, OSError):
+        # The cache is only an optimization, e.g. the repository may be
+        # read-only.
+        pass
 
-    info = namedtuple("vcs_info", ["branch", "revid", "revno",
-                                   "toplevel", "name", "email"])
 
-    return info(branch=branch.name, revid=revid, revno=revno,
-                toplevel=toplevel, name=name, email=email)
+def get_revision_number(repo, rev):
+    """Return the number of commits reachable from a commit.
+
+    The result is the same as 'git rev-list --count <rev>', but it is
+    computed incrementally using a persistent cache stored in the git
+    directory of the repository, which maps commit ids to ancestor counts.
+
+    Starting from the given commit, the first-parent chain is walked until a
+    cached commit is found. If only single-parent commits were found on the
+    way, the result is the cached count plus the number of steps. Otherwise,
+    the commits that are reachable from the given commit but not from the
+    cached one are counted by git. With an empty cache, e.g. in a fresh
+    clone, there is nothing to find and the commits are counted directly.
+
+    """
+    backend = gitbackend.get_backend(repo)
+    path = os.path.join(repo.git_dir, REVNO_CACHE_FILE)
+    cache = _load_revno_cache(path)
+    commit = backend.read_commit(rev)
+    sha = commit.hexsha
+    if sha in cache:
+        return cache[sha]
+
+    if not cache:
+        count = backend.count_commits(sha)
+        _store_revno_cache(path, cache, sha, count)
+        return count
+
+    steps = 0
+    linear = True
+    base = commit
+    while base.hexsha not in cache:
+        parents = base.parents
+        if not parents or steps >= REVNO_CACHE_MAX_WALK:
+            base = None
+            break
+        if len(parents) > 1:
+            linear = False
+        base = backend.read_commit(parents[0])
+        steps += 1
+
+    if base is None:
+        count = backend.count_commits(sha)
+    elif linear:
+        count = cache[base.hexsha] + steps
+    else:
+        new = backend.count_commits("%s..%s" % (base.hexsha, sha))
+        count = cache[base.hexsha] + new
+
+    _store_revno_cache(path, cache, sha, count)
+    return count
 
 
 def get_commit_id(commit, current_branch):
@@ -105,21 +384,21 @@ def get_commit_id(commit, current_branch):
     debian branch we return a combination of the parents commits.
 
     """
-    def short_id(commit):
-        return commit.hexsha[0:7]
+    def short_id(hexsha):
+        return hexsha[0:7]
 
     parents = commit.parents
-    cur_br_name = current_branch.name
     if len(parents) == 1:
-        return short_id(commit)
+        return short_id(commit.hexsha)
     elif len(parents) == 2:
-        if cur_br_name.startswith("debian-") or cur_br_name == "debian":
+        if current_branch.startswith("debian-") or current_branch == "debian":
             pr1, pr2 = parents
             return short_id(pr1) + "_" + short_id(pr2)
         else:
-            return short_id(commit)
+            return short_id(commit.hexsha)
     else:
-        raise RuntimeError("Commit %s has more than 2 parents!" % commit)
+        raise RuntimeError("Commit %s has more than 2 parents!"
+                           % commit.hexsha)
 
 
 def get_debian_branch(branch):
@@ -156,35 +435,75 @@ def get_debian_branch(branch):
     return "debian"
 
 
+def find_debian_branch(branch):
+    """Find the corresponding debian- branch, without creating any branch
+
+    Returns the name of the branch get_debian_branch() would return, and
+    the local or remote-tracking ref it has or would get its commit from.
+    The ref is None if no debian branch exists at all.
+
+    """
+    distribution = get_distribution_codename()
+    backend = gitbackend.get_backend(get_repository())
+    if branch == "master":
+        deb_branch = "debian-" + distribution
+    else:
+        deb_branch = "-".join(["debian", branch, distribution])
+    plain_branch = re.sub("-" + distribution + "$", "", deb_branch)
+    default_branch = BRANCH_TYPES[get_branch_type(branch)].debian_branch
+    candidates = [(deb_branch, deb_branch),
+                  (plain_branch, plain_branch),
+                  (plain_branch, default_branch + "-" + distribution),
+                  (plain_branch, default_branch)]
+    for name, source in candidates:
+        ref = _find_branch_ref(backend, source)
+        if ref is not None:
+            return name, ref
+    return "debian", None
+
+
+def _find_branch_ref(backend, branch):
+    for ref in ["refs/heads/" + branch, "refs/remotes/origin/" + branch]:
+        if backend.ref_exists(ref):
+            return ref
+    return None
+
+
 def _get_branch(branch):
     repo = get_repository()
-    if branch in repo.branches:
-        return branch
-    origin_branch = "origin/" + branch
-    if origin_branch in repo.refs:
+    ref = _find_branch_ref(gitbackend.get_backend(repo), branch)
+    if ref is None:
+        return None
+    if ref.startswith("refs/remotes/"):
+        origin_branch = "origin/" + branch
         print "Creating branch '%s' to track '%s'" % (branch, origin_branch)
         repo.git.branch(branch, origin_branch)
-        return branch
-    else:
-        return None
+    return branch
 
 
-def get_build_mode():
+def get_build_mode(vcs_info=None):
     """Determine the build mode"""
     # Get it from environment if exists
     mode = os.environ.get("DEVFLOW_BUILD_MODE", None)
     if mode is None:
-        branch = get_branch_type(get_vcs_info().branch)
-        try:
-            br_type = BRANCH_TYPES[get_branch_type(branch)]
-        except KeyError:
-            allowed_branches = ", ".join(x for x in BRANCH_TYPES.keys())
-            raise ValueError("Malformed branch name '%s', cannot classify as"
-                             " one of %s" % (branch, allowed_branches))
-        mode = "snapshot" if br_type.builds_snapshot else "release"
+        mode = get_branch_build_mode(vcs_info)
     return mode
 
 
+def get_branch_build_mode(vcs_info=None):
+    """Determine the build mode from the type of the checked out branch"""
+    if vcs_info is None:
+        vcs_info = get_vcs_info()
+    branch = get_branch_type(vcs_info.branch)
+    try:
+        br_type = BRANCH_TYPES[get_branch_type(branch)]
+    except KeyError:
+        allowed_branches = ", ".join(x for x in BRANCH_TYPES.keys())
+        raise ValueError("Malformed branch name '%s', cannot classify as"
+                         " one of %s" % (branch, allowed_branches))
+    return "snapshot" if br_type.builds_snapshot else "release"
+
+
 def normalize_branch_name(branch_name):
     """Normalize branch name by removing debian- if exists"""
     brnorm = branch_name
@@ -232,14 +551,69 @@ def undebianize(branch):
         return branch
 
 
+# Files describing the distribution, and the keys that may hold its codename
+RELEASE_FILES = (
+    ("/etc/os-release", ("VERSION_CODENAME", "UBUNTU_CODENAME")),
+    ("/usr/lib/os-release", ("VERSION_CODENAME", "UBUNTU_CODENAME")),
+    ("/etc/lsb-release", ("DISTRIB_CODENAME",)),
+)
+
+_distribution_codename = None
+
+
+def read_release_file(path):
+    """Parse a shell-style KEY=value file, like /etc/os-release."""
+    info = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#") or "=" not in line:
+                    continue
+                key, value = line.split("=", 1)
+                info[key.strip()] = value.strip().strip("\"'")
+    except IOError:
+        pass
+    return info
+
+
+def _detect_distribution_codename():
+    codename = os.uname()[0].lower()
+    if codename != "linux":
+        return codename
+    for path, keys in RELEASE_FILES:
+        info = read_release_file(path)
+        for key in keys:
+            if info.get(key):
+                return info[key]
+    # lets try to be more specific using lsb_release
+    import sh
+    try:
+        output = sh.lsb_release("-c")  # pylint: disable=E1101
+        _, codename = output.split("\t")
+    except sh.CommandNotFound:
+        pass
+    return codename.strip()
+
+
 def get_distribution_codename():
-    codename = sh.uname().lower().strip()
-    if codename == "linux":
-        # lets try to be more specific using lsb_release
-        try:
-            output = sh.lsb_release("-c")  # pylint: disable=E1101
-            _, codename = output.split("\t")
-        except sh.CommandNotFound:
-            pass
-    codename = codename.strip()
-    return codename
+    """Return the codename of the distribution devflow is running on.
+
+    The codename is read from /etc/os-release or /etc/lsb-release, and
+    'lsb_release' is only run if none of them contains it. The result is
+    computed once per process. Detection is skipped entirely if the
+    DEVFLOW_CODENAME environment variable is set.
+
+    """
+    codename = os.environ.get("DEVFLOW_CODENAME")
+    if codename:
+        return codename.strip()
+    return get_host_distribution_codename()
+
+
+def get_host_distribution_codename():
+    """Return the detected distribution codename, ignoring DEVFLOW_CODENAME"""
+    global _distribution_codename
+    if _distribution_codename is None:
+        _distribution_codename = _detect_distribution_codename()
+    return _distribution_codename
@@ -0,0 +1,244 @@
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+
+"""Comparison of Debian and Python (PEP 440) versions.
+
+This module implements the ordering of Debian package versions, as done by
+'dpkg --compare-versions', and the ordering of PEP 440 Python versions,
+without spawning any processes.
+
+Versions are converted to keys, i.e. tuples that compare in the same way as
+the versions they stand for. Keys are computed once per version, so sorting
+thousands of versions is as cheap as sorting tuples:
+
+>>> sort_versions(["1.0-1", "1.0~rc1-1", "1:0.9-1"])
+['1.0~rc1-1', '1.0-1', '1:0.9-1']
+>>> max_version(["0.14", "0.14.dev10", "0.14rc1"], scheme="python")
+'0.14'
+
+"""
+
+import re
+
+
+def _debian_char_weight(c):
+    """Weight of a non-digit character in the Debian ordering.
+
+    '~' sorts before everything, even the end of a part, letters sort
+    before all other characters. Zero is reserved for the end of a part.
+
+    """
+    if c == "~":
+        return -1
+    elif c.isalpha():
+        return ord(c)
+    else:
+        return ord(c) + 256
+
+
+_DEBIAN_WEIGHTS = dict((chr(i), _debian_char_weight(chr(i)))
+                       for i in range(256))
+_DEBIAN_SEGMENT_RE = re.compile(r"([^0-9]*)([0-9]*)")
+
+
+def _debian_part_key(part):
+    """Return the key of the upstream version or revision of a version.
+
+    dpkg compares alternating non-digit and digit segments. A non-digit
+    segment is compared character by character, with the end of the segment
+    weighing 0, and a digit segment is compared numerically. Both are
+    flattened into a list of integers. A string that runs out of segments
+    compares as if it were padded with zeros, so trailing zeros are dropped
+    and every remaining zero is replaced by the sign of the first non-zero
+    value following it, with non-zero values scaled to stay apart from these
+    markers. The key ends with a 0, which stands for the padding.
+
+    """
+    values = []
+    pos = 0
+    while pos < len(part):
+        nondigits, digits = _DEBIAN_SEGMENT_RE.match(part, pos).groups()
+        values.extend(_DEBIAN_WEIGHTS[c] for c in nondigits)
+        values.append(0)
+        values.append(int(digits or 0))
+        pos += len(nondigits) + len(digits)
+
+    while values and values[-1] == 0:
+        values.pop()
+
+    key = [0]
+    sign = 0
+    for value in reversed(values):
+        if value:
+            sign = 1 if value > 0 else -1
+            key.append(4 * value)
+        else:
+            key.append(sign)
+    key.reverse()
+    return tuple(key)
+
+
+def debian_key(version):
+    """Return a key that sorts Debian versions like dpkg does."""
+    upstream = version.strip()
+    if ":" in upstream:
+        epoch, upstream = upstream.split(":", 1)
+        try:
+            epoch = int(epoch)
+        except ValueError:
+            raise ValueError("Invalid epoch in Debian version '%s'" % version)
+    else:
+        epoch = 0
+    if "-" in upstream:
+        upstream, revision = upstream.rsplit("-", 1)
+    else:
+        revision = ""
+    if not upstream:
+        raise ValueError("Empty upstream version in Debian version '%s'"
+                         % version)
+    return (epoch, _debian_part_key(upstream), _debian_part_key(revision))
+
+
+# The canonical PEP 440 regular expression, see
+# https://www.python.org/dev/peps/pep-0440/#appendix-b-parsing-version-strings
+PEP440_RE = re.compile(r"""
+    ^\s*
+    v?
+    (?:
+        (?:(?P<epoch>[0-9]+)!)?
+        (?P<release>[0-9]+(?:\.[0-9]+)*)
+        (?P<pre>
+            [-_\.]?
+            (?P<pre_l>(a|b|c|rc|alpha|beta|pre|preview))
+            [-_\.]?
+            (?P<pre_n>[0-9]+)?
+        )?
+        (?P<post>
+            (?:-(?P<post_n1>[0-9]+))
+            |
+            (?:
+                [-_\.]?
+                (?P<post_l>post|rev|r)
+                [-_\.]?
+                (?P<post_n2>[0-9]+)?
+            )
+        )?
+        (?P<dev>
+            [-_\.]?
+            (?P<dev_l>dev)
+            [-_\.]?
+            (?P<dev_n>[0-9]+)?
+        )?
+    )
+    (?:\+(?P<local>[a-z0-9]+(?:[-_\.][a-z0-9]+)*))?
+    \s*$
+""", re.VERBOSE | re.IGNORECASE)
+
+_PEP440_PRE_PHASES = {"a": 0, "alpha": 0, "b": 1, "beta": 1,
+                      "c": 2, "rc": 2, "pre": 2, "preview": 2}
+
+
+def python_key(version):
+    """Return a key that sorts Python versions following PEP 440."""
+    m = PEP440_RE.match(version)
+    if m is None:
+        raise ValueError("Invalid PEP 440 version '%s'" % version)
+
+    epoch = int(m.group("epoch") or 0)
+
+    release = [int(x) for x in m.group("release").split(".")]
+    while len(release) > 1 and release[-1] == 0:
+        release.pop()
+
+    if m.group("pre"):
+        pre = (_PEP440_PRE_PHASES[m.group("pre_l").lower()],
+               int(m.group("pre_n") or 0))
+    elif not m.group("post") and m.group("dev"):
+        # Development releases of a final release come before its
+        # pre-releases, e.g. 1.0.dev1 < 1.0a1
+        pre = (-1, 0)
+    else:
+        pre = (3, 0)
+
+    if m.group("post"):
+        post = int(m.group("post_n1") or m.group("post_n2") or 0)
+    else:
+        post = -1
+
+    if m.group("dev"):
+        dev = (0, int(m.group("dev_n") or 0))
+    else:
+        dev = (1, 0)
+
+    if m.group("local"):
+        local = [1]
+        for part in re.split(r"[-_\.]", m.group("local").lower()):
+            if part.isdigit():
+                local.append((1, int(part), ""))
+            else:
+                local.append((0, 0, part))
+        local = tuple(local)
+    else:
+        local = (0,)
+
+    return (epoch, tuple(release), pre, post, dev, local)
+
+
+SCHEMES = {
+    "debian": debian_key,
+    "python": python_key,
+}
+
+
+def get_key_function(scheme):
+    try:
+        return SCHEMES[scheme]
+    except KeyError:
+        raise ValueError("Unknown version scheme '%s'. Available schemes:"
+                         " %s" % (scheme, ", ".join(sorted(SCHEMES))))
+
+
+def compare_versions(a, b, scheme="debian"):
+    """Compare two versions, returning -1, 0 or 1, like cmp()."""
+    key = get_key_function(scheme)
+    return cmp(key(a), key(b))
+
+
+def sort_versions(versions, scheme="debian", reverse=False):
+    """Return a new list with the versions sorted in ascending order."""
+    return sorted(versions, key=get_key_function(scheme), reverse=reverse)
+
+
+def max_version(versions, scheme="debian"):
+    """Return the highest of the versions."""
+    return max(versions, key=get_key_function(scheme))
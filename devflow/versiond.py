@@ -0,0 +1,305 @@
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+
+"""Long-running version daemon and its client.
+
+Build systems tend to ask for the version of the same tree many times
+during a single build. 'devflow-versiond' computes the versions once, keeps
+them in memory and serves them over a Unix socket in the git directory of
+the repository, until HEAD, the checked out branch, the tags or the base
+version file change.
+
+'devflow-versionc' is the matching client:
+
+    devflow-versionc python
+    devflow-versionc debian
+    devflow-versionc update
+
+prints the same output as 'devflow-version python', 'devflow-version
+debian' and runs the same steps as 'devflow-update-version'. If no daemon
+is running, the client computes the answer itself, so it can always be used
+in their place.
+
+The client only needs the standard library, so that a query costs a socket
+round trip rather than importing devflow's dependencies.
+
+"""
+
+import os
+import sys
+import socket
+
+
+SOCKET_NAME = "devflow-versiond.sock"
+COMMANDS = ["python", "debian", "update", "ping", "shutdown"]
+
+
+def find_git_dir(path=None):
+    """Find the git directory of the repository containing 'path'."""
+    from devflow.config import find_repository
+    return find_repository(path)[1]
+
+
+def get_socket_path(git_dir=None):
+    path = os.environ.get("DEVFLOW_VERSIOND_SOCKET")
+    if path:
+        return path
+    return os.path.join(git_dir or find_git_dir(), SOCKET_NAME)
+
+
+def query(command, mode=None, codename=None, socket_path=None):
+    """Send a command to the daemon and return its answer.
+
+    Unless they are given, the daemon determines the build mode from the
+    checked out branch and detects the distribution codename, ignoring its
+    own DEVFLOW_BUILD_MODE and DEVFLOW_CODENAME.
+
+    Raises socket.error if no daemon is listening, and RuntimeError if the
+    daemon failed to answer the query.
+
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path or get_socket_path())
+        sock.sendall("%s %s %s\n" % (command, mode or "-", codename or "-"))
+        response = sock.makefile().readline().rstrip("\n")
+    finally:
+        sock.close()
+    status, _, payload = response.partition(" ")
+    if status != "ok":
+        raise RuntimeError(payload or "Connection closed by devflow-versiond")
+    return payload
+
+
+def compute(command, mode=None, codename=None):
+    """Answer a query in-process, without the daemon."""
+    from devflow import versioning, utils
+    v = utils.get_vcs_info()
+    mode = mode or utils.get_branch_build_mode(v)
+    codename = codename or utils.get_host_distribution_codename()
+    if command == "update":
+        versioning.update_version(v, mode=mode, codename=codename)
+        return ""
+    b = versioning.get_base_version(v)
+    version = versioning.python_version(b, v, mode)
+    if command == "python":
+        return version
+    return versioning.debian_version_from_python_version(
+        version, codename=codename)
+
+
+def client_main():
+    usage = "usage: %s {python,debian,update}\n" % sys.argv[0]
+    if len(sys.argv) != 2 or sys.argv[1] not in ("python", "debian",
+                                                 "update"):
+        sys.stderr.write(usage)
+        return 2
+    command = sys.argv[1]
+    mode = os.environ.get("DEVFLOW_BUILD_MODE")
+    codename = os.environ.get("DEVFLOW_CODENAME", "").strip()
+    try:
+        answer = query(command, mode, codename)
+    except socket.error:
+        # No daemon is running, or it can not be reached, e.g. because the
+        # path of the socket is too long or not accessible
+        answer = compute(command, mode, codename)
+    except RuntimeError as e:
+        sys.stderr.write("devflow-versiond: %s\n" % e)
+        return 1
+    if answer:
+        sys.stdout.write(answer + "\n")
+    return 0
+
+
+class VersionState(object):
+    """The versions of a repository, as long as it does not change.
+
+    The state is fingerprinted by the stat() information of the files that
+    affect the versions: HEAD, the ref it points to, packed refs, the
+    directory of debian tags and the base version file.
+
+    """
+    def __init__(self, toplevel, git_dir):
+        self.toplevel = toplevel
+        self.git_dir = git_dir
+        common_dir = git_dir
+        commondir_file = os.path.join(git_dir, "commondir")
+        if os.path.isfile(commondir_file):
+            with open(commondir_file) as f:
+                common_dir = os.path.join(git_dir, f.read().strip())
+        self.common_dir = common_dir
+        self.fingerprint = None
+        self.answers = {}
+        self.vcs_info = None
+        self.tag_index = None
+
+    def _stat(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime)
+
+    def get_fingerprint(self):
+        from devflow import BASE_VERSION_FILE
+        with open(os.path.join(self.git_dir, "HEAD")) as f:
+            head = f.read().strip()
+        paths = [os.path.join(self.git_dir, "HEAD"),
+                 os.path.join(self.common_dir, "packed-refs"),
+                 os.path.join(self.common_dir, "refs", "tags"),
+                 os.path.join(self.common_dir, "refs", "tags", "debian"),
+                 os.path.join(self.toplevel, BASE_VERSION_FILE)]
+        if head.startswith("ref: "):
+            paths.append(os.path.join(self.common_dir, head[len("ref: "):]))
+        return (head,) + tuple(self._stat(p) for p in paths)
+
+    def refresh(self):
+        from devflow import utils, versioning
+        fingerprint = self.get_fingerprint()
+        if fingerprint != self.fingerprint:
+            self.fingerprint = fingerprint
+            self.answers = {}
+            self.vcs_info = utils.VCSInfo(utils.get_repository(self.toplevel))
+            self.tag_index = versioning.DebianTagIndex(self.vcs_info.repo)
+
+    def answer(self, command, mode=None, codename=None):
+        from devflow import utils, versioning
+        self.refresh()
+        v = self.vcs_info
+        # The environment of the daemon is not the one of the client, so the
+        # defaults do not depend on it.
+        mode = mode or utils.get_branch_build_mode(v)
+        codename = codename or utils.get_host_distribution_codename()
+        if command == "update":
+            # Version files may have been changed by anyone, so they are
+            # always regenerated.
+            versioning.update_version(v, mode=mode, codename=codename)
+            return ""
+        key = (command, mode, codename)
+        if key not in self.answers:
+            b = versioning.get_base_version(v)
+            version = versioning.python_version(b, v, mode)
+            if command == "debian":
+                version = versioning.debian_version_from_python_version(
+                    version, self.tag_index, codename)
+            self.answers[key] = version
+        return self.answers[key]
+
+
+def serve(socket_path, state, idle_timeout=None):
+    import SocketServer
+
+    class Handler(SocketServer.StreamRequestHandler):
+        def handle(self):
+            line = self.rfile.readline().strip()
+            fields = line.split(" ")
+            fields += ["-"] * (3 - len(fields))
+            command, mode, codename = [None if f in ("", "-") else f
+                                       for f in fields[:3]]
+            if command not in COMMANDS:
+                self.wfile.write("error Unknown command '%s'\n" % command)
+                return
+            if command == "shutdown":
+                self.server.running = False
+                self.wfile.write("ok\n")
+                return
+            if command == "ping":
+                self.wfile.write("ok pong\n")
+                return
+            try:
+                answer = state.answer(command, mode, codename)
+            except Exception as e:  # pylint: disable=W0703
+                self.wfile.write("error %s\n" % str(e).replace("\n", " "))
+            else:
+                self.wfile.write("ok %s\n" % answer)
+
+    server = SocketServer.UnixStreamServer(socket_path, Handler)
+    server.timeout = idle_timeout
+    server.running = True
+
+    def handle_timeout():
+        server.running = False
+    server.handle_timeout = handle_timeout
+
+    try:
+        while server.running:
+            server.handle_request()
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+
+def main():
+    from argparse import ArgumentParser
+    import signal
+
+    parser = ArgumentParser(
+        description="Serve the versions of the repository in the current"
+                    " directory over a Unix socket")
+    parser.add_argument("--socket", dest="socket_path",
+                        help="Path of the socket. Defaults to '%s' in the git"
+                             " directory" % SOCKET_NAME)
+    parser.add_argument("--idle-timeout", type=float, default=None,
+                        help="Exit after this many seconds without queries")
+    args = parser.parse_args()
+
+    from devflow import utils
+    repo = utils.get_repository()
+    socket_path = args.socket_path or get_socket_path(repo.git_dir)
+
+    if os.path.exists(socket_path):
+        try:
+            query("ping", socket_path=socket_path)
+        except socket.error:
+            # Stale socket of a daemon that did not exit cleanly
+            os.unlink(socket_path)
+        else:
+            sys.stderr.write("devflow-versiond is already listening on '%s'\n"
+                             % socket_path)
+            return 1
+
+    def terminate(signum, frame):
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, terminate)
+
+    state = VersionState(repo.working_dir, repo.git_dir)
+    sys.stderr.write("devflow-versiond listening on '%s'\n" % socket_path)
+    try:
+        serve(socket_path, state, args.idle_timeout)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
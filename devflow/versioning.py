@@ -44,14 +44,16 @@ of the repository code.
 import os
 import re
 import sys
-import itertools
 import random
 import string
+import time
 
+from collections import OrderedDict
 from distutils import log  # pylint: disable=E0611
 
 from devflow import BRANCH_TYPES, BASE_VERSION_FILE, VERSION_RE
 from devflow import utils
+from devflow import gitbackend
 
 
 DEFAULT_VERSION_FILE = """
@@ -65,18 +67,35 @@ __version_user_name__ = "%(DEVFLOW_USER_NAME)s"
 """
 
 
-def get_base_version(vcs_info):
-    """Determine the base version from a file in the repository"""
-
-    f = open(os.path.join(vcs_info.toplevel, BASE_VERSION_FILE))
-    lines = [l.strip() for l in f.readlines()]
+def parse_base_version(content, path=BASE_VERSION_FILE):
+    """Extract the base version from the contents of the base version file"""
+    lines = [l.strip() for l in content.splitlines()]
     lines = [l for l in lines if not l.startswith("#")]
     if len(lines) != 1:
-        raise ValueError("File '%s' should contain a single non-comment line.")
-    f.close()
+        raise ValueError("File '%s' should contain a single non-comment line."
+                         % path)
     return lines[0]
 
 
+def get_base_version(vcs_info):
+    """Determine the base version from a file in the repository
+
+    The file is read from the working tree, unless 'vcs_info' describes a
+    specific commit, in which case it is read from the commit itself.
+
+    """
+    if vcs_info.rev is None:
+        with open(os.path.join(vcs_info.toplevel, BASE_VERSION_FILE)) as f:
+            content = f.read()
+    else:
+        content = vcs_info.backend.read_blob(
+            "%s:%s" % (vcs_info.commit.hexsha, BASE_VERSION_FILE))
+        if content is None:
+            raise ValueError("Commit %s does not contain file '%s'."
+                             % (vcs_info.commit.hexsha, BASE_VERSION_FILE))
+    return parse_base_version(content)
+
+
 def validate_version(base_version, vcs_info):
     branch = vcs_info.branch
 
@@ -258,7 +277,8 @@ def python_version(base_version, vcs_info, mode):
     return base_version
 
 
-def debian_version_from_python_version(pyver):
+def debian_version_from_python_version(pyver, tag_index=None,
+                                       codename=None):
     """Generate a debian package version from a Python version.
 
     This helper generates a Debian package version from a Python version,
@@ -341,28 +361,67 @@ def debian_version_from_python_version(pyver):
         version = pyver.replace(
             ".dev", rand).replace("dev", "~dev").replace(rand, '~dev').replace(
             "rc", "~rc")
-    codename = utils.get_distribution_codename()
-    minor = str(get_revision(version, codename))
+    if codename is None:
+        codename = utils.get_distribution_codename()
+    minor = str(get_revision(version, codename, tag_index))
     return version + "-" + minor + "~" + codename
 
 
-def get_revision(version, codename):
+# Tags of Debian packages, as created by devflow-autopkg. The suffix is the
+# revision followed by the distribution codename, e.g. '1jessie'.
+DEBIAN_TAG_RE = re.compile(r"^refs/tags/debian/(?P<version>.+)"
+                           r"-(?P<suffix>[1-9][^-]*)$")
+REVISION_RE = re.compile(r"^[1-9][0-9]*$")
+
+
+class DebianTagIndex(object):
+    """Index of the 'debian/*' tags of a repository.
+
+    The index is built with a single pass over the tags and maps each
+    version to the suffixes of its tags. Since a codename may start with a
+    digit, e.g. '2xenial', a suffix can only be split into revision and
+    codename once the codename is known, so this happens on lookup.
+
+    """
+    def __init__(self, repo=None):
+        if repo is None:
+            repo = utils.get_repository()
+        self.index = {}
+        backend = gitbackend.get_backend(repo)
+        for ref, _ in backend.list_refs("refs/tags/debian/"):
+            m = DEBIAN_TAG_RE.match(ref)
+            if m is None:
+                continue
+            suffixes = self.index.setdefault(m.group("version"), set())
+            suffixes.add(m.group("suffix"))
+
+    def next_revision(self, version_tag, codename):
+        """Return N + 1, where the tags for revisions 1 to N all exist."""
+        existing = set()
+        for suffix in self.index.get(version_tag, ()):
+            if not suffix.endswith(codename):
+                continue
+            revision = suffix[:len(suffix) - len(codename)]
+            if REVISION_RE.match(revision):
+                existing.add(int(revision))
+        highest = 0
+        while highest + 1 in existing:
+            highest += 1
+        return highest + 1
+
+
+def get_revision(version, codename, tag_index=None):
     """Find revision for a debian version"""
     version_tag = utils.version_to_tag(version)
-    repo = utils.get_repository()
-    minor = 1
-    while True:
-        tag = "debian/" + version_tag + "-" + str(minor) + codename
-        if tag in repo.tags:
-            minor += 1
-        else:
-            return minor
+    if tag_index is None:
+        tag_index = DebianTagIndex()
+    return tag_index.next_revision(version_tag, codename)
 
 
-def get_python_version():
-    v = utils.get_vcs_info()
+def get_python_version(vcs_info=None):
+    v = vcs_info or utils.get_vcs_info()
     b = get_base_version(v)
-    mode = utils.get_build_mode()
+    mode = utils.get_build_mode(v)
     return python_version(b, v, mode)
 
 
@@ -371,34 +430,99 @@ def debian_version(base_version, vcs_info, mode):
     return debian_version_from_python_version(p)
 
 
-def get_debian_version():
-    v = utils.get_vcs_info()
+def get_debian_version(vcs_info=None):
+    v = vcs_info or utils.get_vcs_info()
     b = get_base_version(v)
-    mode = utils.get_build_mode()
+    mode = utils.get_build_mode(v)
     return debian_version(b, v, mode)
 
 
-def update_version():
+def get_version_files(config):
+    """Return a {version_file: version_template} map from devflow.conf
+
+    The template is None for files using the default contents. If a version
+    file is declared more than once, the last declaration wins.
+
+    """
+    version_files = OrderedDict()
+    for package in config.packages:
+        version_filenames = package.version_files
+        if not version_filenames:
+            continue
+        version_templates = package.version_templates or \
+            (None,) * len(version_filenames)
+
+        if len(version_filenames) != len(version_templates):
+            raise RuntimeError(
+                "devflow.conf contains '%s' version files and '%s' version "
+                "templates. The number of version files and templates must "
+                "match." % (len(version_filenames), len(version_templates)))
+
+        for (vfilename, vtemplate) in zip(version_filenames,
+                                          version_templates):
+            version_files.pop(vfilename, None)
+            version_files[vfilename] = vtemplate or None
+    return version_files
+
+
+def render_version_templates(templates, env, toplevel):
+    """Render each distinct version template once
+
+    Returns a {version_template: content} map. Each template file is read
+    only once, no matter how many version files use it.
+
+    """
+    contents = {}
+    for vtemplate in set(templates):
+        if vtemplate is None:
+            contents[vtemplate] = DEFAULT_VERSION_FILE % env
+            continue
+        vtemplate_file = os.path.join(toplevel, vtemplate)
+        try:
+            with file(vtemplate_file) as f:
+                contents[vtemplate] = f.read(-1) % env
+        except IOError as e:
+            if e.errno == 2:
+                raise RuntimeError("devflow.conf contains '%s' as a"
+                                   " version template file, but file"
+                                   " does not exists!"
+                                   % vtemplate_file)
+            else:
+                raise
+    return contents
+
+
+# Default maximum number of threads writing version files
+VERSION_FILE_JOBS = 8
+
+
+def update_version(vcs_info=None, mode=None, jobs=None, codename=None):
     """Generate or replace version files
 
     Helper function for generating/replacing version files containing version
-    information.
+    information. The build mode is determined by utils.get_build_mode(), and
+    the distribution codename by utils.get_distribution_codename(), unless
+    they are given.
+
+    Each distinct template is rendered once, and the version files are
+    written by up to 'jobs' threads. Returns a summary with the number of
+    templates rendered, of files written and skipped because they were up
+    to date, and the time each stage took.
 
     """
 
-    v = utils.get_vcs_info()
+    v = vcs_info or utils.get_vcs_info()
     toplevel = v.toplevel
 
-    config = utils.get_config()
-    if not v:
-        # Return early if not in development environment
-        raise RuntimeError("Can not compute version outside of a git"
-                           " repository.")
+    timings = OrderedDict()
+    start = time.time()
+    config = utils.get_compiled_config(vcs_info=v)
     b = get_base_version(v)
     check_obsolete_version(b)
-    mode = utils.get_build_mode()
+    mode = mode or utils.get_build_mode(v)
     version = python_version(b, v, mode)
-    debian_version_ = debian_version_from_python_version(version)
+    debian_version_ = debian_version_from_python_version(
+        version, DebianTagIndex(v.repo), codename)
     env = {"DEVFLOW_VERSION": version,
            "DEVFLOW_DEBIAN_VERSION": debian_version_,
            "DEVFLOW_BRANCH": v.branch,
@@ -406,44 +530,62 @@ def update_version():
            "DEVFLOW_REVISION_NUMBER": v.revno,
            "DEVFLOW_USER_EMAIL": v.email,
            "DEVFLOW_USER_NAME": v.name}
+    version_files = get_version_files(config)
+    timings["version"] = time.time() - start
+
+    start = time.time()
+    contents = render_version_templates(version_files.values(), env,
+                                        toplevel)
+    timings["render"] = time.time() - start
+
+    def write(vfilename):
+        content = contents[version_files[vfilename]]
+        return utils.write_file_if_changed(os.path.join(toplevel, vfilename),
+                                           content)
+
+    start = time.time()
+    if jobs is None:
+        jobs = VERSION_FILE_JOBS
+    jobs = min(jobs, len(version_files))
+    if jobs > 1:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(jobs)
+        try:
+            written = pool.map(write, version_files.keys())
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        written = map(write, version_files.keys())
+    timings["write"] = time.time() - start
 
-    for _pkg_name, pkg_info in config['packages'].items():
-        if pkg_info.get("version_file"):
-            version_filenames = pkg_info.as_list("version_file")
-        else:
-            continue
-        if pkg_info.get('version_template'):
-            version_templates = pkg_info.as_list("version_template")
+    for vfilename, changed in zip(version_files.keys(), written):
+        if changed:
+            log.info("Updating version file '%s'" % vfilename)
         else:
-            version_templates = itertools.repeat(None, len(version_filenames))
-            version_templates = list(version_templates)
+            log.info("Version file '%s' is up to date" % vfilename)
 
-        if len(version_filenames) != len(version_templates):
-            raise RuntimeError(
-                "devflow.conf contains '%s' version files and '%s' version "
-                "templates. The number of version files and templates must "
-                "match." % (len(version_filenames), len(version_templates)))
+    summary = {"rendered": len(contents),
+               "written": written.count(True),
+               "skipped": written.count(False),
+               "timings": timings}
+    return summary
 
-        v_files_templates = zip(version_filenames, version_templates)
-        for (vfilename, vtemplate) in v_files_templates:
-            if vtemplate:
-                vtemplate_file = os.path.join(toplevel, vtemplate)
-                try:
-                    with file(vtemplate_file) as f:
-                        content = f.read(-1) % env
-                except IOError as e:
-                    if e.errno == 2:
-                        raise RuntimeError("devflow.conf contains '%s' as a"
-                                           " version template file, but file"
-                                           " does not exists!"
-                                           % vtemplate_file)
-                    else:
-                        raise
-            else:
-                content = DEFAULT_VERSION_FILE % env
-            with file(os.path.join(toplevel, vfilename), 'w+') as f:
-                log.info("Updating version file '%s'" % vfilename)
-                f.write(content)
+
+def format_update_summary(summary):
+    return ("Version files: %d templates rendered, %d files written, %d up"
+            " to date (%s)" % (summary["rendered"], summary["written"],
+                               summary["skipped"],
+                               ", ".join("%s %.3fs" % t
+                                         for t in summary["timings"].items())))
+
+
+def update_version_main():
+    summary = update_version()
+    # The summary is only printed here, since distutils only shows warnings
+    # by default. It must not be returned, since it would become the exit
+    # status.
+    sys.stdout.write(format_update_summary(summary) + "\n")
 
 
 def bump_version_main():
@@ -481,21 +623,21 @@ def _bump_version(new_version, v):
     sys.stdout.write("Update version file and commited\n")
 
 
-def bump_version(new_version):
+def bump_version(new_version, vcs_info=None):
     """Set new base version to base version file and commit"""
-    v = utils.get_vcs_info()
+    v = vcs_info or utils.get_vcs_info()
 
     # Check that new base version is valid
     validate_version(new_version, v)
     _bump_version(new_version, v)
 
 
-def check_obsolete_version(version=None):
+def check_obsolete_version(version=None, vcs_info=None):
     """Check if the version is postfixed with 'next' which is deprecated.
     Output a warning"""
 
     if version is None:
-        v = utils.get_vcs_info()
+        v = vcs_info or utils.get_vcs_info()
         version = get_base_version(v)
 
     if not version.endswith('next'):
@@ -511,22 +653,106 @@ def check_obsolete_version(version=None):
         (version, new_version))
 
 
+# Number of revision numbers kept in memory while walking a range of commits
+RANGE_REVNO_CACHE_SIZE = 1024
+
+
+def iter_range_vcs_info(rev_range, branch=None, repo=None):
+    """Yield VCSInfo objects for all commits in a range, parents first.
+
+    The range is anything 'git rev-list' accepts, e.g. 'A..B'. Revision
+    numbers are computed incrementally from the ones of their parents. Only
+    the numbers of the most recent commits are kept in memory; the numbers
+    of other parents are found through utils.get_revision_number().
+
+    Note that to list the commits parents first, git has to walk the whole
+    range before it emits the first one, and keeps the list of commit ids in
+    its memory meanwhile. Only the rest of the work is streamed.
+
+    """
+    if repo is None:
+        repo = utils.get_repository()
+    if branch is None:
+        branch = utils.VCSInfo(repo).branch
+    backend = gitbackend.get_backend(repo)
+    revnos = OrderedDict()
+
+    def get_revno(sha):
+        try:
+            return revnos[sha]
+        except KeyError:
+            return utils.get_revision_number(repo, sha)
+
+    for line in backend.rev_list("--topo-order", "--reverse", "--parents",
+                                 rev_range):
+        shas = line.split()
+        sha, parents = shas[0], shas[1:]
+        if not parents:
+            revno = 1
+        else:
+            revno = get_revno(parents[0]) + 1
+            if len(parents) > 1:
+                # Add the commits that were merged in
+                revno += backend.count_commits("^" + parents[0],
+                                               *parents[1:])
+        revnos[sha] = revno
+        if len(revnos) > RANGE_REVNO_CACHE_SIZE:
+            revnos.popitem(last=False)
+
+        info = utils.VCSInfo(repo, rev=sha, branch=branch)
+        info.revno = revno
+        yield info
+
+
 def main():
-    v = utils.get_vcs_info()
-    b = get_base_version(v)
-    check_obsolete_version(b)
-    mode = utils.get_build_mode()
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(
+        description="Compute the Python or Debian version of the repository"
+                    " code. By default, the version of the checked out"
+                    " working tree is computed.")
+    parser.add_argument("flavor", choices=["python", "debian"],
+                        help="Kind of version to compute")
+    revs = parser.add_mutually_exclusive_group()
+    revs.add_argument("--at", metavar="REV",
+                      help="Compute the version of commit REV, without"
+                           " checking it out")
+    revs.add_argument("--range", metavar="A..B", dest="rev_range",
+                      help="Compute the versions of all commits in a range,"
+                           " printing one '<commit> <version>' line per"
+                           " commit, oldest first")
+    parser.add_argument("--branch",
+                        help="Branch name to compute the versions for, when"
+                             " using --at or --range. Defaults to the checked"
+                             " out branch")
+    args = parser.parse_args()
+
+    if args.rev_range is None:
+        v = utils.VCSInfo(rev=args.at, branch=args.branch)
+        b = get_base_version(v)
+        check_obsolete_version(b)
+        mode = utils.get_build_mode(v)
+        if args.flavor == "python":
+            print python_version(b, v, mode)
+        elif args.flavor == "debian":
+            print debian_version(b, v, mode)
+        return
+
+    tag_index = DebianTagIndex() if args.flavor == "debian" else None
+    for v in iter_range_vcs_info(args.rev_range, branch=args.branch):
+        sha = v.commit.hexsha
+        try:
+            b = get_base_version(v)
+            version = python_version(b, v, utils.get_build_mode(v))
+            if args.flavor == "debian":
+                version = debian_version_from_python_version(version,
+                                                             tag_index)
+        except ValueError as e:
+            sys.stderr.write("Skipping commit %s: %s\n" % (sha, e))
+            continue
+        sys.stdout.write("%s %s\n" % (sha, version))
+        sys.stdout.flush()
 
-    try:
-        arg = sys.argv[1]
-        assert arg == "python" or arg == "debian"
-    except (IndexError, AssertionError):
-        raise ValueError("A single argument, 'python' or 'debian is required")
-
-    if arg == "python":
-        print python_version(b, v, mode)
-    elif arg == "debian":
-        print debian_version(b, v, mode)
 
 if __name__ == "__main__":
     sys.exit(main())
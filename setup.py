@@ -76,10 +76,13 @@ setup(
 
     entry_points={
         'console_scripts': [
+            'devflow=devflow.cli:main',
             'devflow-version=devflow.versioning:main',
             'devflow-bump-version=devflow.versioning:bump_version_main',
-            'devflow-update-version=devflow.versioning:update_version',
+            'devflow-update-version=devflow.versioning:update_version_main',
             'devflow-autopkg=devflow.autopkg:main',
-            'devflow-flow=devflow.flow:main'],
+            'devflow-flow=devflow.flow:main',
+            'devflow-versiond=devflow.versiond:main',
+            'devflow-versionc=devflow.versiond:client_main'],
     },
 )
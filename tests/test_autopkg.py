@@ -0,0 +1,467 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+#
+#
+
+"""Unit Tests for devflow.autopkg
+
+The packages are built from scratch repositories, with git-buildpackage
+replaced by a script that writes fake packages named after the version.
+
+"""
+
+import os
+import re
+import sys
+import shutil
+import tempfile
+import unittest
+
+from devflow import autopkg, utils, versioning
+from test_utils import TemporaryRepositoryTestCase
+
+
+FAKE_GBP = """#!/bin/sh
+for arg; do
+    case "$arg" in
+        --git-export-dir=*) dir="${arg#--git-export-dir=}";;
+    esac
+done
+version="$DEB_DEVFLOW_DEBIAN_VERSION"
+case "$version" in
+    *~broken) echo "Failed to build $version" >&2; exit 1;;
+esac
+git symbolic-ref --short HEAD > "$dir/pkg_${version}_all.deb"
+echo "$DEBFULLNAME <$DEBEMAIL>" > "$dir/pkg_${version}_amd64.changes"
+"""
+
+FAKE_DPKG_BUILDPACKAGE = """#!/bin/sh
+# The version files must have been exported with the sources
+test -f sub/version.py || exit 1
+version="$DEB_DEVFLOW_DEBIAN_VERSION"
+head -n 1 debian/changelog > "../sub_${version}_all.deb"
+"""
+
+CONFIG = """\
+[ packages ]
+  [[ pkg ]]
+    version_file = pkg/version.py
+"""
+
+CHANGELOG = """\
+pkg (0.1-1) unstable; urgency=medium
+
+  * Initial release
+
+ -- Devflow Tester <tester@example.com>  Thu, 01 Jan 2015 00:00:00 +0000
+"""
+
+
+class AutopkgTestCase(TemporaryRepositoryTestCase):
+    """Run devflow-autopkg on a repository with a 'develop' branch.
+
+    The packaging is in the 'debian-develop' branch. The default codename
+    of the distribution is 'jessie'.
+
+    """
+    def setUp(self):
+        super(AutopkgTestCase, self).setUp()
+        self.write("version", "0.15dev\n")
+        self.write("devflow.conf", CONFIG)
+        self.write("pkg/__init__.py", "")
+        self.repo.git.add("version", "devflow.conf", "pkg")
+        self.commit()
+        self.repo.git.checkout("-b", "develop")
+        self.repo.git.checkout("-b", "debian-develop")
+        self.write("debian/changelog", CHANGELOG)
+        self.repo.git.add("debian")
+        self.commit()
+        self.repo.git.checkout("develop")
+        self.commit()
+
+        self.tmp = tempfile.mkdtemp(prefix="devflow-test-")
+        self.build_dir = os.path.join(self.tmp, "build")
+        bin_dir = os.path.join(self.tmp, "bin")
+        os.mkdir(bin_dir)
+        self.write_script(bin_dir, "git-buildpackage", FAKE_GBP)
+        self.write_script(bin_dir, "dpkg-buildpackage",
+                          FAKE_DPKG_BUILDPACKAGE)
+
+        self.cwd = os.getcwd()
+        self.argv = sys.argv
+        self.stdout = sys.stdout
+        self.environ = dict(os.environ)
+        os.environ["PATH"] = bin_dir + os.pathsep + os.environ["PATH"]
+        os.environ["DEVFLOW_CODENAME"] = "jessie"
+        # The clones do not have the identity of the repository
+        os.environ["HOME"] = self.tmp
+        with open(os.path.join(self.tmp, ".gitconfig"), "w") as f:
+            f.write("[user]\n\tname = Devflow Tester\n"
+                    "\temail = tester@example.com\n")
+        os.environ.pop("DEVFLOW_BUILD_MODE", None)
+        os.chdir(self.path)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        sys.argv = self.argv
+        sys.stdout = self.stdout
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.tmp)
+        super(AutopkgTestCase, self).tearDown()
+
+    def write(self, name, content):
+        path = os.path.join(self.path, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(content)
+
+    def write_script(self, directory, name, content):
+        path = os.path.join(directory, name)
+        with open(path, "w") as f:
+            f.write(content)
+        os.chmod(path, 0o755)
+
+    def autopkg(self, *args):
+        """Run devflow-autopkg and return its output.
+
+        The output goes to a file, since the workers redirect their output
+        at the level of file descriptors.
+
+        """
+        sys.argv = ["devflow-autopkg", "-b", self.build_dir, "--no-sign",
+                    "--no-cache"] + list(args)
+        with tempfile.TemporaryFile() as output:
+            sys.stdout = output
+            try:
+                autopkg.main()
+            finally:
+                sys.stdout = self.stdout
+                os.chdir(self.path)
+            output.seek(0)
+            return output.read()
+
+    def packages(self, subdir=""):
+        return sorted(name for name
+                      in os.listdir(os.path.join(self.build_dir, subdir))
+                      if name.endswith(".deb"))
+
+
+class TestBuild(AutopkgTestCase):
+    def test_snapshot(self):
+        upstream = self.repo.head.commit.hexsha[:7]
+        self.autopkg("snapshot")
+        packages = self.packages()
+        self.assertEqual(len(packages), 1)
+        self.assertTrue(packages[0].startswith("pkg_0.15~dev"))
+        self.assertTrue(packages[0].endswith(".%s-1~jessie_all.deb"
+                                             % upstream))
+        changes = packages[0].replace("_all.deb", "_amd64.changes")
+        with open(os.path.join(self.build_dir, changes)) as f:
+            self.assertEqual(f.read(),
+                             "Devflow Tester <tester@example.com>\n")
+        self.assertTrue(os.path.isfile(os.path.join(
+            self.build_dir, autopkg.TIMINGS_REPORT)))
+
+    def test_shared_clone(self):
+        repo_dir = os.path.join(self.tmp, "repo")
+        self.autopkg("snapshot", "--keep-repo", "-r", repo_dir)
+        alternates = os.path.join(repo_dir, ".git", "objects", "info",
+                                  "alternates")
+        self.assertFalse(os.path.exists(alternates))
+        packages = self.packages()
+        shutil.rmtree(repo_dir)
+        shutil.rmtree(self.build_dir)
+
+        self.autopkg("snapshot", "--shared-clone", "--keep-repo", "-r",
+                     repo_dir)
+        with open(alternates) as f:
+            self.assertEqual(f.read().strip(),
+                             os.path.join(self.path, ".git", "objects"))
+        self.assertEqual(self.packages(), packages)
+
+    def test_single_distribution_codename(self):
+        self.autopkg("snapshot", "--dist", "sid")
+        packages = self.packages()
+        self.assertEqual(len(packages), 1)
+        self.assertTrue(packages[0].endswith("-1~sid_all.deb"))
+
+    def test_distributions(self):
+        output = self.autopkg("snapshot", "--dist", "wheezy,jessie,wheezy")
+        self.assertTrue("Building for distributions wheezy, jessie using 2"
+                        " workers" in output)
+        for dist in ("wheezy", "jessie"):
+            packages = self.packages(dist)
+            self.assertEqual(len(packages), 1)
+            self.assertTrue(packages[0].endswith("-1~%s_all.deb" % dist))
+            self.assertTrue(os.path.isfile(os.path.join(
+                self.build_dir, "%s.log" % dist)))
+        self.assertEqual(self.packages(), [])
+
+    def test_distributions_existing_build_dir(self):
+        self.autopkg("snapshot", "--dist", "wheezy,jessie")
+        self.commit()
+        self.autopkg("snapshot", "--dist", "wheezy,jessie")
+        for dist in ("wheezy", "jessie"):
+            self.assertEqual(len(self.packages(dist)), 2)
+
+    def test_failed_distribution(self):
+        with self.assertRaises(RuntimeError) as cm:
+            self.autopkg("snapshot", "--dist", "jessie,broken")
+        self.assertEqual(str(cm.exception),
+                         "Build failed for distributions: broken")
+        self.assertEqual(len(self.packages("jessie")), 1)
+        with open(os.path.join(self.build_dir, "broken.log")) as f:
+            self.assertTrue("Failed to build" in f.read())
+
+    def test_release_distributions(self):
+        self.assertRaises(ValueError, self.autopkg, "release", "--dist",
+                          "jessie,wheezy")
+
+
+class TestDryRun(AutopkgTestCase):
+    def dry_run_version(self, *args):
+        branches = self.repo.git.for_each_ref("refs/heads")
+        output = self.autopkg("snapshot", "--dry-run", *args)
+        self.assertEqual(self.repo.git.for_each_ref("refs/heads"), branches)
+        self.assertFalse(os.path.exists(self.build_dir))
+        match = re.search(r"Would build version '([^']*)'(.*) for"
+                          r" distribution '([^']*)' from branch '([^']*)'",
+                          output)
+        return match.groups()
+
+    def build_version(self, *args):
+        output = self.autopkg("snapshot", *args)
+        return re.search(r"The new debian version will be: '([^']*)'",
+                         output).group(1)
+
+    def test_merge(self):
+        version, estimate, dist, branch = self.dry_run_version()
+        self.assertEqual(estimate, "")
+        self.assertEqual((dist, branch), ("unstable", "debian-develop"))
+        self.assertEqual(version, self.build_version())
+
+    def test_fast_forward(self):
+        self.merge("debian-develop")
+        self.commit()
+        version, estimate, _, _ = self.dry_run_version()
+        self.assertEqual(estimate, "")
+        self.assertEqual(version, self.build_version())
+
+    def test_distribution_branch(self):
+        self.repo.git.branch("debian-develop-sid", "debian-develop")
+        version, estimate, dist, branch = self.dry_run_version("--dist",
+                                                               "sid")
+        self.assertEqual(estimate, "")
+        self.assertEqual((dist, branch), ("sid", "debian-develop-sid"))
+        self.assertEqual(version, self.build_version("--dist", "sid"))
+
+    def test_remote_branch(self):
+        self.repo.git.update_ref("refs/remotes/origin/debian-develop",
+                                 "debian-develop")
+        self.repo.git.branch("-D", "debian-develop")
+        version, estimate, _, branch = self.dry_run_version()
+        self.assertEqual((estimate, branch), ("", "debian-develop"))
+        self.assertEqual(version, self.build_version())
+
+    def test_estimate(self):
+        self.repo.git.branch("-D", "debian-develop")
+        version, estimate, _, _ = self.dry_run_version()
+        self.assertEqual(version, versioning.get_debian_version(
+            utils.VCSInfo(self.repo)))
+        self.assertTrue(estimate.startswith(
+            " (estimated from branch 'develop' only"))
+
+
+class TestScratchSpace(AutopkgTestCase):
+    def setUp(self):
+        super(TestScratchSpace, self).setUp()
+        self.write("data", "x" * 4096)
+        self.repo.git.add("data")
+        self.commit()
+        self.scratch_dir = os.path.join(self.tmp, "scratch")
+        os.mkdir(self.scratch_dir)
+
+    def test_estimate_build_space(self):
+        tree = self.repo.head.commit.tree
+        tree_size = sum(item.size for item in tree.traverse()
+                        if item.type == "blob")
+        self.assertTrue(tree_size > 4096)
+        self.assertEqual(autopkg.estimate_build_space(self.repo, "HEAD",
+                                                      shared=True),
+                         2 * tree_size)
+        self.assertEqual(autopkg.estimate_build_space(self.repo, "HEAD", 3,
+                                                      shared=True),
+                         6 * tree_size)
+        counts = dict(line.split(": ") for line
+                      in self.repo.git.count_objects("-v").splitlines())
+        objects_size = (int(counts["size"]) + int(counts["size-pack"])) * 1024
+        self.assertEqual(autopkg.estimate_build_space(self.repo, "HEAD"),
+                         2 * tree_size + objects_size)
+
+    def test_check_free_space(self):
+        autopkg.check_free_space(self.scratch_dir, 0)
+        with self.assertRaises(RuntimeError) as cm:
+            autopkg.check_free_space(self.scratch_dir, 1 << 60)
+        self.assertTrue(str(cm.exception).startswith(
+            "Not enough free space in '%s': %d MiB are required, but only"
+            % (self.scratch_dir, 1 << 40)))
+
+    def test_scratch_min_free(self):
+        with self.assertRaises(RuntimeError) as cm:
+            self.autopkg("snapshot", "--scratch-dir", self.scratch_dir,
+                         "--scratch-min-free", str(1 << 40))
+        self.assertTrue("%d MiB are required" % (1 << 40)
+                        in str(cm.exception))
+        self.assertEqual(os.listdir(self.scratch_dir), [])
+
+        self.autopkg("snapshot", "--scratch-dir", self.scratch_dir,
+                     "--scratch-min-free", "0")
+        self.assertEqual(len(self.packages()), 1)
+        # The clone and the intermediate files are removed
+        self.assertEqual(os.listdir(self.scratch_dir), [])
+
+    def test_estimated_scratch_space(self):
+        self.autopkg("snapshot", "--scratch-dir", self.scratch_dir)
+        self.assertEqual(len(self.packages()), 1)
+        self.assertEqual(os.listdir(self.scratch_dir), [])
+
+
+class TestSourcePackages(AutopkgTestCase):
+    """Build a package with its own 'source_dir' next to the root package."""
+    def setUp(self):
+        super(TestSourcePackages, self).setUp()
+        self.write("devflow.conf", CONFIG + "  [[ sub ]]\n"
+                   "    version_file = snf-sub/sub/version.py\n"
+                   "    source_dir = snf-sub/\n")
+        self.write("snf-sub/sub/__init__.py", "")
+        self.repo.git.add("devflow.conf", "snf-sub")
+        self.commit()
+        self.repo.git.checkout("debian-develop")
+        self.write("snf-sub/debian/changelog",
+                   CHANGELOG.replace("pkg (", "sub ("))
+        self.write("snf-sub/debian/source/format", "3.0 (quilt)\n")
+        self.repo.git.add("snf-sub")
+        self.commit()
+        self.repo.git.checkout("develop")
+
+    def test_build(self):
+        output = self.autopkg("snapshot")
+        self.assertTrue("Building packages sub using 1 workers" in output)
+        self.assertEqual(len(self.packages()), 1)
+        packages = self.packages("sub")
+        self.assertEqual(len(packages), 1)
+        version = packages[0][len("sub_"):-len("_all.deb")]
+        self.assertTrue(version.endswith("-1~jessie"))
+        # The changelog of the subdirectory got the new entry
+        with open(os.path.join(self.build_dir, "sub", packages[0])) as f:
+            self.assertEqual(f.read(),
+                             "sub (%s) unstable; urgency=medium\n" % version)
+        upstream_version = version.rsplit("-", 1)[0]
+        self.assertTrue(os.path.isfile(os.path.join(
+            self.build_dir, "sub", "sub_%s.orig.tar.gz" % upstream_version)))
+        self.assertTrue(os.path.isfile(os.path.join(self.build_dir,
+                                                    "sub.log")))
+
+    def test_package_debian_branch(self):
+        self.repo.git.checkout("debian-develop")
+        self.repo.git.checkout("-b", "debian-develop-sub")
+        self.write("snf-sub/debian/compat", "9\n")
+        self.repo.git.add("snf-sub")
+        self.commit()
+        self.repo.git.checkout("develop")
+        with open(os.path.join(self.path, "devflow.conf"), "a") as f:
+            f.write("    debian_branch = debian-develop-sub\n")
+        self.repo.git.add("devflow.conf")
+        self.commit()
+
+        output = self.autopkg("snapshot")
+        self.assertTrue("Merged branch 'develop' into 'debian-develop-sub'"
+                        in output)
+        # The root package is built from its own debian branch
+        packages = self.packages()
+        self.assertEqual(len(packages), 1)
+        with open(os.path.join(self.build_dir, packages[0])) as f:
+            self.assertEqual(f.read(), "debian-develop\n")
+        self.assertEqual(len(self.packages("sub")), 1)
+
+    def test_single_distribution_only(self):
+        with self.assertRaises(ValueError) as cm:
+            self.autopkg("snapshot", "--dist", "jessie,wheezy")
+        self.assertTrue("for a single distribution" in str(cm.exception))
+        package = {"sub": None}
+        self.assertRaises(ValueError, autopkg.check_distributions,
+                          ["jessie"], "release", package)
+        autopkg.check_distributions(["jessie"], "snapshot", package)
+        autopkg.check_distributions(["jessie", "wheezy"], "snapshot", {})
+
+
+class TestCollectArtifacts(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix="devflow-test-")
+        self.work_dir = os.path.join(self.path, "work")
+        self.build_dir = os.path.join(self.path, "build")
+        for name in ["pkg_1.0-1_all.deb", "pkg_1.0-1.dsc", "jessie.log",
+                     "notes.txt", "jessie/pkg_1.0-1~jessie_all.deb",
+                     "jessie/pkg-1.0/setup.py", "wheezy/pkg.deb"]:
+            path = os.path.join(self.work_dir, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "w") as f:
+                f.write(name)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_collect(self):
+        autopkg.collect_artifacts(self.work_dir, self.build_dir,
+                                  ["jessie", "sid"], lambda msg: None)
+        self.assertFalse(os.path.exists(self.work_dir))
+        self.assertEqual(sorted(os.listdir(self.build_dir)),
+                         ["jessie", "jessie.log", "pkg_1.0-1.dsc",
+                          "pkg_1.0-1_all.deb"])
+        self.assertEqual(os.listdir(os.path.join(self.build_dir, "jessie")),
+                         ["pkg_1.0-1~jessie_all.deb"])
+
+    def test_same_directory(self):
+        autopkg.collect_artifacts(self.work_dir, self.work_dir, ["jessie"],
+                                  lambda msg: None)
+        self.assertTrue(os.path.isfile(os.path.join(self.work_dir,
+                                                    "notes.txt")))
+
+
+if __name__ == '__main__':
+    unittest.main()
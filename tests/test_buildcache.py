@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+#
+#
+
+"""Unit Tests for devflow.buildcache"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from devflow import buildcache
+
+
+class TestBuildCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix="devflow-test-")
+        self.cache_dir = os.path.join(self.path, "cache")
+        self.build_dir = os.path.join(self.path, "build")
+        os.mkdir(self.build_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, directory, name, content="data"):
+        path = os.path.join(directory, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_cache_key(self):
+        key = buildcache.get_cache_key("abc", "1.0-1", "wheezy",
+                                       {"sign": False, "source_only": False})
+        self.assertEqual(key, buildcache.get_cache_key(
+            "abc", "1.0-1", "wheezy", {"source_only": False, "sign": False}))
+        self.assertNotEqual(key, buildcache.get_cache_key(
+            "abd", "1.0-1", "wheezy", {"sign": False, "source_only": False}))
+        self.assertNotEqual(key, buildcache.get_cache_key(
+            "abc", "1.0-1", "jessie", {"sign": False, "source_only": False}))
+        self.assertNotEqual(key, buildcache.get_cache_key(
+            "abc", "1.0-1", "wheezy", {"sign": False, "source_only": True}))
+        self.assertNotEqual(
+            buildcache.get_cache_key("abc", "1.0-1", "wheezy",
+                                     {"maintainer": "A <a@example.com>"}),
+            buildcache.get_cache_key("abc", "1.0-1", "wheezy",
+                                     {"maintainer": "B <b@example.com>"}))
+
+    def test_new_artifacts(self):
+        self.write(self.build_dir, "old_1.0-1_all.deb")
+        os.mkdir(os.path.join(self.build_dir, "pkg-1.0"))
+        before = buildcache.list_artifacts(self.build_dir)
+        self.write(self.build_dir, "pkg_1.1-1_all.deb")
+        self.write(self.build_dir, "pkg_1.1-1.dsc")
+        self.write(self.build_dir, "pkg_1.1.orig.tar.gz")
+        self.write(self.build_dir, "build.log")
+        after = buildcache.list_artifacts(self.build_dir)
+        self.assertEqual(buildcache.new_artifacts(before, after),
+                         ["pkg_1.1-1.dsc", "pkg_1.1-1_all.deb",
+                          "pkg_1.1.orig.tar.gz"])
+
+    def test_store_and_restore(self):
+        key = buildcache.get_cache_key("abc", "1.0-1", "wheezy")
+        self.assertEqual(buildcache.restore(self.cache_dir, key,
+                                            self.build_dir), None)
+        files = [self.write(self.build_dir, "pkg_1.0-1_all.deb", "deb"),
+                 self.write(self.build_dir, "pkg_1.0-1_amd64.changes", "chg")]
+        self.assertTrue(buildcache.store(self.cache_dir, key, files))
+        self.assertFalse(buildcache.store(self.cache_dir, key, files))
+        self.assertEqual(buildcache.lookup(self.cache_dir, key),
+                         ["pkg_1.0-1_all.deb", "pkg_1.0-1_amd64.changes"])
+
+        other_dir = os.path.join(self.path, "other")
+        restored = buildcache.restore(self.cache_dir, key, other_dir)
+        self.assertEqual(restored,
+                         [os.path.join(other_dir, "pkg_1.0-1_all.deb"),
+                          os.path.join(other_dir, "pkg_1.0-1_amd64.changes")])
+        with open(restored[0]) as f:
+            self.assertEqual(f.read(), "deb")
+        # Only complete entries are visible in the cache directory
+        self.assertEqual(os.listdir(self.cache_dir), [key])
+
+    def test_entries_are_copies(self):
+        key = buildcache.get_cache_key("abc", "1.0-1", "wheezy")
+        files = [self.write(self.build_dir, "pkg_1.0-1_all.deb", "deb")]
+        buildcache.store(self.cache_dir, key, files)
+        cached = os.path.join(self.cache_dir, key, "pkg_1.0-1_all.deb")
+        self.assertEqual(os.stat(cached).st_mode & 0o222, 0)
+        other_dir = os.path.join(self.path, "other")
+        restored = buildcache.restore(self.cache_dir, key, other_dir)[0]
+        for path in files + [restored]:
+            self.assertNotEqual(os.stat(path).st_ino, os.stat(cached).st_ino)
+        self.assertEqual(os.stat(cached).st_nlink, 1)
+
+        # Editing the packages of a build leaves the cache untouched
+        self.write(self.build_dir, "pkg_1.0-1_all.deb", "changed")
+        self.write(other_dir, "pkg_1.0-1_all.deb", "signed")
+        with open(cached) as f:
+            self.assertEqual(f.read(), "deb")
+
+    def test_prune(self):
+        keys = []
+        for i in range(4):
+            key = buildcache.get_cache_key("abc", "1.0-%d" % i, "wheezy")
+            path = self.write(self.build_dir, "pkg_1.0-%d_all.deb" % i,
+                              "x" * 100)
+            buildcache.store(self.cache_dir, key, [path])
+            os.utime(os.path.join(self.cache_dir, key), (1000 + i, 1000 + i))
+            keys.append(key)
+
+        # Restoring an entry marks it as recently used
+        buildcache.restore(self.cache_dir, keys[0], self.build_dir)
+        now = os.stat(os.path.join(self.cache_dir, keys[0])).st_mtime
+        self.assertEqual(buildcache.prune(self.cache_dir, max_size=250,
+                                          max_age=now), 2)
+        self.assertEqual(sorted(os.listdir(self.cache_dir)),
+                         sorted([keys[0], keys[3]]))
+        self.assertEqual(buildcache.prune(self.cache_dir, max_size=250,
+                                          max_age=now - 1004, now=now), 1)
+        self.assertEqual(os.listdir(self.cache_dir), [keys[0]])
+        self.assertEqual(buildcache.prune(os.path.join(self.path, "none")),
+                         0)
+
+
+if __name__ == '__main__':
+    unittest.main()
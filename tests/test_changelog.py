@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+#
+#
+
+"""Unit Tests for devflow.changelog"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from devflow import changelog
+
+
+OLD_ENTRY = """\
+pkg (0.1-1) unstable; urgency=low
+
+  * Initial release
+
+ -- Old Maintainer <old@example.com>  Mon, 01 Jan 2018 00:00:00 +0000
+"""
+
+
+class TestChangelog(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix="devflow-test-")
+        self.changelog = os.path.join(self.path, "changelog")
+        with open(self.changelog, "w") as f:
+            f.write(OLD_ENTRY)
+        os.chmod(self.changelog, 0o640)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_add_entry(self):
+        entry = changelog.add_entry(self.changelog, "0.2-1~wheezy", "wheezy",
+                                    "snapshot build",
+                                    maintainer="A B <ab@example.com>",
+                                    date="Tue, 02 Jan 2018 10:00:00 +0200")
+        expected = ("pkg (0.2-1~wheezy) wheezy; urgency=medium\n"
+                    "\n"
+                    "  * snapshot build\n"
+                    "\n"
+                    " -- A B <ab@example.com>  "
+                    "Tue, 02 Jan 2018 10:00:00 +0200\n"
+                    "\n")
+        self.assertEqual(entry, expected)
+        with open(self.changelog) as f:
+            self.assertEqual(f.read(), expected + OLD_ENTRY)
+        self.assertEqual(os.stat(self.changelog).st_mode & 0o777, 0o640)
+        self.assertEqual(os.listdir(self.path), ["changelog"])
+
+    def test_maintainer_from_environment(self):
+        old_env = os.environ.copy()
+        try:
+            os.environ["DEBFULLNAME"] = "C D"
+            os.environ["DEBEMAIL"] = "cd@example.com"
+            entry = changelog.add_entry(self.changelog, "0.2-1", "unstable",
+                                        ["first", "second"], urgency="low")
+        finally:
+            os.environ.clear()
+            os.environ.update(old_env)
+        lines = entry.splitlines()
+        self.assertEqual(lines[0], "pkg (0.2-1) unstable; urgency=low")
+        self.assertEqual(lines[2:4], ["  * first", "  * second"])
+        self.assertTrue(lines[5].startswith(" -- C D <cd@example.com>  "))
+
+    def test_bad_changelog(self):
+        with open(self.changelog, "w") as f:
+            f.write("not a changelog\n")
+        self.assertRaises(ValueError, changelog.add_entry, self.changelog,
+                          "0.2-1", "unstable", "build", maintainer="A B <a@b>")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+#
+#
+
+"""Unit Tests for devflow.cli"""
+
+import os
+import sys
+import subprocess
+import unittest
+from StringIO import StringIO
+
+from devflow import cli
+
+TOPLEVEL = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def echo_argv():
+    return list(sys.argv)
+
+
+class TestDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.argv = sys.argv
+        self.stdout, self.stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+
+    def tearDown(self):
+        sys.argv = self.argv
+        sys.stdout, sys.stderr = self.stdout, self.stderr
+        cli.COMMANDS.pop("echo", None)
+
+    def test_usage(self):
+        self.assertEqual(cli.main([]), 0)
+        for name in cli.COMMANDS:
+            self.assertTrue(name in sys.stdout.getvalue())
+
+    def test_unknown_command(self):
+        self.assertEqual(cli.main(["bogus"]), 2)
+        self.assertTrue("bogus" in sys.stderr.getvalue())
+
+    def test_commands_exist(self):
+        for name in cli.COMMANDS:
+            self.assertTrue(callable(cli.load_command(name)))
+
+    def test_dispatch(self):
+        cli.COMMANDS["echo"] = ("test_cli", "echo_argv", "")
+        self.assertEqual(cli.main(["echo", "-x", "arg"]),
+                         ["devflow-echo", "-x", "arg"])
+
+    def test_lazy_imports(self):
+        code = ("import sys, devflow.cli, devflow.versioning;"
+                " print(' '.join(m for m in ('git', 'sh', 'configobj')"
+                " if m in sys.modules))")
+        env = dict(os.environ, PYTHONPATH=TOPLEVEL)
+        out = subprocess.check_output([sys.executable, "-c", code], env=env)
+        self.assertEqual(out.strip(), "")
+
+
+if __name__ == '__main__':
+    unittest.main()
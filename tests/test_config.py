@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+#
+#
+
+"""Unit Tests for devflow.config"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from devflow import config
+from devflow import utils
+from test_utils import TemporaryRepositoryTestCase
+
+CONFIG = """[ packages ]
+  [[ a ]]
+    version_file = a.py, b.py
+    version_template = template, template
+  [[ b ]]
+    version_file = c.py
+    source_dir = snf-b/
+    debian_branch = debian-b
+  [[ c ]]
+"""
+
+
+class TestConfig(TemporaryRepositoryTestCase):
+    def setUp(self):
+        super(TestConfig, self).setUp()
+        self.config_path = os.path.join(self.path, config.CONFIG_FILE)
+        self.write(CONFIG)
+        self.cache_path = os.path.join(self.path, ".git", config.CACHE_FILE)
+        self.compile_config = config.compile_config
+
+    def tearDown(self):
+        config.compile_config = self.compile_config
+        super(TestConfig, self).tearDown()
+
+    def write(self, content):
+        with open(self.config_path, "w") as f:
+            f.write(content)
+
+    def check(self, conf):
+        self.assertEqual(conf.path, self.config_path)
+        self.assertEqual(conf.package_names, ("a", "b", "c"))
+        a = conf.get_package("a")
+        self.assertEqual(a.version_files, ("a.py", "b.py"))
+        self.assertEqual(a.version_templates, ("template", "template"))
+        self.assertEqual(a.source_dir, None)
+        b = conf.get_package("b")
+        self.assertEqual(b.version_files, ("c.py",))
+        self.assertEqual(b.version_templates, ())
+        self.assertEqual(b.source_dir, "snf-b/")
+        self.assertEqual(b.debian_branch, "debian-b")
+        self.assertEqual(conf.get_package("c").version_files, ())
+        self.assertRaises(KeyError, conf.get_package, "d")
+
+    def test_compile(self):
+        conf = config.compile_config(self.config_path)
+        self.check(conf)
+        self.assertRaises(AttributeError, setattr, conf, "packages", ())
+        self.assertRaises(AttributeError, setattr, conf.packages[0],
+                          "version_files", ())
+
+    def test_cache(self):
+        self.check(config.load(self.config_path))
+        self.assertTrue(os.path.isfile(self.cache_path))
+
+        def fail(path):
+            raise AssertionError("Parsed %s again" % path)
+        config.compile_config = fail
+        conf = config.load(self.config_path)
+        self.check(conf)
+        self.assertTrue(isinstance(conf.path, str))
+        self.assertTrue(isinstance(conf.packages[0].version_files[0], str))
+
+        # A change of the file invalidates the cache
+        config.compile_config = self.compile_config
+        self.write("[ packages ]\n  [[ d ]]\n")
+        self.assertEqual(config.load(self.config_path).package_names,
+                         ("d",))
+
+    def test_corrupted_cache(self):
+        with open(self.cache_path, "w") as f:
+            f.write("{")
+        self.check(config.load(self.config_path))
+
+    def test_outside_repository(self):
+        path = tempfile.mkdtemp(prefix="devflow-test-")
+        try:
+            config_path = os.path.join(path, config.CONFIG_FILE)
+            shutil.copy(self.config_path, config_path)
+            self.assertEqual(config.get_cache_path(config_path), None)
+            self.assertEqual(config.load(config_path).package_names,
+                             ("a", "b", "c"))
+        finally:
+            shutil.rmtree(path)
+
+    def test_find_repository(self):
+        subdir = os.path.join(self.path, "a", "b")
+        os.makedirs(subdir)
+        toplevel, git_dir = config.find_repository(subdir)
+        self.assertEqual(toplevel, self.path)
+        self.assertEqual(git_dir, os.path.join(self.path, ".git"))
+
+    def test_get_config(self):
+        cwd = os.getcwd()
+        os.chdir(self.path)
+        try:
+            self.check(utils.get_compiled_config())
+            conf = utils.get_config()
+        finally:
+            os.chdir(cwd)
+        # get_config() returns the ConfigObj mapping, as it always did
+        self.assertEqual(conf["packages"].keys(), ["a", "b", "c"])
+        self.assertEqual(conf["packages"]["b"]["source_dir"], "snf-b/")
+        for get_config in (utils.get_config, utils.get_compiled_config):
+            self.assertRaises(RuntimeError, get_config,
+                              os.path.join(self.path, "missing.conf"))
+
+
+if __name__ == '__main__':
+    unittest.main()
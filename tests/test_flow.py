@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+#
+#
+
+"""Unit Tests for devflow.flow"""
+
+import os
+import sys
+import shutil
+import logging
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from devflow import flow, utils
+from test_utils import TemporaryRepositoryTestCase
+
+
+class TestEditChangelog(TemporaryRepositoryTestCase):
+    def setUp(self):
+        super(TestEditChangelog, self).setUp()
+        with open(os.path.join(self.path, "version"), "w") as f:
+            f.write("0.15dev\n")
+        self.repo.git.add("version")
+        self.commit()
+        self.repo.git.checkout("-b", "develop")
+        self.repo.git.checkout("-b", "feature-x")
+        self.commit("Fix the parser")
+        self.repo.git.checkout("-b", "feature-y")
+        self.commit("Fix the parser")
+        self.repo.git.checkout("feature-x")
+        self.merge("feature-y")
+        self.commit("Add the option")
+        self.head = self.repo.head.commit.hexsha
+
+        # The changelog is edited with 'editor', which leaves it as is
+        self.bin_dir = tempfile.mkdtemp(prefix="devflow-test-")
+        editor = os.path.join(self.bin_dir, "editor")
+        with open(editor, "w") as f:
+            f.write("#!/bin/sh\n")
+        os.chmod(editor, 0o755)
+        self.environ_path = os.environ["PATH"]
+        os.environ["PATH"] = self.bin_dir + os.pathsep + self.environ_path
+
+        # GitManager logs to the root logger and sets its level
+        self.logger = logging.getLogger("")
+        self.level = self.logger.level
+        self.handler = logging.NullHandler()
+        self.logger.addHandler(self.handler)
+        self.gm = flow.GitManager(utils.VCSInfo(self.repo))
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self.level)
+        os.environ["PATH"] = self.environ_path
+        shutil.rmtree(self.bin_dir)
+        super(TestEditChangelog, self).tearDown()
+
+    def entry(self, **kwargs):
+        """Edit the changelog and return the lines of the new entry."""
+        self.repo.git.reset("--hard", self.head)
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            self.gm.edit_changelog("feature-x", "develop", **kwargs)
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(self.repo.head.commit.message.strip(),
+                         "Update changelog")
+        with open(os.path.join(self.path, "Changelog")) as f:
+            return f.read().splitlines()
+
+    def test_all_subjects(self):
+        self.assertEqual(self.entry(),
+                         ["#Changelog for feature-x",
+                          "* Add the option",
+                          "* Merge feature-y",
+                          "* Fix the parser",
+                          "* Fix the parser",
+                          ""])
+
+    def test_no_merges(self):
+        self.assertEqual(self.entry(no_merges=True),
+                         ["#Changelog for feature-x",
+                          "* Add the option",
+                          "* Fix the parser",
+                          "* Fix the parser",
+                          ""])
+
+    def test_unique_subjects(self):
+        self.assertEqual(self.entry(unique_subjects=True),
+                         ["#Changelog for feature-x",
+                          "* Add the option",
+                          "* Merge feature-y",
+                          "* Fix the parser",
+                          ""])
+        self.assertEqual(self.entry(no_merges=True, unique_subjects=True),
+                         ["#Changelog for feature-x",
+                          "* Add the option",
+                          "* Fix the parser",
+                          ""])
+
+
+if __name__ == '__main__':
+    unittest.main()
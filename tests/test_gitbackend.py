@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+#
+#
+
+"""Unit Tests for devflow.gitbackend
+
+Checks that all git backends give the same answers on a temporary
+repository.
+
+"""
+
+import os
+import unittest
+
+from devflow import gitbackend
+from test_utils import TemporaryRepositoryTestCase
+
+
+class BackendTests(object):
+    backend_class = None
+
+    def setUp(self):
+        super(BackendTests, self).setUp()
+        with open(os.path.join(self.path, "version"), "w") as f:
+            f.write("0.14\n")
+        self.repo.git.add("version")
+        self.first = self.commit("First commit\n\nWith a body")
+        self.repo.git.tag("debian/0.14-1")
+        self.second = self.commit("Second commit")
+        self.backend = self.backend_class(self.repo.git_dir)
+
+    def tearDown(self):
+        self.backend.close()
+        super(BackendTests, self).tearDown()
+
+    def test_resolve(self):
+        self.assertEqual(self.backend.resolve("HEAD"), self.second.hexsha)
+        self.assertEqual(self.backend.resolve("refs/tags/debian/0.14-1"),
+                         self.first.hexsha)
+        self.assertEqual(self.backend.resolve("refs/heads/missing"), None)
+        self.assertTrue(self.backend.ref_exists("refs/heads/master"))
+        self.assertFalse(self.backend.ref_exists("refs/heads/develop"))
+
+    def test_revisions_with_spaces(self):
+        self.assertEqual(self.backend.resolve("HEAD^{/First commit}"),
+                         self.first.hexsha)
+        self.assertEqual(self.backend.resolve("HEAD^{/No such commit}"),
+                         None)
+        self.assertEqual(self.backend.read_blob("HEAD:missing file"), None)
+        self.assertEqual(self.backend.read_commit("HEAD^{/Second commit}")
+                         .hexsha, self.second.hexsha)
+
+    def test_read_blob(self):
+        self.assertEqual(self.backend.read_blob("HEAD:version"), "0.14\n")
+        self.assertEqual(self.backend.read_blob("HEAD:missing"), None)
+
+    def test_read_commit(self):
+        commit = self.backend.read_commit("master")
+        self.assertEqual(commit.hexsha, self.second.hexsha)
+        self.assertEqual(commit.parents, [self.first.hexsha])
+        self.assertEqual(commit.tree, self.second.tree.hexsha)
+        self.assertTrue(commit.author.startswith(
+            "Devflow Tester <tester@example.com>"))
+        commit = self.backend.read_commit(self.first.hexsha)
+        self.assertEqual(commit.message, "First commit\n\nWith a body\n")
+        self.assertEqual(commit.parents, [])
+        self.assertRaises(ValueError, self.backend.read_commit, "missing")
+
+    def test_head_branch(self):
+        self.assertEqual(self.backend.head_branch(), "master")
+        self.repo.git.checkout(self.first.hexsha)
+        self.assertEqual(self.backend.head_branch(), None)
+
+    def test_list_refs(self):
+        self.assertEqual(self.backend.list_refs("refs/tags/"),
+                         [("refs/tags/debian/0.14-1", self.first.hexsha)])
+        self.assertEqual(self.backend.list_refs("refs/heads/", "refs/tags/"),
+                         [("refs/heads/master", self.second.hexsha),
+                          ("refs/tags/debian/0.14-1", self.first.hexsha)])
+
+    def test_rev_list(self):
+        self.assertEqual(list(self.backend.rev_list("HEAD")),
+                         [self.second.hexsha, self.first.hexsha])
+        self.assertEqual(self.backend.count_commits("HEAD"), 2)
+
+    def test_log_subjects(self):
+        self.repo.git.checkout("-b", "feature")
+        self.commit("Second commit")
+        self.repo.git.checkout("master")
+        self.merge("feature")
+        self.assertEqual(list(self.backend.log_subjects("HEAD~1..HEAD")),
+                         ["Merge feature", "Second commit"])
+        self.assertEqual(list(self.backend.log_subjects("--no-merges",
+                                                        "HEAD")),
+                         ["Second commit", "Second commit", "First commit"])
+
+
+class TestSubprocessBackend(BackendTests, TemporaryRepositoryTestCase):
+    backend_class = gitbackend.GitBackend
+
+
+class TestBatchBackend(BackendTests, TemporaryRepositoryTestCase):
+    backend_class = gitbackend.BatchBackend
+
+
+if __name__ == '__main__':
+    unittest.main()
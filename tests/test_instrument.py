@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+#
+#
+
+"""Unit Tests for devflow.instrument"""
+
+import json
+import os
+import unittest
+from StringIO import StringIO
+
+import git
+
+from devflow import gitbackend
+from devflow import instrument
+from test_utils import TemporaryRepositoryTestCase
+
+
+class TestPhaseTimer(TemporaryRepositoryTestCase):
+    def setUp(self):
+        super(TestPhaseTimer, self).setUp()
+        self.commit()
+        self.commit()
+
+    def test_phases(self):
+        timer = instrument.PhaseTimer()
+        with instrument.counting():
+            self.run_phases(timer)
+        report = timer.report()
+        self.assertEqual(list(report["phases"]),
+                         ["gitpython", "backend", "idle"])
+        self.assertEqual(report["phases"]["gitpython"]["git_commands"], 3)
+        self.assertEqual(report["phases"]["backend"]["git_commands"], 1)
+        self.assertEqual(report["phases"]["idle"]["git_commands"], 0)
+        self.assertEqual(report["total"]["git_commands"], 4)
+        self.assertTrue(report["total"]["wall"] >= 0)
+
+        path = os.path.join(self.path, "timings.json")
+        timer.write_report(path)
+        with open(path) as f:
+            self.assertEqual(json.load(f)["total"]["git_commands"], 4)
+        table = timer.format_table().splitlines()
+        self.assertEqual(len(table), 5)
+        self.assertTrue(table[-1].startswith("total"))
+
+    def run_phases(self, timer):
+        timer.start("gitpython")
+        timer.start("gitpython")
+        self.repo.git.rev_parse("HEAD")
+        self.repo.git.rev_parse("HEAD~1")
+        timer.start("backend")
+        backend = gitbackend.GitBackend(self.repo.git_dir)
+        backend.count_commits("HEAD")
+        timer.start("idle")
+        timer.start("gitpython")
+        self.repo.git.rev_parse("HEAD")
+
+    def test_restored(self):
+        execute = vars(git.cmd.Git)["execute"]
+        try:
+            with instrument.counting():
+                self.assertNotEqual(vars(git.cmd.Git)["execute"], execute)
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        self.assertEqual(vars(git.cmd.Git)["execute"], execute)
+        self.assertEqual(gitbackend._hooks, [])  # pylint: disable=W0212
+        count = instrument.git_command_count()
+        self.repo.git.rev_parse("HEAD")
+        gitbackend.GitBackend(self.repo.git_dir).count_commits("HEAD")
+        self.assertEqual(instrument.git_command_count(), count)
+
+
+class TestGitTracer(TemporaryRepositoryTestCase):
+    def setUp(self):
+        super(TestGitTracer, self).setUp()
+        self.commit()
+        self.stream = StringIO()
+
+    def tearDown(self):
+        os.environ.pop("DEVFLOW_TRACE", None)
+        super(TestGitTracer, self).tearDown()
+
+    def test_git_subcommand(self):
+        self.assertEqual(instrument.git_subcommand(
+            ["git", "--git-dir=.git", "rev-parse", "HEAD"]), "rev-parse")
+        self.assertEqual(instrument.git_subcommand(
+            ["/usr/bin/git", "-c", "a.b=c", "log"]), "log")
+        self.assertEqual(instrument.git_subcommand(["git", "--version"]),
+                         None)
+
+    def run_commands(self):
+        self.repo.git.rev_parse("HEAD")
+        self.repo.git.rev_parse("HEAD")
+        self.assertRaises(git.GitCommandError, self.repo.git.rev_parse,
+                          "--verify", "missing")
+        backend = gitbackend.GitBackend(self.repo.git_dir)
+        self.assertEqual(list(backend.rev_list("HEAD")),
+                         [self.repo.head.commit.hexsha])
+        self.assertEqual(backend.resolve("missing"), None)
+
+    def test_summary(self):
+        with instrument.tracing(True, stream=self.stream) as tracer:
+            self.run_commands()
+        self.assertEqual(instrument.get_tracer(), None)
+        self.assertTrue("rev-parse" in self.stream.getvalue())
+
+        summary = tracer.summary()
+        self.assertEqual(sorted(summary), ["rev-list", "rev-parse"])
+        self.assertEqual(summary["rev-parse"]["count"], 4)
+        self.assertEqual(summary["rev-parse"]["failed"], 1)
+        self.assertEqual(summary["rev-list"]["count"], 1)
+        self.assertTrue(summary["rev-parse"]["max"] <=
+                        summary["rev-parse"]["total"])
+        self.assertEqual(tracer.records[2]["args"],
+                         ["git", "rev-parse", "--verify", "missing"])
+        self.assertEqual(tracer.records[2]["status"], 128)
+
+        path = os.path.join(self.path, "trace.json")
+        tracer.write(path)
+        with open(path) as f:
+            trace = json.load(f)
+        self.assertEqual(len(trace["commands"]), 5)
+        self.assertEqual(trace["summary"]["rev-list"]["count"], 1)
+
+    def test_disabled(self):
+        with instrument.tracing(stream=self.stream) as tracer:
+            self.run_commands()
+        self.assertEqual(tracer, None)
+        self.assertEqual(self.stream.getvalue(), "")
+
+    def test_environment(self):
+        path = os.path.join(self.path, "trace.json")
+        os.environ["DEVFLOW_TRACE"] = path
+        try:
+            with instrument.tracing(stream=self.stream):
+                self.run_commands()
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        self.assertEqual(gitbackend._hooks, [])  # pylint: disable=W0212
+        with open(path) as f:
+            self.assertEqual(len(json.load(f)["commands"]), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+#
+#
+
+"""Unit Tests for devflow.refs"""
+
+import os
+import subprocess
+import unittest
+
+from devflow import gitbackend, refs
+from test_utils import TemporaryRepositoryTestCase
+
+
+class TestRefTransaction(TemporaryRepositoryTestCase):
+    def setUp(self):
+        super(TestRefTransaction, self).setUp()
+        self.first = self.commit()
+        self.second = self.commit()
+
+    def ref(self, name):
+        return self.repo.git.rev_parse("--verify", "--quiet", name,
+                                       with_exceptions=False)
+
+    def test_create_and_delete(self):
+        with refs.RefTransaction(self.repo) as transaction:
+            transaction.create_branch("feature", "HEAD~1")
+            transaction.create_tag("v1", "master")
+            self.assertEqual(len(transaction), 2)
+            # Nothing is applied before the transaction is committed
+            self.assertEqual(self.ref("refs/heads/feature"), "")
+        self.assertEqual(self.ref("refs/heads/feature"), self.first.hexsha)
+        self.assertEqual(self.ref("refs/tags/v1"), self.second.hexsha)
+
+        with refs.RefTransaction(self.repo) as transaction:
+            transaction.delete_branch("feature")
+            transaction.delete_tag("v1")
+        self.assertEqual(self.ref("refs/heads/feature"), "")
+        self.assertEqual(self.ref("refs/tags/v1"), "")
+
+    def test_all_or_nothing(self):
+        self.repo.git.tag("v1")
+        transaction = refs.RefTransaction(self.repo)
+        transaction.create_branch("feature", "HEAD")
+        transaction.create_tag("v1", "HEAD~1")
+        self.assertRaises(subprocess.CalledProcessError, transaction.commit)
+        self.assertEqual(self.ref("refs/heads/feature"), "")
+        self.assertEqual(self.ref("refs/tags/v1"), self.second.hexsha)
+
+    def test_invalid_updates(self):
+        transaction = refs.RefTransaction(self.repo)
+        self.assertRaises(ValueError, transaction.create_branch, "feature",
+                          "no-such-branch")
+        transaction.create_branch("feature", "HEAD")
+        self.assertRaises(ValueError, transaction.create_branch, "feature",
+                          "HEAD~1")
+
+    def test_annotated_tag(self):
+        with refs.RefTransaction(self.repo) as transaction:
+            transaction.create_tag("v1", "HEAD~1", "Release version 1")
+        self.assertEqual(self.repo.git.cat_file("-t", "v1"), "tag")
+        self.assertEqual(self.ref("v1^{commit}"), self.first.hexsha)
+        tag = self.repo.tags["v1"].tag
+        self.assertEqual(tag.message, "Release version 1")
+        self.assertEqual(tag.tagger.email, "tester@example.com")
+
+
+class TestRefSnapshot(TemporaryRepositoryTestCase):
+    def test_restore(self):
+        first = self.commit()
+        self.repo.git.checkout("-b", "develop")
+        second = self.commit()
+        self.repo.git.tag("-a", "-m", "Version 1", "v1", first.hexsha)
+        self.repo.git.branch("obsolete")
+        tag = self.repo.git.rev_parse("v1")
+        snapshot = refs.RefSnapshot(self.repo)
+
+        # Create, update and delete refs, and move away from 'develop'
+        self.repo.git.checkout("-b", "release")
+        self.commit()
+        self.repo.git.tag("v2")
+        self.repo.git.tag("-d", "v1")
+        self.repo.git.branch("-D", "obsolete")
+        self.repo.git.branch("-f", "develop", "release")
+
+        self.assertEqual(snapshot.restore(work_tree=True), 5)
+        self.assertEqual(sorted(b.name for b in self.repo.branches),
+                         ["develop", "master", "obsolete"])
+        self.assertEqual(self.repo.git.rev_parse("develop"), second.hexsha)
+        self.assertEqual(self.repo.git.rev_parse("v1"), tag)
+        self.assertEqual([t.name for t in self.repo.tags], ["v1"])
+        self.assertEqual(self.repo.active_branch.name, "develop")
+        self.assertEqual(snapshot.restore(), 0)
+
+
+class TestMergeBranches(TemporaryRepositoryTestCase):
+    def setUp(self):
+        super(TestMergeBranches, self).setUp()
+        self.write("a", "a\n")
+        self.base = self.commit()
+        self.repo.git.checkout("-b", "release")
+        self.write("b", "b\n")
+        self.release = self.commit()
+        self.repo.git.checkout("master")
+
+    def write(self, name, content):
+        with open(os.path.join(self.path, name), "w") as f:
+            f.write(content)
+        self.repo.git.add(name)
+
+    def test_merge(self):
+        self.repo.git.checkout("-b", "develop")
+        self.write("c", "c\n")
+        develop = self.commit()
+        self.repo.git.checkout("master")
+
+        head = refs.merge_branches(self.repo, "develop", "release")
+        self.assertEqual(self.repo.git.rev_parse("develop"), head)
+        merge = self.repo.commit(head)
+        self.assertEqual([p.hexsha for p in merge.parents],
+                         [develop.hexsha, self.release.hexsha])
+        self.assertEqual(merge.message,
+                         "Merge branch 'release' into develop\n")
+        self.assertEqual(sorted(b.path for b in merge.tree.blobs),
+                         ["a", "b", "c"])
+        # The work tree and the checked out branch are not touched
+        self.assertEqual(self.repo.active_branch.name, "master")
+        self.assertFalse(os.path.exists(os.path.join(self.path, "b")))
+        self.assertFalse(self.repo.is_dirty())
+
+        # Merging again is a no-op
+        self.assertEqual(refs.merge_branches(self.repo, "develop", "release"),
+                         head)
+
+    def test_no_fast_forward(self):
+        self.repo.git.branch("develop")
+        head = refs.merge_branches(self.repo, "develop", "release")
+        self.assertEqual(len(self.repo.commit(head).parents), 2)
+
+    def test_conflict(self):
+        self.repo.git.checkout("-b", "develop")
+        self.write("b", "conflict\n")
+        develop = self.commit()
+        self.repo.git.checkout("master")
+        self.assertEqual(refs.merge_branches(self.repo, "develop", "release"),
+                         None)
+        self.assertEqual(self.repo.git.rev_parse("develop"), develop.hexsha)
+
+    def test_merge_commit(self):
+        self.repo.git.checkout("-b", "develop")
+        self.write("c", "c\n")
+        develop = self.commit()
+        commands = []
+
+        def hook(args, wall, status):  # pylint: disable=W0613
+            commands.append(args[1])
+        gitbackend.add_hook(hook)
+        try:
+            commit = refs.merge_commit(self.repo, develop.hexsha,
+                                       self.release.hexsha, "Merge")
+        finally:
+            gitbackend.remove_hook(hook)
+        self.assertTrue("merge-tree" in commands)
+        self.assertEqual(self.repo.git.rev_parse("develop"), develop.hexsha)
+        self.assertEqual(self.repo.commit(commit).message, "Merge\n")
+        # Fast-forward
+        self.assertEqual(refs.merge_commit(self.repo, self.base.hexsha,
+                                           self.release.hexsha, "Merge",
+                                           fast_forward=True),
+                         self.release.hexsha)
+
+    def test_signed_merge(self):
+        self.repo.git.checkout("-b", "develop")
+        self.write("c", "c\n")
+        self.commit()
+        self.repo.git.checkout("master")
+        gpg = os.path.join(self.path, ".git", "fake-gpg")
+        with open(gpg, "w") as f:
+            f.write("#!/bin/sh\n"
+                    "cat > /dev/null\n"
+                    "echo '[GNUPG:] SIG_CREATED ' >&2\n"
+                    "printf -- '-----BEGIN PGP SIGNATURE-----\\n\\n"
+                    "fake\\n-----END PGP SIGNATURE-----\\n'\n")
+        os.chmod(gpg, 0o755)
+        self.repo.git.config("gpg.program", gpg)
+        self.repo.git.config("user.signingKey", "tester@example.com")
+        self.repo.git.config("commit.gpgSign", "true")
+
+        head = self.repo.git.rev_parse("develop")
+        unsigned = refs.merge_commit(self.repo, head, self.release.hexsha,
+                                     "Merge", sign=False)
+        self.assertFalse("gpgsig" in self.repo.git.cat_file("commit",
+                                                            unsigned))
+        head = refs.merge_branches(self.repo, "develop", "release")
+        self.assertTrue("gpgsig" in self.repo.git.cat_file("commit", head))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+#
+#
+
+"""Unit Tests for devflow.utils
+
+Provides unit tests for module devflow.utils, using temporary git
+repositories.
+
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import git
+
+from devflow import utils
+from devflow import gitbackend
+
+
+class TemporaryRepositoryTestCase(unittest.TestCase):
+    """Base class for tests that need a scratch git repository."""
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix="devflow-test-")
+        self.repo = git.Repo.init(self.path)
+        writer = self.repo.config_writer()
+        writer.set_value("user", "name", "Devflow Tester")
+        writer.set_value("user", "email", "tester@example.com")
+        writer.release()
+
+    def tearDown(self):
+        gitbackend.close_backends()
+        shutil.rmtree(self.path)
+
+    def commit(self, message=None):
+        if message is None:
+            # Use unique messages, since commits created in the same second
+            # on different branches would be identical otherwise.
+            self.commits = getattr(self, "commits", 0) + 1
+            message = "commit %d" % self.commits
+        self.repo.git.commit("--allow-empty", m=message)
+        return self.repo.head.commit
+
+    def merge(self, branch):
+        self.repo.git.merge("--no-ff", "-m", "Merge %s" % branch, branch)
+        return self.repo.head.commit
+
+    def revno(self, commit):
+        return utils.get_revision_number(self.repo, commit.hexsha)
+
+    def rev_list_count(self, rev="HEAD"):
+        return int(self.repo.git.rev_list("--count", rev))
+
+
+class TestRevisionNumber(TemporaryRepositoryTestCase):
+    def test_linear_history(self):
+        for i in range(5):
+            commit = self.commit()
+            self.assertEqual(self.revno(commit), i + 1)
+        cache_file = os.path.join(self.repo.git_dir, utils.REVNO_CACHE_FILE)
+        self.assertTrue(os.path.isfile(cache_file))
+
+    def test_merges(self):
+        self.commit()
+        self.repo.git.checkout("-b", "feature")
+        for _ in range(3):
+            self.commit()
+        self.repo.git.checkout("master")
+        commit = self.commit()
+        self.assertEqual(self.revno(commit),
+                         self.rev_list_count())
+        commit = self.merge("feature")
+        self.assertEqual(self.revno(commit),
+                         self.rev_list_count())
+        commit = self.commit()
+        self.assertEqual(self.revno(commit),
+                         self.rev_list_count())
+
+    def test_cold_cache(self):
+        for _ in range(5):
+            commit = self.commit()
+        backend = gitbackend.get_backend(self.repo)
+        read = []
+        read_commit = backend.read_commit
+        backend.read_commit = lambda rev: read.append(rev) or read_commit(rev)
+        try:
+            self.assertEqual(self.revno(commit), 5)
+        finally:
+            del backend.read_commit
+        # With nothing cached, the history is not walked
+        self.assertEqual(len(read), 1)
+
+    def test_corrupted_cache(self):
+        commit = self.commit()
+        cache_file = os.path.join(self.repo.git_dir, utils.REVNO_CACHE_FILE)
+        with open(cache_file, "w") as f:
+            f.write("garbage\n%s" % commit.hexsha)
+        commit = self.commit()
+        self.assertEqual(self.revno(commit), 2)
+
+
+class TestVcsInfo(TemporaryRepositoryTestCase):
+    def setUp(self):
+        super(TestVcsInfo, self).setUp()
+        self.cwd = os.getcwd()
+        os.chdir(self.path)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        super(TestVcsInfo, self).tearDown()
+
+    def test_vcs_info(self):
+        self.commit()
+        commit = self.commit()
+        v = utils.get_vcs_info()
+        self.assertEqual(v.branch, "master")
+        self.assertEqual(v.revid, commit.hexsha[:7])
+        self.assertEqual(v.revno, 2)
+        self.assertEqual(os.path.realpath(v.toplevel),
+                         os.path.realpath(self.path))
+        self.assertEqual(v.name, "Devflow Tester")
+        self.assertEqual(v.email, "tester@example.com")
+
+    def test_debian_merge_revid(self):
+        self.commit()
+        self.repo.git.checkout("-b", "debian-develop")
+        debian = self.commit()
+        self.repo.git.checkout("master")
+        self.repo.git.checkout("-b", "develop")
+        upstream = self.commit()
+        self.repo.git.checkout("debian-develop")
+        self.merge("develop")
+        v = utils.get_vcs_info()
+        self.assertEqual(v.branch, "debian-develop")
+        self.assertEqual(v.revid,
+                         debian.hexsha[:7] + "_" + upstream.hexsha[:7])
+        self.assertEqual(v.revno, 4)
+
+
+class TestDistributionCodename(unittest.TestCase):
+    def setUp(self):
+        self.environ = dict(os.environ)
+        os.environ.pop("DEVFLOW_CODENAME", None)
+        utils._distribution_codename = None
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        utils._distribution_codename = None
+
+    def test_override(self):
+        os.environ["DEVFLOW_CODENAME"] = "jessie"
+        self.assertEqual(utils.get_distribution_codename(), "jessie")
+
+    def test_memoized(self):
+        codename = utils.get_distribution_codename()
+        self.assertTrue(codename)
+        self.assertEqual(utils._distribution_codename, codename)
+        utils._distribution_codename = "wheezy"
+        self.assertEqual(utils.get_distribution_codename(), "wheezy")
+
+    def test_read_release_file(self):
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as f:
+            f.write('# comment\n'
+                    'PRETTY_NAME="Debian GNU/Linux 8 (jessie)"\n'
+                    'VERSION_CODENAME=jessie\n'
+                    "ID='debian'\n")
+        try:
+            info = utils.read_release_file(path)
+        finally:
+            os.unlink(path)
+        self.assertEqual(info["VERSION_CODENAME"], "jessie")
+        self.assertEqual(info["PRETTY_NAME"], "Debian GNU/Linux 8 (jessie)")
+        self.assertEqual(info["ID"], "debian")
+        self.assertEqual(utils.read_release_file("/nonexistent"), {})
+
+
+class TestWriteFileIfChanged(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix="devflow-test-")
+        self.filename = os.path.join(self.path, "version.py")
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_write(self):
+        self.assertTrue(utils.write_file_if_changed(self.filename, "a\n"))
+        with open(self.filename) as f:
+            self.assertEqual(f.read(), "a\n")
+        self.assertEqual(os.stat(self.filename).st_mode & 0o777,
+                         0o666 & ~utils.UMASK)
+        os.chmod(self.filename, 0o640)
+        self.assertTrue(utils.write_file_if_changed(self.filename, "b\n"))
+        with open(self.filename) as f:
+            self.assertEqual(f.read(), "b\n")
+        self.assertEqual(os.stat(self.filename).st_mode & 0o777, 0o640)
+        self.assertEqual(os.listdir(self.path), ["version.py"])
+
+    def test_unchanged(self):
+        utils.write_file_if_changed(self.filename, "a\n")
+        os.utime(self.filename, (1, 1))
+        self.assertFalse(utils.write_file_if_changed(self.filename, "a\n"))
+        self.assertEqual(os.stat(self.filename).st_mtime, 1)
+
+    def test_prepend(self):
+        utils.prepend_file(self.filename, "b\n")
+        with open(self.filename) as f:
+            self.assertEqual(f.read(), "b\n")
+        os.chmod(self.filename, 0o640)
+        utils.prepend_file(self.filename, "a\n")
+        with open(self.filename) as f:
+            self.assertEqual(f.read(), "a\nb\n")
+        self.assertEqual(os.stat(self.filename).st_mode & 0o777, 0o640)
+        self.assertEqual(os.listdir(self.path), ["version.py"])
+
+
+if __name__ == '__main__':
+    unittest.main()
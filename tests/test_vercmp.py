@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+#
+#
+
+"""Unit Tests for devflow.vercmp
+
+Checks the Debian ordering against dpkg and the PEP 440 ordering against
+setuptools, on large generated sets of versions.
+
+"""
+
+import random
+import subprocess
+import unittest
+from distutils.spawn import find_executable
+from pkg_resources import parse_version
+
+from devflow import vercmp
+
+
+def random_debian_version(rand):
+    def part(first, chars, maxlen):
+        return rand.choice(first) + "".join(rand.choice(chars) for _ in
+                                            range(rand.randint(0, maxlen)))
+    version = part("0123456789", "0123456789.+~ab", 6)
+    if rand.random() < 0.5:
+        version += "-" + part("0129ab", "0129.+~ab", 4)
+    if rand.random() < 0.2:
+        version = "%d:%s" % (rand.randint(0, 2), version)
+    return version
+
+
+def random_python_version(rand):
+    version = ".".join(str(rand.randint(0, 3))
+                       for _ in range(rand.randint(1, 3)))
+    if rand.random() < 0.3:
+        version += rand.choice(["a", "b", "rc"]) + str(rand.randint(0, 2))
+    if rand.random() < 0.2:
+        version += ".post%d" % rand.randint(0, 2)
+    if rand.random() < 0.4:
+        version += ".dev%d" % rand.randint(0, 2)
+    if rand.random() < 0.2:
+        version += "+" + rand.choice(["df", "1", "df.2", "abc.3"])
+    return version
+
+
+def dpkg_compare_all(triples):
+    """Check a list of (a, op, b) triples with a single shell process."""
+    script = "".join("dpkg --compare-versions '%s' %s '%s' && echo 1 ||"
+                     " echo 0\n" % t for t in triples)
+    proc = subprocess.Popen(["sh"], stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE)
+    out, _ = proc.communicate(script)
+    return [line == "1" for line in out.splitlines()]
+
+
+class TestDebianOrdering(unittest.TestCase):
+    def test_known_orderings(self):
+        orderings = [
+            ("1.0~rc1", "1.0"),
+            ("1.0", "1.0+b1"),
+            ("1.0", "1.0.0"),
+            ("1.0", "1.0a"),
+            ("1.0a", "1.0+"),
+            ("1.0~~", "1.0~"),
+            ("1.0~", "1.0"),
+            ("0~", "0"),
+            ("1.9", "1.10"),
+            ("1.0-1", "1.0-2"),
+            ("1.0-9", "1.0-10"),
+            ("1.0-1~bpo1", "1.0-1"),
+            ("9.9-1", "1:0.1-1"),
+            ("0.14~dev4+df.1f14d32-1~jessie", "0.14~rc1-1~jessie"),
+            ("0.14~rc1-1~jessie", "0.14-1~jessie"),
+        ]
+        for a, b in orderings:
+            self.assertEqual(vercmp.compare_versions(a, b), -1,
+                             "%s < %s" % (a, b))
+            self.assertEqual(vercmp.compare_versions(b, a), 1,
+                             "%s > %s" % (b, a))
+        for a, b in [("1.0", "1.0-0"), ("1.0", "0:1.0"), ("1.", "1.0"),
+                     ("1.007", "1.7")]:
+            self.assertEqual(vercmp.compare_versions(a, b), 0,
+                             "%s == %s" % (a, b))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, vercmp.debian_key, "x:1.0")
+        self.assertRaises(ValueError, vercmp.debian_key, "-1")
+
+    @unittest.skipUnless(find_executable("dpkg"), "dpkg is not available")
+    def test_against_dpkg(self):
+        rand = random.Random(440)
+        versions = [random_debian_version(rand) for _ in range(1500)]
+        ordered = vercmp.sort_versions(versions)
+        triples = []
+        for a, b in zip(ordered, ordered[1:]):
+            op = "eq" if vercmp.compare_versions(a, b) == 0 else "lt"
+            triples.append((a, op, b))
+        for _ in range(500):
+            a, b = rand.choice(versions), rand.choice(versions)
+            op = {-1: "lt", 0: "eq", 1: "gt"}[vercmp.compare_versions(a, b)]
+            triples.append((a, op, b))
+        results = dpkg_compare_all(triples)
+        self.assertEqual(len(results), len(triples))
+        failed = [t for t, ok in zip(triples, results) if not ok]
+        self.assertEqual(failed, [])
+        self.assertEqual(vercmp.max_version(versions), ordered[-1])
+
+
+class TestPythonOrdering(unittest.TestCase):
+    def test_known_orderings(self):
+        ordered = ["0.14.dev1", "0.14a1", "0.14b2.dev3", "0.14b2",
+                   "0.14rc1.dev10", "0.14rc1", "0.14", "0.14+df.1",
+                   "0.14.post1.dev1", "0.14.post1", "0.14.1", "1!0.1"]
+        self.assertEqual(vercmp.sort_versions(reversed(ordered),
+                                              scheme="python"), ordered)
+        self.assertEqual(vercmp.compare_versions("0.14", "0.14.0",
+                                                 scheme="python"), 0)
+        self.assertEqual(vercmp.compare_versions("0.14c1", "0.14rc1",
+                                                 scheme="python"), 0)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, vercmp.python_key, "0.14next")
+        self.assertRaises(ValueError, vercmp.sort_versions, ["1"],
+                          scheme="rpm")
+
+    def test_against_setuptools(self):
+        rand = random.Random(440)
+        versions = [random_python_version(rand) for _ in range(2000)]
+        expected = [str(v) for v in sorted(parse_version(v)
+                                           for v in versions)]
+        ordered = vercmp.sort_versions(versions, scheme="python")
+        self.assertEqual([str(parse_version(v)) for v in ordered], expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+#
+#
+
+"""Unit Tests for devflow.versiond"""
+
+import os
+import sys
+import time
+import socket
+import threading
+import unittest
+from StringIO import StringIO
+
+from devflow import versiond
+from test_utils import TemporaryRepositoryTestCase
+
+
+class TestVersionDaemon(TemporaryRepositoryTestCase):
+    def setUp(self):
+        super(TestVersionDaemon, self).setUp()
+        with open(os.path.join(self.path, "version"), "w") as f:
+            f.write("0.15dev\n")
+        self.repo.git.add("version")
+        self.commit()
+        self.repo.git.checkout("-b", "develop")
+        self.commit()
+        self.socket_path = os.path.join(self.repo.git_dir,
+                                        versiond.SOCKET_NAME)
+        state = versiond.VersionState(self.path, self.repo.git_dir)
+        self.server = threading.Thread(target=versiond.serve,
+                                       args=(self.socket_path, state, 30))
+        self.server.start()
+        # The socket exists before the daemon listens on it
+        while True:
+            try:
+                self.query("ping")
+                break
+            except socket.error:
+                time.sleep(0.01)
+
+    def tearDown(self):
+        versiond.query("shutdown", socket_path=self.socket_path)
+        self.server.join()
+        super(TestVersionDaemon, self).tearDown()
+
+    def query(self, command, mode=None, codename=None):
+        return versiond.query(command, mode, codename,
+                              socket_path=self.socket_path)
+
+    def test_queries(self):
+        commit = self.commit()
+        expected = "0.15.dev3+df.%s" % commit.hexsha[:7]
+        self.assertEqual(self.query("python"), expected)
+        self.assertEqual(self.query("python", "snapshot"), expected)
+        self.assertTrue(self.query("debian").startswith(
+            "0.15~dev3+df.%s-1~" % commit.hexsha[:7]))
+        self.assertRaises(RuntimeError, self.query, "python", "release")
+        self.assertRaises(RuntimeError, self.query, "unknown")
+
+    def test_client_environment(self):
+        commit = self.commit()
+        prefix = "0.15~dev3+df.%s-1~" % commit.hexsha[:7]
+        self.assertEqual(self.query("debian", codename="jessie"),
+                         prefix + "jessie")
+        self.assertEqual(self.query("debian", codename="2xenial"),
+                         prefix + "2xenial")
+        # The environment of the daemon does not affect the answers
+        environ = dict(os.environ)
+        try:
+            os.environ["DEVFLOW_BUILD_MODE"] = "release"
+            os.environ["DEVFLOW_CODENAME"] = "wheezy"
+            self.assertEqual(self.query("python"),
+                             "0.15.dev3+df.%s" % commit.hexsha[:7])
+            self.assertFalse(self.query("debian").endswith("~wheezy"))
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+
+    def test_invalidation(self):
+        self.assertTrue(self.query("python").startswith("0.15.dev2+"))
+        commit = self.commit()
+        self.assertEqual(self.query("python"),
+                         "0.15.dev3+df.%s" % commit.hexsha[:7])
+        with open(os.path.join(self.path, "version"), "w") as f:
+            f.write("0.16dev\n")
+        self.assertEqual(self.query("python"),
+                         "0.16.dev3+df.%s" % commit.hexsha[:7])
+
+    def test_find_git_dir(self):
+        subdir = os.path.join(self.path, "a", "b")
+        os.makedirs(subdir)
+        self.assertEqual(os.path.realpath(versiond.find_git_dir(subdir)),
+                         os.path.realpath(self.repo.git_dir))
+
+
+class TestVersionClient(TemporaryRepositoryTestCase):
+    def setUp(self):
+        super(TestVersionClient, self).setUp()
+        with open(os.path.join(self.path, "version"), "w") as f:
+            f.write("0.15dev\n")
+        self.repo.git.add("version")
+        self.commit()
+        self.repo.git.checkout("-b", "develop")
+        self.commit()
+        self.cwd = os.getcwd()
+        self.argv = sys.argv
+        self.stdout = sys.stdout
+        self.environ = dict(os.environ)
+        os.chdir(self.path)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        sys.argv = self.argv
+        sys.stdout = self.stdout
+        os.environ.clear()
+        os.environ.update(self.environ)
+        super(TestVersionClient, self).tearDown()
+
+    def test_fallback(self):
+        # Too long for the path of a Unix socket
+        os.environ["DEVFLOW_VERSIOND_SOCKET"] = os.path.join(self.path,
+                                                             "s" * 200)
+        os.environ.pop("DEVFLOW_BUILD_MODE", None)
+        sys.argv = ["devflow-versionc", "python"]
+        sys.stdout = StringIO()
+        self.assertEqual(versiond.client_main(), 0)
+        self.assertEqual(sys.stdout.getvalue(), "0.15.dev2+df.%s\n"
+                         % self.repo.head.commit.hexsha[:7])
+
+    def test_fallback_codename(self):
+        os.environ["DEVFLOW_VERSIOND_SOCKET"] = os.path.join(self.path,
+                                                             "s" * 200)
+        os.environ["DEVFLOW_CODENAME"] = "jessie"
+        sys.argv = ["devflow-versionc", "debian"]
+        sys.stdout = StringIO()
+        self.assertEqual(versiond.client_main(), 0)
+        self.assertTrue(sys.stdout.getvalue().endswith("-1~jessie\n"))
+
+
+if __name__ == '__main__':
+    unittest.main()
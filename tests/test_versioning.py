@@ -43,30 +43,35 @@ for automatic generation of version strings.
 """
 
 import os
+import sys
+import operator
 import unittest
+from StringIO import StringIO
+from distutils import log  # pylint: disable=E0611
 from pkg_resources import parse_version
+from devflow import utils, versioning
 from devflow.versioning import debian_version_from_python_version
+from devflow.vercmp import debian_key
+from test_utils import TemporaryRepositoryTestCase
 
 
 class DebianVersionObject(object):
     """Object representing a Debian Version."""
     def __init__(self, pyver):
         self.version = debian_version_from_python_version(pyver)
+        self.key = debian_key(self.version)
 
     def __str__(self):
         return self.version
 
-
-def debian_compare_versions(a, op, b):
-    i = os.system("dpkg --compare-versions %s %s %s" % (a, op, b))
-    return i == 0
-
-# Set ordering between DebianVersionObject objects, by adding
-# debian_compare_versions
+# Set ordering between DebianVersionObject objects, by comparing their
+# pre-parsed keys
 for op in ["lt", "le", "eq", "ne", "gt", "ge"]:
     def gen(op):
+        key_op = getattr(operator, op)
+
         def operator_func(self, other):
-            return debian_compare_versions(self.version, op, other.version)
+            return key_op(self.key, other.key)
         return operator_func
     setattr(DebianVersionObject, "__%s__" % op, gen(op))
 
@@ -129,17 +134,131 @@ class TestVersionFunctions(unittest.TestCase):
                                  " is not True" % (a, op, b))
 
 
+class TestDebianRevision(TemporaryRepositoryTestCase):
+    def test_revision_index(self):
+        self.commit()
+        for tag in ["debian/0.14-1jessie", "debian/0.14-2jessie",
+                    "debian/0.14-4jessie", "debian/0.14-1wheezy",
+                    "debian/0.14dev1+df.abc-1jessie", "debian/0.14-01sid",
+                    "debian/other"]:
+            self.repo.git.tag(tag)
+        index = versioning.DebianTagIndex(self.repo)
+        self.assertEqual(index.next_revision("0.14", "jessie"), 3)
+        self.assertEqual(index.next_revision("0.14", "wheezy"), 2)
+        self.assertEqual(index.next_revision("0.14", "sid"), 1)
+        self.assertEqual(index.next_revision("0.14dev1+df.abc", "jessie"), 2)
+        self.assertEqual(index.next_revision("0.15", "jessie"), 1)
+        self.assertEqual(versioning.get_revision("0.14", "jessie", index), 3)
+        self.assertEqual(versioning.get_revision("0.14~dev1+df.abc",
+                                                 "jessie", index), 2)
+
+    def test_revision_index_numeric_codename(self):
+        self.commit()
+        for tag in ["debian/1.0-12xenial", "debian/1.0-1xenial"]:
+            self.repo.git.tag(tag)
+        index = versioning.DebianTagIndex(self.repo)
+        # 'debian/1.0-12xenial' is the first revision for '2xenial'
+        self.assertEqual(index.next_revision("1.0", "2xenial"), 2)
+        self.assertEqual(index.next_revision("1.0", "xenial"), 2)
+        self.assertEqual(index.next_revision("1.0", "3xenial"), 1)
+
+
+class TestRangeVersions(TemporaryRepositoryTestCase):
+    def test_range_revision_numbers(self):
+        self.commit()
+        base = self.commit()
+        self.repo.git.checkout("-b", "feature")
+        self.commit()
+        self.commit()
+        self.repo.git.checkout("master")
+        self.commit()
+        self.merge("feature")
+        self.commit()
+        infos = list(versioning.iter_range_vcs_info(
+            "%s..master" % base.hexsha, branch="develop", repo=self.repo))
+        self.assertEqual(len(infos), 5)
+        for info in infos:
+            sha = info.commit.hexsha
+            self.assertEqual(info.revno, self.rev_list_count(sha))
+            self.assertEqual(info.revid, sha[:7])
+            self.assertEqual(info.branch, "develop")
+
+
+class TestUpdateVersion(TemporaryRepositoryTestCase):
+    def setUp(self):
+        super(TestUpdateVersion, self).setUp()
+        files = {
+            "version": "0.15dev\n",
+            "template": "VERSION = '%(DEVFLOW_VERSION)s'\n",
+            "devflow.conf": "[ packages ]\n"
+                            "  [[ a ]]\n"
+                            "    version_file = a.py, b.py\n"
+                            "    version_template = template, template\n"
+                            "  [[ b ]]\n"
+                            "    version_file = c.py\n"
+                            "  [[ c ]]\n"
+                            "    version_file = d.py\n"
+                            "    version_template = template\n"}
+        for name, content in files.items():
+            with open(os.path.join(self.path, name), "w") as f:
+                f.write(content)
+        self.repo.git.add(*files.keys())
+        self.commit()
+        self.repo.git.checkout("-b", "develop")
+        self.commit()
+
+    def read(self, name):
+        with open(os.path.join(self.path, name)) as f:
+            return f.read()
+
+    def test_update_version(self):
+        v = utils.VCSInfo(self.repo)
+        summary = versioning.update_version(v, mode="snapshot", jobs=2)
+        self.assertEqual(summary["rendered"], 2)
+        self.assertEqual(summary["written"], 4)
+        self.assertEqual(summary["skipped"], 0)
+        expected = "VERSION = '0.15.dev2+df.%s'\n" % v.revid
+        for name in ["a.py", "b.py", "d.py"]:
+            self.assertEqual(self.read(name), expected)
+        self.assertTrue("'revno': 2}" in self.read("c.py"))
+
+        os.unlink(os.path.join(self.path, "b.py"))
+        summary = versioning.update_version(v, mode="snapshot")
+        self.assertEqual(summary["written"], 1)
+        self.assertEqual(summary["skipped"], 3)
+        self.assertEqual(self.read("b.py"), expected)
+
+    def test_update_version_main(self):
+        os.environ["DEVFLOW_BUILD_MODE"] = "snapshot"
+        cwd = os.getcwd()
+        stdout = sys.stdout
+        threshold = log.set_threshold(log.INFO)
+        os.chdir(self.path)
+        sys.stdout = StringIO()
+        try:
+            versioning.update_version_main()
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+            log.set_threshold(threshold)
+            os.chdir(cwd)
+            os.environ.pop("DEVFLOW_BUILD_MODE")
+        self.assertEqual(output.count("Version files: 2 templates rendered,"
+                                      " 4 files written"), 1)
+
+
 def compare(function, a, op, b):
     import operator
     str_to_op = {"<": operator.lt,
-            "<=": operator.le,
-            "==": operator.eq,
-            ">": operator.gt,
-            ">=": operator.ge}
+                 "<=": operator.le,
+                 "==": operator.eq,
+                 ">": operator.gt,
+                 ">=": operator.ge}
     try:
         return str_to_op[op](function(a), function(b))
     except KeyError:
         raise ValueError("Unknown operator '%s'" % op)
 
+
 if __name__ == '__main__':
     unittest.main()